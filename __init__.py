@@ -1,7 +1,6 @@
 """Dyson Python library."""
 
 from .const import (
-    DEVICE_TYPE_360_EYE,
     DEVICE_TYPE_PURE_COOL,
     DEVICE_TYPE_PURE_COOL_DESK,
     DEVICE_TYPE_PURE_COOL_LINK,
@@ -25,8 +24,7 @@ from .const import (
 
 def get_device(serial: str, credential: str, device_type: str) -> Optional[DysonDevice]:
     """Get a new DysonDevice instance."""
-    if device_type == DEVICE_TYPE_360_EYE:
-        return Dyson360Eye(serial, credential)
+    #the 360 Eye is created by the plugin, see plugin.startDevice and dyson_360_eye.py
     if device_type in [
         DEVICE_TYPE_PURE_COOL_LINK_DESK,
         DEVICE_TYPE_PURE_COOL_LINK,
@@ -0,0 +1,147 @@
+"""Threshold alerts on the decoded state and sensor fields
+
+A rule watches one field, e.g. {"name": "Dust", "when": "particulate_matter_25 > 35"}.
+Optional keys:
+    for       seconds the condition must hold before the alert fires
+    clear     threshold to drop below (or rise above) before the alert clears,
+              defaults to the trigger threshold (no hysteresis)
+    cooldown  seconds after clearing before the alert can fire again
+    level     Domoticz alert level 1-4 (default 3)
+
+Besides the comparisons (> >= < <= == !=) the operator 'rises' fires when
+a field jumps by at least the value between two samples, e.g. "volatile_compounds rises 3".
+
+Rules are compiled once into predicates and indexed by field, so a message
+only evaluates the rules of the fields that changed. Rules waiting for their
+'for' duration are checked by check_pending from the heartbeat.
+"""
+
+import operator
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+#operator of the clear threshold, the alert clears once this holds
+CLEAR_OPERATORS = {
+    '>': operator.le,
+    '>=': operator.lt,
+    '<': operator.ge,
+    '<=': operator.gt,
+}
+
+INACTIVE, PENDING, ACTIVE = 'inactive', 'pending', 'active'
+
+class AlertRuleError(ValueError):
+    """A rule of the settings can not be compiled"""
+    pass
+
+def _threshold(text):
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def _numeric(test):
+    """wrap a comparison so a value of another type (e.g. 'INIT', 'OFF') never matches"""
+    def numeric_test(value, threshold):
+        try:
+            return test(float(value), threshold)
+        except (TypeError, ValueError):
+            return False
+    return numeric_test
+
+class AlertRule(object):
+    """Compiled rule with its hysteresis state"""
+
+    def __init__(self, raw):
+        try:
+            self.name = raw['name']
+            field, op, threshold = raw['when'].split(None, 2)
+        except (KeyError, TypeError, AttributeError, ValueError):
+            raise AlertRuleError("Alert rule '{0}' needs a name and a 'when' like 'field > value'".format(raw))
+        self.field = field
+        self.hold = float(raw.get('for', 0))
+        self.cooldown = float(raw.get('cooldown', 0))
+        self.level = int(raw.get('level', 3))
+        threshold = _threshold(threshold)
+        if op == 'rises':
+            if not isinstance(threshold, float):
+                raise AlertRuleError("Alert rule '{0}': 'rises' needs a number".format(self.name))
+            self.trigger = lambda value, previous: (isinstance(value, (int, float)) and isinstance(previous, (int, float))
+                                                    and value - previous >= threshold)
+            #a jump is a single event, it clears on the next sample that is no jump
+            self.clears = lambda value, previous: not self.trigger(value, previous)
+        elif op in OPERATORS:
+            compare = OPERATORS[op] if isinstance(threshold, str) else _numeric(OPERATORS[op])
+            self.trigger = lambda value, previous: compare(value, threshold)
+            clear_threshold = _threshold(str(raw['clear'])) if 'clear' in raw else None
+            if clear_threshold is not None and op in CLEAR_OPERATORS and isinstance(clear_threshold, float):
+                clear_compare = _numeric(CLEAR_OPERATORS[op])
+                self.clears = lambda value, previous: clear_compare(value, clear_threshold)
+            else:
+                self.clears = lambda value, previous: not compare(value, threshold)
+        else:
+            raise AlertRuleError("Alert rule '{0}': unknown operator '{1}'".format(self.name, op))
+        self.state = INACTIVE
+        self.since = None
+        self.cleared_at = None
+        self.value = None
+
+    def __repr__(self):
+        return "AlertRule '{0}' on {1} ({2})".format(self.name, self.field, self.state)
+
+class AlertEngine(object):
+    """Evaluates the rules of the changed fields and reports alerts through notify(rule, active)"""
+
+    def __init__(self, rules, notify):
+        self.notify = notify
+        self.rules = [AlertRule(raw) for raw in rules]
+        self._by_field = {}
+        for rule in self.rules:
+            self._by_field.setdefault(rule.field, []).append(rule)
+        self._pending = set()
+
+    @property
+    def fields(self):
+        return set(self._by_field)
+
+    def active(self):
+        return [rule for rule in self.rules if rule.state == ACTIVE]
+
+    def evaluate(self, changes, previous, now):
+        """evaluate the rules of changes (as returned by changed_fields), previous holds the values before"""
+        previous = previous or {}
+        for field, value in changes.items():
+            for rule in self._by_field.get(field, ()):
+                rule.value = value
+                if rule.state == ACTIVE:
+                    if rule.clears(value, previous.get(field)):
+                        rule.state = INACTIVE
+                        rule.cleared_at = now
+                        self.notify(rule, False)
+                elif rule.trigger(value, previous.get(field)):
+                    if rule.state == INACTIVE:
+                        rule.state = PENDING
+                        rule.since = now
+                        self._pending.add(rule)
+                elif rule.state == PENDING:
+                    rule.state = INACTIVE
+                    self._pending.discard(rule)
+        self.check_pending(now)
+
+    def check_pending(self, now):
+        """fire the pending rules whose condition held long enough, to be called from the heartbeat too"""
+        for rule in list(self._pending):
+            if now - rule.since < rule.hold:
+                continue
+            if rule.cleared_at is not None and now - rule.cleared_at < rule.cooldown:
+                continue
+            self._pending.discard(rule)
+            rule.state = ACTIVE
+            self.notify(rule, True)
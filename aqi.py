@@ -0,0 +1,207 @@
+"""Air quality indexes derived from the particle sensors
+
+Samples are accumulated in hourly buckets of a rolling 24 hour window. Adding
+a sample only updates the running sums of the current bucket and of the
+window, the indexes are computed from the hourly averages (at most 12 or 24
+of them), so no raw sample is ever rescanned.
+
+US AQI: EPA NowCast over the last 12 hours of PM2.5 and PM10, converted with
+the EPA breakpoints (PM2.5 revision of 2024). The current, incomplete hour
+counts as the most recent hour.
+
+EU CAQI: Common Air Quality Index of the hourly (background) grid from the
+current hour averages, and of the daily grid from the 24 hour averages.
+
+The Dyson VOC and NO2 readings are indexes rather than concentrations, they
+are averaged over the same windows but not part of the US AQI or CAQI.
+"""
+
+import math
+
+#(concentration low, concentration high, index low, index high)
+PM25_AQI_BREAKPOINTS = [
+    (0.0, 9.0, 0, 50),
+    (9.1, 35.4, 51, 100),
+    (35.5, 55.4, 101, 150),
+    (55.5, 125.4, 151, 200),
+    (125.5, 225.4, 201, 300),
+    (225.5, 325.4, 301, 500),
+]
+PM10_AQI_BREAKPOINTS = [
+    (0, 54, 0, 50),
+    (55, 154, 51, 100),
+    (155, 254, 101, 150),
+    (255, 354, 151, 200),
+    (355, 424, 201, 300),
+    (425, 604, 301, 500),
+]
+
+#concentration at CAQI 0, 25, 50, 75 and 100
+CAQI_HOURLY_GRID = {
+    'pm25': (0, 15, 30, 55, 110),
+    'pm10': (0, 25, 50, 90, 180),
+}
+CAQI_DAILY_GRID = {
+    'pm25': (0, 10, 20, 30, 60),
+    'pm10': (0, 15, 30, 50, 100),
+}
+
+SECONDS_PER_HOUR = 3600
+
+class HourlyWindow(object):
+    """Rolling window of hourly averages with O(1) updates"""
+
+    def __init__(self, hours=24):
+        self.hours = hours
+        self.sums = [0.0] * hours
+        self.counts = [0] * hours
+        self.current_hour = None
+        self.window_sum = 0.0
+        self.window_count = 0
+
+    def _advance(self, hour):
+        if self.current_hour is None or hour - self.current_hour >= self.hours:
+            self.sums = [0.0] * self.hours
+            self.counts = [0] * self.hours
+            self.window_sum = 0.0
+            self.window_count = 0
+        else:
+            for skipped in range(self.current_hour + 1, hour + 1):
+                slot = skipped % self.hours
+                self.window_sum -= self.sums[slot]
+                self.window_count -= self.counts[slot]
+                self.sums[slot] = 0.0
+                self.counts[slot] = 0
+        self.current_hour = hour
+
+    def add(self, timestamp, value):
+        hour = int(timestamp // SECONDS_PER_HOUR)
+        if self.current_hour is not None and hour < self.current_hour:
+            #sample from before the window moved on
+            if self.current_hour - hour >= self.hours:
+                return
+        elif hour != self.current_hour:
+            self._advance(hour)
+        slot = hour % self.hours
+        self.sums[slot] += value
+        self.counts[slot] += 1
+        self.window_sum += value
+        self.window_count += 1
+
+    def hourly_averages(self, hours):
+        """averages of the most recent hours, newest first, None for hours without samples"""
+        averages = []
+        for age in range(min(hours, self.hours)):
+            slot = (self.current_hour - age) % self.hours
+            averages.append(self.sums[slot] / self.counts[slot] if self.counts[slot] else None)
+        return averages
+
+    def mean(self):
+        """average over the whole window"""
+        return self.window_sum / self.window_count if self.window_count else None
+
+    def to_dict(self):
+        return {'hours': self.hours, 'sums': list(self.sums), 'counts': list(self.counts), 'current_hour': self.current_hour}
+
+    @classmethod
+    def from_dict(cls, raw):
+        window = cls(raw['hours'])
+        window.sums = [float(value) for value in raw['sums']]
+        window.counts = [int(value) for value in raw['counts']]
+        window.current_hour = raw['current_hour']
+        window.window_sum = sum(window.sums)
+        window.window_count = sum(window.counts)
+        return window
+
+def nowcast(hourly, minimum_weight=0.5):
+    """EPA NowCast of hourly averages (newest first, None when missing)"""
+    hourly = list(hourly[:12])
+    if len([value for value in hourly[:3] if value is not None]) < 2:
+        return None
+    values = [value for value in hourly if value is not None]
+    highest = max(values)
+    weight = max(min(values) / highest, minimum_weight) if highest > 0 else 1.0
+    numerator = denominator = 0.0
+    for age, value in enumerate(hourly):
+        if value is not None:
+            numerator += weight ** age * value
+            denominator += weight ** age
+    return numerator / denominator
+
+def aqi_from_concentration(concentration, breakpoints, decimals):
+    """US AQI of a concentration, truncated to the resolution of the breakpoints"""
+    factor = 10 ** decimals
+    concentration = math.floor(concentration * factor) / factor
+    for concentration_low, concentration_high, index_low, index_high in breakpoints:
+        if concentration <= concentration_high:
+            concentration = max(concentration, concentration_low)
+            return int(round((index_high - index_low) / (concentration_high - concentration_low)
+                             * (concentration - concentration_low) + index_low))
+    return breakpoints[-1][3]
+
+def caqi_from_concentration(concentration, grid):
+    """CAQI sub-index of a concentration on a grid, extrapolated above 100"""
+    for band in range(1, len(grid)):
+        if concentration <= grid[band] or band == len(grid) - 1:
+            low, high = grid[band - 1], grid[band]
+            return int(round(25 * (band - 1) + 25.0 * (concentration - low) / (high - low)))
+
+class AirQualityEngine(object):
+    """Incremental US AQI (NowCast) and EU CAQI of one device"""
+
+    POLLUTANTS = ('pm25', 'pm10', 'voc', 'no2')
+
+    def __init__(self):
+        self.windows = {pollutant: HourlyWindow(24) for pollutant in self.POLLUTANTS}
+
+    def add(self, timestamp, pm25=None, pm10=None, voc=None, no2=None):
+        """add a sample, values that are None are not measured by the device"""
+        for pollutant, value in (('pm25', pm25), ('pm10', pm10), ('voc', voc), ('no2', no2)):
+            if value is not None:
+                self.windows[pollutant].add(timestamp, value)
+
+    def nowcast(self, pollutant):
+        if self.windows[pollutant].current_hour is None:
+            return None
+        return nowcast(self.windows[pollutant].hourly_averages(12))
+
+    def us_aqi(self):
+        """returns (AQI, dominant pollutant), or None when not enough data"""
+        indexes = []
+        pm25 = self.nowcast('pm25')
+        if pm25 is not None:
+            indexes.append((aqi_from_concentration(pm25, PM25_AQI_BREAKPOINTS, 1), 'pm25'))
+        pm10 = self.nowcast('pm10')
+        if pm10 is not None:
+            indexes.append((aqi_from_concentration(pm10, PM10_AQI_BREAKPOINTS, 0), 'pm10'))
+        return max(indexes) if indexes else None
+
+    def _caqi(self, grid, value_of):
+        indexes = []
+        for pollutant in grid:
+            window = self.windows[pollutant]
+            if window.current_hour is None:
+                continue
+            value = value_of(window)
+            if value is not None:
+                indexes.append((caqi_from_concentration(value, grid[pollutant]), pollutant))
+        return max(indexes) if indexes else None
+
+    def caqi_hourly(self):
+        """returns (CAQI of the current hour averages, dominant pollutant), or None"""
+        return self._caqi(CAQI_HOURLY_GRID, lambda window: window.hourly_averages(1)[0])
+
+    def caqi_daily(self):
+        """returns (CAQI of the 24 hour averages, dominant pollutant), or None"""
+        return self._caqi(CAQI_DAILY_GRID, lambda window: window.mean())
+
+    def to_dict(self):
+        return {pollutant: window.to_dict() for pollutant, window in self.windows.items()}
+
+    @classmethod
+    def from_dict(cls, raw):
+        engine = cls()
+        for pollutant, window in (raw or {}).items():
+            if pollutant in engine.windows:
+                engine.windows[pollutant] = HourlyWindow.from_dict(window)
+        return engine
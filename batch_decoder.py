@@ -0,0 +1,362 @@
+"""Columnar batch decoding of recorded device messages
+
+For offline analysis of recorded traffic: a JSON-lines archive (one device
+message per line, or a capture record with the message under "message") is
+read in chunks and the sensor and state messages of a chunk are decoded
+into NumPy columns at once, instead of one SensorsData/StateData per
+message. NumPy is only needed here, the plugin itself does not use it.
+
+A chunk is not parsed as JSON. Its bytes are scanned as one array: the wire
+keys are located before the colons of the chunk, their string values (or the
+new value of an [old, new] pair) are cut out as fixed width byte strings and
+the digits are summed column by column. Lines the scanner can not read with
+certainty (escapes, a key twice, values that are no short strings, a line
+that is not complete) are parsed with json and merged in archive order.
+
+The columns carry the names and values of SensorsData and StateData, with
+the integer columns using the ENVIRONMENTAL_* sentinels of const.py where
+the classes give None: OFF, INIT and INV (failed) readings, and MISSING for
+a field the model does not report. Float columns are NaN instead. The Kelvin
+conversions are the same float64 operations as kelvin_to_celsius, so the
+values match the per-message classes exactly.
+"""
+
+import json, numbers
+
+from const import ENVIRONMENTAL_OFF, ENVIRONMENTAL_INIT, ENVIRONMENTAL_FAIL
+from inbound import SENSOR_MESSAGES, STATE_MESSAGES
+
+#field not reported by the model
+MISSING = -4
+#fan speed AUTO in the fan_speed column
+FAN_SPEED_AUTO = -5
+
+#numpy string type of the wire values, longer values are decoded at their own width
+WIRE_WIDTH = 'U8'
+
+SENTINELS = {'OFF': ENVIRONMENTAL_OFF, 'INIT': ENVIRONMENTAL_INIT, 'INV': ENVIRONMENTAL_FAIL, '': MISSING}
+
+#SensorsData field: wire keys, the first one present is used
+SENSOR_COLUMNS = {
+    'humidity': ('hact',),
+    'volatile_compounds': ('va10', 'vact'),
+    'particles': ('pact',),
+    'particles2_5': ('p25r',),
+    'particles10': ('p10r',),
+    'particulate_matter_25': ('pm25',),
+    'particulate_matter_10': ('pm10',),
+    'nitrogenDioxideDensity': ('noxl',),
+    'sleep_timer': ('sltm',),
+}
+SENSOR_KEYS = ('tact',) + tuple(key for keys in SENSOR_COLUMNS.values() for key in keys)
+STATE_KEYS = ('fnsp', 'filf', 'hflr', 'cflr', 'hmax', 'ercd', 'wacd')
+
+#bytes read for a wire value, for the time and the msg of a message, and to find the new value of a pair
+VALUE_WIDTH = 16
+TIME_WIDTH = 32
+MSG_WIDTH = 40
+PAIR_WIDTH = 48
+QUOTE, COLON, COMMA, OPEN_PAIR, CLOSE_PAIR, BACKSLASH = (ord(char) for char in '":,[]\\')
+OPEN_OBJECT, CLOSE_OBJECT, NEWLINE = ord('{'), ord('}'), ord('\n')
+WHITESPACE = (ord(' '), ord('\t'), ord('\r'))
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The batch decoder needs NumPy, install numpy")
+    return numpy
+
+def _wire_table(np, rows, keys, pairs=False):
+    """raw wire strings of keys as one array with a row per key, '' where a message lacks the key
+
+    with pairs the [old, new] values of STATE-CHANGE messages are taken into account"""
+    table = [[row.get(key, '') for row in rows] for key in keys]
+    if pairs:
+        table = [[value[-1] if value.__class__ is list else value for value in values] for values in table]
+    #wire values are short, a fixed width is quicker than measuring every string
+    array = np.array(table, dtype=WIRE_WIDTH)
+    if array.size and np.char.str_len(array).max() == int(WIRE_WIDTH[1:]):
+        array = np.array(table, dtype=str)
+    return dict(zip(keys, array))
+
+def _int_column(np, raw, sentinels=SENTINELS):
+    """integer column of wire strings (str or bytes array), sentinel values for the non numeric ones
+
+    The digits are summed on the code points of the fixed width strings, a few
+    array operations instead of a conversion per string."""
+    code_type = np.dtype(np.uint32 if raw.dtype.kind == 'U' else np.uint8)
+    codes = np.ascontiguousarray(raw).view(code_type).reshape(raw.shape + (raw.dtype.itemsize // code_type.itemsize,))
+    #the code points after the longest value are all 0
+    used = np.flatnonzero(codes.reshape(-1, codes.shape[-1]).any(axis=0))
+    codes = codes[..., :used[-1] + 1] if len(used) else codes[..., :1]
+    value = np.zeros(raw.shape, dtype=np.int64)
+    numeric = codes[..., 0] != 0
+    for position in range(codes.shape[-1]):
+        code = codes[..., position]
+        digit = code.astype(np.int64) - 48
+        numeric &= (code == 0) | ((digit >= 0) & (digit <= 9))
+        value = np.where(code != 0, value * 10 + digit, value)
+    column = np.where(numeric, value, MISSING).astype(np.int32)
+    for text, sentinel in sentinels.items():
+        column[raw == (text if raw.dtype.kind == 'U' else text.encode())] = sentinel
+    return column
+
+def _first_present(np, columns, keys):
+    """per message the column of the first key the message has"""
+    column = columns[keys[0]]
+    for key in keys[1:]:
+        column = np.where(column == MISSING, columns[key], column)
+    return column
+
+def _time_column(np, messages):
+    """message times as datetime64[ms], NaT when absent"""
+    return np.array([str(message.get('time', 'NaT')).rstrip('Z') for message in messages], dtype='datetime64[ms]')
+
+def _sensor_columns(np, times, values):
+    """SensorsData columns of the integer columns of the wire keys"""
+    columns = {'time': times}
+    tact = values['tact']
+    columns['temperature'] = np.where(tact >= 0, tact.astype(np.float64) / 10 - 273.15, np.nan)
+    for field, field_keys in SENSOR_COLUMNS.items():
+        columns[field] = _first_present(np, values, field_keys)
+    #like SensorsData, a sleep timer that is off counts as 0
+    columns['sleep_timer'][columns['sleep_timer'] < 0] = 0
+    return columns
+
+def _state_columns(np, times, raw, strings):
+    """StateData columns of the wire values (raw) and of the string columns of ercd and wacd"""
+    columns = {'time': times}
+    columns['fan_speed'] = _int_column(np, raw['fnsp'], dict(SENTINELS, AUTO=FAN_SPEED_AUTO))
+    filter_life = _int_column(np, raw['filf'])
+    #TP04 models report the HEPA and carbon filter, like StateData the average
+    hepa = _int_column(np, raw['hflr'])
+    carbon = _int_column(np, raw['cflr'])
+    average = np.where((hepa >= 0) & (carbon >= 0), (hepa + carbon) // 2, np.minimum(hepa, carbon))
+    filter_life = np.where(filter_life != MISSING, filter_life, np.where(hepa != MISSING, average, MISSING))
+    columns['filter_life'] = filter_life.astype(np.int32)
+    hmax = _int_column(np, raw['hmax'])
+    celsius = np.trunc(hmax.astype(np.float64) / 10 - 273.15).astype(np.int32)
+    columns['heat_target'] = np.where(hmax >= 0, celsius, hmax)
+    columns['error_code'] = strings['ercd']
+    columns['warning_code'] = strings['wacd']
+    return columns
+
+def decode_sensors(messages):
+    """columns of a list of ENVIRONMENTAL-CURRENT-SENSOR-DATA messages"""
+    np = _numpy()
+    raw = _wire_table(np, [message['data'] for message in messages], SENSOR_KEYS)
+    values = dict(zip(SENSOR_KEYS, _int_column(np, np.array([raw[key] for key in SENSOR_KEYS]))))
+    return _sensor_columns(np, _time_column(np, messages), values)
+
+def decode_state(messages):
+    """columns of a list of CURRENT-STATE and STATE-CHANGE messages"""
+    np = _numpy()
+    raw = _wire_table(np, [message['product-state'] for message in messages], STATE_KEYS, True)
+    return _state_columns(np, _time_column(np, messages), raw, raw)
+
+def _window(np, buf, width):
+    """view of buf with at each position the width bytes from there on"""
+    return np.lib.stride_tricks.as_strided(buf, (len(buf) - width + 1, width), (buf.strides[0], buf.strides[0]), writeable=False)
+
+class _Chunk(object):
+    """The lines of a chunk as one byte array, with the positions of the values of the wire keys"""
+
+    def __init__(self, np, data):
+        self.np = np
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        #padding so every window read past the last line stays in the array
+        self.buf = buf = np.frombuffer(data + b'\0' * (PAIR_WIDTH + VALUE_WIDTH), dtype=np.uint8)
+        size = len(data)
+        self.space = np.zeros(256, dtype=bool)
+        self.space[list(WHITESPACE)] = True
+        self.ends = np.flatnonzero(buf[:size] == NEWLINE)
+        starts = np.concatenate(([0], self.ends[:-1] + 1))
+        self.count = len(self.ends)
+        #lines that are read with json: escapes, not a complete object
+        self.bad = np.zeros(self.count, dtype=bool)
+        self.bad[self.line_of(np.flatnonzero(buf[:size] == BACKSLASH))] = True
+        first = self.skip(starts)
+        last = self.skip(self.ends - 1, -1)
+        self.bad |= (buf[first] != OPEN_OBJECT) | (buf[last] != CLOSE_OBJECT)
+        #a key is the string before a colon, the wire keys have 3 or 4 characters
+        colons = np.flatnonzero(buf[:size] == COLON)
+        closing = self.skip(colons - 1, -1)
+        self.bad[self.line_of(closing[self.space[buf[closing]]])] = True
+        colons, closing = colons[buf[closing] == QUOTE], closing[buf[closing] == QUOTE]
+        opening = np.where(buf[closing - 4] == QUOTE, closing - 4, np.where(buf[closing - 5] == QUOTE, closing - 5, -1))
+        colons, closing, opening = colons[opening >= 0], closing[opening >= 0], opening[opening >= 0]
+        self.key_lengths = closing - opening - 1
+        #the 4 bytes after the opening quote as one integer, with the closing quote for 3 characters
+        self.key_words = np.ascontiguousarray(_window(np, buf, 4)[opening + 1]).view('<u4').ravel()
+        self.key_values = self.skip(colons + 1)
+
+    def line_of(self, positions):
+        return self.np.searchsorted(self.ends, positions)
+
+    def skip(self, positions, step=1, limit=3):
+        """positions moved past at most limit whitespace bytes"""
+        for _ in range(limit):
+            spaces = self.space[self.buf[positions]]
+            if not spaces.any():
+                break
+            positions = positions + step * spaces
+        return positions
+
+    def value_starts(self, key):
+        """per line the position of the value of key, -1 where the line lacks the key"""
+        np = self.np
+        word = int.from_bytes((key.encode() + b'"')[:4], 'little')
+        values = self.key_values[(self.key_words == word) & (self.key_lengths == len(key))]
+        lines = self.line_of(values)
+        self.bad |= np.bincount(lines, minlength=self.count) > 1
+        starts = np.full(self.count, -1, dtype=np.int64)
+        starts[lines] = values
+        first = self.buf[values]
+        self.bad[lines[(first != QUOTE) & (first != OPEN_PAIR)]] = True
+        return starts
+
+    def strings(self, starts, width=VALUE_WIDTH, lines=None):
+        """bytes of the string values (or new values of pairs) at starts, b'' where absent
+
+        lines are the line numbers of the starts, all lines when None"""
+        np = self.np
+        buf = self.buf
+        lines = np.arange(len(starts)) if lines is None else lines
+        present = np.flatnonzero(starts >= 0)
+        values = np.zeros(len(starts), dtype='S{0}'.format(width))
+        opening = starts[present]
+        rows = lines[present]
+        pairs = np.flatnonzero(buf[opening] == OPEN_PAIR)
+        if len(pairs):
+            #the new value starts at the third quote of the pair, after the old string value
+            window = _window(np, buf, PAIR_WIDTH)[opening[pairs]]
+            counted = np.cumsum(window == QUOTE, axis=1, dtype=np.uint8)
+            third = np.argmax(counted == 3, axis=1)
+            closed = np.argmax(window == CLOSE_PAIR, axis=1)
+            unreadable = (counted[:, -1] < 3) | ((closed > 0) & (closed < third)) | (buf[self.skip(opening[pairs] + 1)] != QUOTE)
+            self.bad[rows[pairs[unreadable]]] = True
+            opening[pairs] += third
+        window = _window(np, buf, width)[opening + 1]
+        quotes = window == QUOTE
+        length = np.argmax(quotes, axis=1)
+        self.bad[rows[~quotes.any(axis=1)]] = True
+        if len(pairs):
+            closing = self.skip(opening[pairs] + length[pairs] + 2)
+            self.bad[rows[pairs[buf[closing] != CLOSE_PAIR]]] = True
+        window *= np.arange(width) < length[:, None]
+        values[present] = window.view(values.dtype).ravel()
+        return values
+
+    def times(self, starts, lines=None):
+        """the time values at starts as datetime64[ms], NaT where absent"""
+        values = self.np.char.rstrip(self.strings(starts, TIME_WIDTH, lines), b'Z')
+        return self.np.where(values == b'', b'NaT', values).astype('datetime64[ms]')
+
+def _scan(np, data):
+    """decode the lines of data that the byte scanner can read
+
+    returns sensor columns, state columns, their line numbers and the lines to be read with json"""
+    chunk = _Chunk(np, data)
+    kinds = chunk.strings(chunk.value_starts('msg'), MSG_WIDTH)
+    starts = dict((key, chunk.value_starts(key)) for key in ('time',) + SENSOR_KEYS + STATE_KEYS)
+    #the values are read before the lines are chosen, reading a value may mark its line as bad
+    sensor_lines = np.flatnonzero(np.isin(kinds, [kind.encode() for kind in SENSOR_MESSAGES]) & ~chunk.bad)
+    state_lines = np.flatnonzero(np.isin(kinds, [kind.encode() for kind in STATE_MESSAGES]) & ~chunk.bad)
+    sensor_raw = np.array([chunk.strings(starts[key][sensor_lines], lines=sensor_lines) for key in SENSOR_KEYS])
+    sensor_times = chunk.times(starts['time'][sensor_lines], sensor_lines)
+    state_raw = dict((key, chunk.strings(starts[key][state_lines], lines=state_lines)) for key in STATE_KEYS)
+    state_times = chunk.times(starts['time'][state_lines], state_lines)
+    sensors_read = ~chunk.bad[sensor_lines]
+    values = dict(zip(SENSOR_KEYS, _int_column(np, sensor_raw[:, sensors_read])))
+    sensors = _sensor_columns(np, sensor_times[sensors_read], values)
+    states_read = ~chunk.bad[state_lines]
+    raw = dict((key, state_raw[key][states_read]) for key in STATE_KEYS)
+    strings = dict((key, np.char.decode(raw[key], 'utf-8')) for key in ('ercd', 'wacd'))
+    states = _state_columns(np, state_times[states_read], raw, strings)
+    return sensors, sensor_lines[sensors_read], states, state_lines[states_read], np.flatnonzero(chunk.bad)
+
+def _concatenate(np, parts):
+    if not parts:
+        return {}
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+def _message(line):
+    """the device message of an archive line, None when the line holds none"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        #e.g. the last line of an archive that is still written
+        return None
+    message = record.get('message', record) if isinstance(record, dict) else None
+    return message if isinstance(message, dict) and 'msg' in message else None
+
+def _merge(np, fast, fast_lines, slow, slow_lines):
+    """the rows of the scanned and the json decoded lines in line order"""
+    if not slow_lines:
+        return fast
+    if not len(fast_lines):
+        return slow
+    order = np.argsort(np.concatenate((fast_lines, slow_lines)), kind='stable')
+    return {name: np.concatenate((fast[name], slow[name]))[order] for name in fast}
+
+def decode_lines(lines):
+    """sensor and state columns of a list of archive lines"""
+    np = _numpy()
+    data = ''.join(lines).encode('utf-8')
+    sensors, sensor_lines, states, state_lines, bad = _scan(np, data)
+    if len(bad):
+        line_texts = data.split(b'\n')
+        slow_sensors, slow_sensor_lines, slow_states, slow_state_lines = [], [], [], []
+        for line in bad:
+            message = _message(line_texts[line])
+            if message is not None and message['msg'] in SENSOR_MESSAGES:
+                slow_sensors.append(message)
+                slow_sensor_lines.append(line)
+            elif message is not None and message['msg'] in STATE_MESSAGES:
+                slow_states.append(message)
+                slow_state_lines.append(line)
+        if slow_sensors:
+            sensors = _merge(np, sensors, sensor_lines, decode_sensors(slow_sensors), slow_sensor_lines)
+        if slow_states:
+            states = _merge(np, states, state_lines, decode_state(slow_states), slow_state_lines)
+    return sensors if len(sensors['time']) else {}, states if len(states['time']) else {}
+
+def iter_batches(archive, chunk_size=50000):
+    """decode a JSON-lines archive (path or open file) in chunks of lines, yields (sensor columns, state columns)"""
+    if isinstance(archive, str):
+        with open(archive) as archive_file:
+            for batch in iter_batches(archive_file, chunk_size):
+                yield batch
+        return
+    while True:
+        lines = [line for _, line in zip(range(chunk_size), archive)]
+        if not lines:
+            return
+        yield decode_lines(lines)
+
+def decode_archive(archive, chunk_size=50000):
+    """all sensor and state columns of a JSON-lines archive"""
+    np = _numpy()
+    sensors, states = [], []
+    for sensor_columns, state_columns in iter_batches(archive, chunk_size):
+        if sensor_columns:
+            sensors.append(sensor_columns)
+        if state_columns:
+            states.append(state_columns)
+    return _concatenate(np, sensors), _concatenate(np, states)
+
+def as_python(value, field=None):
+    """a column value as the per-message classes give it: None for sentinels and NaN
+
+    the numeric fan_speed is given as the wire string of StateData when field is 'fan_speed'"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if field == 'fan_speed' and value >= 0:
+        return '{0:04d}'.format(value)
+    if field == 'fan_speed' and value == FAN_SPEED_AUTO:
+        return 'AUTO'
+    if value != value or (isinstance(value, numbers.Integral) and value < 0):
+        return None
+    return value
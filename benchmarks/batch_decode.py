@@ -0,0 +1,76 @@
+"""Benchmark of the columnar batch decoder against the per-message classes
+
+A synthetic JSON-lines archive of sensor and state messages is decoded with
+batch_decoder and line by line with SensorsData/StateData, and the columns
+are checked against the values of the classes. The time is the best of a
+few runs without tracemalloc, the memory kept by the result is measured in
+a run of its own.
+
+usage: python benchmarks/batch_decode.py [messages] [runs]
+"""
+
+import io, json, os, random, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import batch_decoder
+from value_types import SensorsData, StateData
+
+def reading(high):
+    return random.choice(['INIT', 'OFF']) if random.random() < 0.05 else '{0:04d}'.format(random.randint(0, high))
+
+def archive(count):
+    lines = []
+    for index in range(count):
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(1600000000 + index * 30))
+        if index % 4:
+            data = {'tact': reading(3100), 'hact': reading(99), 'pm25': reading(200), 'pm10': reading(200),
+                    'va10': reading(100), 'noxl': reading(100), 'p25r': reading(200), 'p10r': reading(200), 'sltm': 'OFF'}
+            message = {'msg': 'ENVIRONMENTAL-CURRENT-SENSOR-DATA', 'time': stamp, 'data': data}
+        else:
+            state = {'fnsp': random.choice(['AUTO', '0004']), 'filf': '4000', 'hmax': random.choice(['OFF', '2960']),
+                     'ercd': 'NONE', 'wacd': 'NONE'}
+            message = {'msg': 'STATE-CHANGE', 'time': stamp, 'product-state': {key: [value, value] for key, value in state.items()}}
+        lines.append(json.dumps(message))
+    return '\n'.join(lines) + '\n'
+
+def per_message(text):
+    sensors, states = [], []
+    for line in io.StringIO(text):
+        message = json.loads(line)
+        if SensorsData.is_sensors_data(message):
+            sensors.append(SensorsData(message).as_dict())
+        elif StateData.is_state_data(message):
+            states.append(StateData(message).as_dict())
+    return sensors, states
+
+def batch(text):
+    return batch_decoder.decode_archive(io.StringIO(text))
+
+def measure(decode, text, runs):
+    """result, best seconds of runs and the memory the result keeps (kB) of decode(text)"""
+    elapsed = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        decode(text)
+        elapsed.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = decode(text)
+    kept = tracemalloc.get_traced_memory()[0] // 1024
+    tracemalloc.stop()
+    return result, min(elapsed), kept
+
+def main(count, runs):
+    text = archive(count)
+    #NumPy is imported before the timed runs
+    batch(text[:1000])
+    (sensor_columns, state_columns), batch_time, batch_memory = measure(batch, text, runs)
+    (sensors, states), message_time, message_memory = measure(per_message, text, runs)
+    mismatches = sum(batch_decoder.as_python(sensor_columns[field][row], field) != values[field]
+                     for row, values in enumerate(sensors) for field in set(sensor_columns) - {'time'})
+    mismatches += sum(batch_decoder.as_python(state_columns[field][row], field) != values[field]
+                      for row, values in enumerate(states) for field in set(state_columns) - {'time'})
+    print("{0} messages: batch {1:.3f} s {2} kB, per message {3:.3f} s {4} kB, {5} mismatches".format(
+        count, batch_time, batch_memory, message_time, message_memory, mismatches))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
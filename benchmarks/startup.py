@@ -0,0 +1,44 @@
+"""Import time and memory benchmark of the plugin start path
+
+Every run imports the plugin in a fresh interpreter (outside Domoticz, so
+fakeDomoticz is used) and reports the import time, the peak RSS and which of
+the heavy optional modules got loaded along the way.
+
+usage: python benchmarks/startup.py [runs]
+"""
+
+import os, subprocess, sys, json, statistics
+
+PLUGIN_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#modules that should not be loaded on the start path of a provisioned install
+HEAVY_MODULES = ['requests', 'Crypto', 'cryptography', 'pathlib', 'cloud.account', 'asyncio', 'ssl', 'http.server']
+
+PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {folder!r})
+start = time.perf_counter()
+import plugin
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    'import_ms': elapsed * 1000,
+    'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'loaded': [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+def run_once():
+    probe = PROBE.format(folder=PLUGIN_FOLDER, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(runs):
+    results = [run_once() for _ in range(runs)]
+    import_times = [result['import_ms'] for result in results]
+    print("plugin import: median {0:.1f} ms, min {1:.1f} ms over {2} runs".format(
+        statistics.median(import_times), min(import_times), runs))
+    print("peak RSS: {0} kB".format(max(result['maxrss_kb'] for result in results)))
+    print("heavy modules loaded at start: {0}".format(results[-1]['loaded'] or 'none'))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -0,0 +1,215 @@
+"""Headless bridge: Dyson devices to a local MQTT broker and an HTTP API
+
+Runs without Domoticz. All devices are handled in one asyncio event loop,
+their decoded values are republished as retained topics on a local broker:
+
+    dyson/<serial>/online               true|false
+    dyson/<serial>/state/<field>        decoded StateData fields
+    dyson/<serial>/sensors/<field>      decoded SensorsData fields
+
+Commands are accepted on dyson/<serial>/set/<field> and over HTTP:
+
+    GET  /devices                       all devices and their last values
+    GET  /devices/<serial>              one device
+    POST /devices/<serial>/command      JSON object of field: value
+
+The HTTP API controls the devices, it listens on 127.0.0.1 unless another
+address is given. With --token every request needs the header
+"Authorization: Bearer <token>".
+
+usage: python bridge_daemon.py devices.json [--broker host:port] [--http port]
+                               [--http-address address] [--token token]
+The device file has the layout described in shard_runner.py.
+"""
+
+import argparse, asyncio, hmac, json, sys
+
+from mqtt_async import AsyncMqttClient
+from shard_runner import DeviceSession, load_devices
+from schedules import ScheduleError, command_data
+from cloud.exceptions import DysonInvalidTargetTemperatureException
+
+TOPIC_PREFIX = 'dyson'
+
+#command fields and the schedule action (DysonCommands setter) handling them
+COMMANDS = {
+    'fan_mode': 'fan_mode',
+    'fan_power': 'fan_power',
+    'fan_speed': 'fan_speed',
+    'fan_mode_auto': 'fan_mode_auto',
+    'night_mode': 'night_mode',
+    'oscillation': 'oscilation',
+    'focus': 'focus',
+    'standby_monitoring': 'standby_monitoring',
+    'heat_mode': 'heat_mode',
+    'heat_target': 'heat_target',
+}
+
+class CommandError(Exception):
+    """Command that can not be sent to a device"""
+    pass
+
+class BridgeDaemon(object):
+    """Bridges many Dyson devices to a local broker and serves the HTTP API"""
+
+    def __init__(self, devices, broker_address='127.0.0.1', broker_port=1883, http_port=None,
+                 broker_factory=AsyncMqttClient, session_factory=DeviceSession, http_address='127.0.0.1', http_token=None):
+        self.devices = {}
+        self.sessions = {}
+        for description in devices:
+            self.sessions[description['serial']] = session_factory(description, self.on_changes)
+            self.devices[description['serial']] = {'name': description['name'], 'connected': False, 'state': {}, 'sensors': {}}
+        self.broker = broker_factory(broker_address, broker_port, 'DysonBridge',
+            connected_cb=self.on_broker_connected, publish_cb=self.on_broker_message)
+        self.http_port = http_port
+        self.http_address = http_address
+        self.http_token = http_token
+        self._http_server = None
+        self._tasks = []
+
+    def on_changes(self, serial, kind, changes):
+        """store changed values of a device and republish them retained"""
+        device = self.devices[serial]
+        base = '{0}/{1}'.format(TOPIC_PREFIX, serial)
+        if kind == 'connection':
+            device['connected'] = changes['connected']
+            self.broker.publish(base + '/online', json.dumps(changes['connected']), retain=True)
+            return
+        device[kind].update(changes)
+        for field, value in changes.items():
+            self.broker.publish('{0}/{1}/{2}'.format(base, kind, field), json.dumps(value), retain=True)
+
+    def on_broker_connected(self):
+        self.broker.subscribe(['{0}/+/set/+'.format(TOPIC_PREFIX)])
+        #(re)publish everything known, the broker may have lost its retained messages
+        for serial, device in self.devices.items():
+            self.on_changes(serial, 'connection', {'connected': device['connected']})
+            for kind in ('state', 'sensors'):
+                if device[kind]:
+                    self.on_changes(serial, kind, device[kind])
+
+    def on_broker_message(self, topic, message):
+        parts = topic.split('/')
+        if len(parts) != 4 or parts[0] != TOPIC_PREFIX or parts[2] != 'set':
+            return
+        try:
+            self.send_command(parts[1], {parts[3]: message})
+        except CommandError as inst:
+            print("Command on '{0}' ignored: {1}".format(topic, inst), file=sys.stderr)
+
+    def send_command(self, serial, fields):
+        """send fields (command name: value) to a device, as one STATE-SET"""
+        session = self.sessions.get(serial)
+        if session is None:
+            raise CommandError("unknown device '{0}'".format(serial))
+        if not session.client.is_connected:
+            raise CommandError("device '{0}' is not connected".format(serial))
+        data = {}
+        for field, value in fields.items():
+            if field not in COMMANDS:
+                raise CommandError("unknown command '{0}', use one of {1}".format(field, sorted(COMMANDS)))
+            try:
+                #the wire values as the schedules build them, e.g. a fan speed of 5 as 0005
+                data.update(command_data(session.device, {COMMANDS[field]: int(value) if field == 'heat_target' else str(value).upper()}))
+            except (ValueError, ScheduleError, DysonInvalidTargetTemperatureException):
+                raise CommandError("invalid value '{0}' for '{1}'".format(value, field))
+        if data:
+            session.client.publish(*session.device.set_fields(data))
+
+    async def handle_http(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            if self.authorized(headers):
+                status, response = self.http_response(request_line, body)
+            else:
+                status, response = 401, {'error': 'unauthorized'}
+        except (ValueError, asyncio.IncompleteReadError):
+            status, response = 400, {'error': 'bad request'}
+        data = json.dumps(response).encode('utf-8')
+        writer.write('HTTP/1.0 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n\r\n'.format(
+            status, 'OK' if status < 300 else 'Error', len(data)).encode('latin-1') + data)
+        await writer.drain()
+        writer.close()
+
+    def authorized(self, headers):
+        """True when no token is configured or the request carries it"""
+        if self.http_token is None:
+            return True
+        return hmac.compare_digest(headers.get('authorization', '').encode('utf-8'), ('Bearer ' + self.http_token).encode('utf-8'))
+
+    def http_response(self, request_line, body):
+        """returns (status, JSON response) of an API request"""
+        if len(request_line) < 2:
+            return 400, {'error': 'bad request'}
+        method, parts = request_line[0], [part for part in request_line[1].split('/') if part]
+        if method == 'GET' and parts == ['devices']:
+            return 200, self.devices
+        if len(parts) >= 2 and parts[0] == 'devices':
+            if parts[1] not in self.devices:
+                return 404, {'error': "unknown device '{0}'".format(parts[1])}
+            if method == 'GET' and len(parts) == 2:
+                return 200, self.devices[parts[1]]
+            if method == 'POST' and parts[2:] == ['command']:
+                fields = json.loads(body or b'{}')
+                if not isinstance(fields, dict):
+                    return 400, {'error': 'expected a JSON object'}
+                try:
+                    self.send_command(parts[1], fields)
+                except CommandError as inst:
+                    return 409, {'error': str(inst)}
+                return 202, {'sent': fields}
+        return 404, {'error': 'not found'}
+
+    async def run(self, poll_interval=300):
+        if self.http_port is not None:
+            self._http_server = await asyncio.start_server(self.handle_http, self.http_address, self.http_port)
+        self._tasks = [asyncio.ensure_future(self.broker.run())]
+        for index, session in enumerate(self.sessions.values()):
+            self._tasks.append(asyncio.ensure_future(session.client.run()))
+            self._tasks.append(asyncio.ensure_future(session.poll(poll_interval, poll_interval * (index + 1) / len(self.sessions))))
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        for session in self.sessions.values():
+            session.client.stop()
+        self.broker.stop()
+        if self._http_server is not None:
+            self._http_server.close()
+        for task in self._tasks:
+            task.cancel()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Bridge Dyson devices to a local MQTT broker")
+    parser.add_argument('devices', help="JSON file with the device configuration entries")
+    parser.add_argument('--broker', default='127.0.0.1:1883', help="local broker as host:port")
+    parser.add_argument('--http', type=int, default=None, help="port of the HTTP API")
+    parser.add_argument('--http-address', default='127.0.0.1', help="address the HTTP API listens on, 0.0.0.0 for all")
+    parser.add_argument('--token', default=None, help="bearer token required by the HTTP API")
+    parser.add_argument('--poll', type=int, default=300, help="state poll interval in seconds")
+    args = parser.parse_args(argv[1:])
+    with open(args.devices) as config_file:
+        devices = load_devices(json.load(config_file))
+    from cloud.utils import credentials
+    passwords = credentials.decrypt_many([device['credential'] for device in devices])
+    devices = [dict(device, password=passwords[device['credential']]) for device in devices]
+    broker_address, _, broker_port = args.broker.rpartition(':')
+    daemon = BridgeDaemon(devices, broker_address, int(broker_port), args.http, http_address=args.http_address, http_token=args.token)
+    try:
+        asyncio.run(daemon.run(args.poll))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
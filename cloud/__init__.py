@@ -1,7 +1,24 @@
-"""Dyson cloud client."""
+"""Dyson cloud client.
 
-from .account import DysonAccount, DysonAccountCN  # noqa: F401
-#from .cloud_360_eye import DysonCloud360Eye  # noqa: F401
-#from .cloud_device import DysonCloudDevice  # noqa: F401
-from .device_info import DysonDeviceInfo  # noqa: F401
-#from .regions import REGIONS  # noqa: F401
+The account client pulls in requests, so it is only imported when one of the
+names below is used. Importing cloud.exceptions stays cheap.
+"""
+
+_LAZY_IMPORTS = {
+    "DysonAccount": ".account",
+    "DysonAccountCN": ".account",
+    #"DysonCloud360Eye": ".cloud_360_eye",
+    #"DysonCloudDevice": ".cloud_device",
+    "DysonDeviceInfo": ".device_info",
+    #"REGIONS": ".regions",
+}
+
+
+def __getattr__(name):
+    """Import the cloud clients on first access."""
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+    import importlib
+    value = getattr(importlib.import_module(_LAZY_IMPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -1,7 +1,6 @@
 """Dyson cloud account client."""
 
 import pathlib
-import Domoticz
 import requests
 from requests.auth import AuthBase, HTTPBasicAuth
 
@@ -64,9 +63,12 @@ class DysonAccount:
     def __init__(
         self,
         auth_info = None,
+        log = None,
     ):
-        """Create a new Dyson account."""
+        """Create a new Dyson account, the log lines of the requests are appended to log."""
         self._auth_info = auth_info
+        #(level, text), the requests may run on a worker thread where the caller can not log
+        self.log = [] if log is None else log
 
     @property
     def auth_info(self):
@@ -99,7 +101,7 @@ class DysonAccount:
         auth = True,
     ):
         """Make API request. Return response object"""
-        Domoticz.Debug("building request: method {0}, path {1}, params {2}, data {3}, auth {4}".format(method, path, params, data, self._auth if auth else None))
+        self.log.append(('debug', "building request: method {0}, path {1}, params {2}, data {3}, auth {4}".format(method, path, params, data, self._auth if auth else None)))
         if auth and self._auth is None:
             raise DysonAuthRequired
         try:
@@ -115,7 +117,7 @@ class DysonAccount:
         except requests.RequestException:
             raise DysonNetworkError
         if response.status_code  != requests.codes.ok:
-            Domoticz.Error("Dyson request failed: '" +str(response.status_code)+", " +str(response.reason)+"'")
+            self.log.append(('error', "Dyson request failed: '" +str(response.status_code)+", " +str(response.reason)+"'"))
         if response.status_code in [401, 403]:
             raise DysonInvalidAuth
         if 500 <= response.status_code < 600:
@@ -1,10 +1,9 @@
 """Dyson cloud client utilities."""
 
 import base64
+import hashlib
 import json
 
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-
 DYSON_ENCRYPTION_KEY = (
     b"\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\x0c\r\x0e\x0f\x10"
     b"\x11\x12\x13\x14\x15\x16\x17\x18\x19\x1a\x1b\x1c\x1d\x1e\x1f "
@@ -19,14 +18,101 @@ def _unpad(in_string):
     return in_string[: -ord(in_string[len(in_string) - 1 :])]
 
 
-def decrypt_password(encrypted_password):
-    """Decrypt local credential into MQTT password."""
+def _pycryptodome_decryptor():
+    """Return AES-CBC decrypt function based on PyCryptodome."""
+    from Crypto.Cipher import AES
+
+    def decrypt(encrypted):
+        cipher = AES.new(DYSON_ENCRYPTION_KEY, AES.MODE_CBC, DYSON_ENCRYPTION_INIT_VECTOR)
+        return cipher.decrypt(encrypted)
+
+    return decrypt
+
+
+def _cryptography_decryptor():
+    """Return AES-CBC decrypt function based on cryptography."""
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
     cipher = Cipher(
         algorithms.AES(DYSON_ENCRYPTION_KEY),
         modes.CBC(DYSON_ENCRYPTION_INIT_VECTOR),
     )
-    decryptor = cipher.decryptor()
-    encrypted = base64.b64decode(encrypted_password)
-    decrypted = decryptor.update(encrypted) + decryptor.finalize()
-    json_password = json.loads(_unpad(decrypted))
-    return json_password["apPasswordHash"]
+
+    def decrypt(encrypted):
+        decryptor = cipher.decryptor()
+        return decryptor.update(encrypted) + decryptor.finalize()
+
+    return decrypt
+
+
+CRYPTO_BACKENDS = [
+    ("pycryptodome", _pycryptodome_decryptor),
+    ("cryptography", _cryptography_decryptor),
+]
+
+
+class CredentialService:
+    """Decrypts local credentials into MQTT passwords.
+
+    The crypto backend is picked on first use from whichever library is
+    installed. Decrypted passwords are cached by a hash of the encrypted blob,
+    so the AES work is done once per credential.
+    """
+
+    def __init__(self, backends=None):
+        """Create the service, backends is a list of (name, factory) tried in order."""
+        self._backends = CRYPTO_BACKENDS if backends is None else backends
+        self._decrypt = None
+        self._cache = {}
+        self.backend = None
+
+    def _decryptor(self):
+        if self._decrypt is None:
+            for name, factory in self._backends:
+                try:
+                    self._decrypt = factory()
+                except ImportError:
+                    continue
+                self.backend = name
+                break
+            else:
+                raise ImportError(
+                    "No AES backend available, install pycryptodome or cryptography"
+                )
+        return self._decrypt
+
+    @staticmethod
+    def _key(encrypted_password):
+        return hashlib.sha256(encrypted_password.encode("ascii")).hexdigest()
+
+    def decrypt(self, encrypted_password):
+        """Decrypt local credential into MQTT password."""
+        key = self._key(encrypted_password)
+        password = self._cache.get(key)
+        if password is None:
+            decrypted = self._decryptor()(base64.b64decode(encrypted_password))
+            password = json.loads(_unpad(decrypted))["apPasswordHash"]
+            self._cache[key] = password
+        return password
+
+    def decrypt_many(self, encrypted_passwords):
+        """Decrypt a batch of local credentials, e.g. all devices of a manifest.
+
+        Returns a dictionary of encrypted credential to MQTT password.
+        """
+        return {
+            encrypted: self.decrypt(encrypted)
+            for encrypted in encrypted_passwords
+        }
+
+    def clear(self):
+        """Forget all decrypted passwords."""
+        self._cache.clear()
+
+
+credentials = CredentialService()
+
+
+def decrypt_password(encrypted_password):
+    """Decrypt local credential into MQTT password."""
+    return credentials.decrypt(encrypted_password)
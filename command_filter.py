@@ -0,0 +1,41 @@
+"""Suppression of commands that would not change the device
+
+Automations re-assert states all the time. Before a STATE-SET is published,
+its fields are compared with the last state the device reported (the wire
+values of the snapshot). Fields the device already has are pruned and a
+command without fields left is not sent at all.
+
+The cached state is only trusted when the device reported it recently, and
+never for a field with a command still waiting for confirmation: the device
+may be about to change it. Pressing the same button again within a few
+seconds sends the command as it is, for when the cached state is wrong.
+"""
+
+import time
+
+class CommandFilter(object):
+    """Prunes the fields of a command that match the confirmed device state"""
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.suppressed = 0
+        self.pruned = 0
+        self.passed = 0
+
+    def prune(self, data, state, state_time, pending=(), now=None):
+        """the fields of data (wire field: value) that should be sent
+
+        state is the last reported wire state, received at state_time (epoch
+        seconds), pending the fields of commands that are not confirmed yet"""
+        now = time.time() if now is None else now
+        if state_time is None or now - state_time > self.max_age:
+            self.passed += 1
+            return dict(data)
+        needed = {field: value for field, value in data.items()
+                  if field in pending or state.get(field) != value}
+        if not needed:
+            self.suppressed += 1
+            return needed
+        self.pruned += len(data) - len(needed)
+        self.passed += 1
+        return needed
@@ -0,0 +1,132 @@
+"""Round trip tracking of the commands sent to a device
+
+Every STATE-SET is recorded with the wire values it sets. The device confirms
+a command with a STATE-CHANGE whose [old, new] pairs end in those values, for
+every field either with a real change (old != new) or in a message the device
+stamped after the command was sent. A STATE-CHANGE that merely repeats the
+values, from before the command or about other fields, does not confirm it.
+The time between the two is the round trip latency. Commands that are not
+confirmed within the deadline are reported as unconfirmed, e.g. because the
+device ignored them or does not support the field.
+
+Latencies are counted in fixed buckets per device, so percentiles come from
+the histogram without keeping the samples.
+"""
+
+import collections, time
+
+#upper bounds of the latency buckets in seconds, the last bucket is unbounded
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+class PendingCommand(object):
+    __slots__ = ('serial', 'data', 'sent', 'sent_at', 'deadline')
+
+    def __init__(self, serial, data, sent, deadline, sent_at=None):
+        self.serial = serial
+        self.data = dict(data)
+        self.sent = sent
+        #wall clock time, compared with the time the device puts in its messages
+        self.sent_at = time.time() if sent_at is None else sent_at
+        self.deadline = deadline
+
+    def __repr__(self):
+        return 'Command {0} to {1}'.format(self.data, self.serial)
+
+class LatencyHistogram(object):
+    """Bucketed latency distribution"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        index = 0
+        while index < len(self.buckets) and latency > self.buckets[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, fraction):
+        """upper bound of the bucket holding the given fraction of the latencies, None without data"""
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'max': self.max,
+        }
+
+class CommandTracker(object):
+    """Matches sent commands with the STATE-CHANGE messages confirming them"""
+
+    def __init__(self, deadline=10.0):
+        self.deadline = deadline
+        self._pending = collections.defaultdict(list)
+        self.latency = collections.defaultdict(LatencyHistogram)
+        self.confirmed = collections.Counter()
+        self.unconfirmed = collections.Counter()
+
+    def sent(self, serial, data, now=None, sent_at=None):
+        """record a STATE-SET with its data (wire field: value), returns the PendingCommand"""
+        now = time.monotonic() if now is None else now
+        command = PendingCommand(serial, data, now, now + self.deadline, sent_at)
+        self._pending[serial].append(command)
+        return command
+
+    def pending(self, serial=None):
+        if serial is not None:
+            return list(self._pending.get(serial, ()))
+        return [command for commands in self._pending.values() for command in commands]
+
+    def state_changed(self, serial, product_state, now=None, device_time=None):
+        """match a STATE-CHANGE ({field: [old, new]}), returns the confirmed commands, oldest first
+
+        device_time is the epoch time of the message according to the device, None when unknown"""
+        commands = self._pending.get(serial)
+        if not commands:
+            return []
+        now = time.monotonic() if now is None else now
+        current = {field: value[-1] if isinstance(value, list) else value for field, value in product_state.items()}
+        moved = set(field for field, value in product_state.items() if isinstance(value, list) and value[0] != value[-1])
+        confirmed = [command for command in commands
+                     if all(current.get(field) == value and (field in moved or (device_time is not None and device_time > command.sent_at))
+                            for field, value in command.data.items())]
+        for command in confirmed:
+            commands.remove(command)
+            self.latency[serial].add(now - command.sent)
+            self.confirmed[serial] += 1
+        return confirmed
+
+    def expire(self, now=None):
+        """remove and return the commands that passed their deadline unconfirmed"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        for serial, commands in self._pending.items():
+            while commands and commands[0].deadline <= now:
+                command = commands.pop(0)
+                self.unconfirmed[serial] += 1
+                expired.append(command)
+        return expired
+
+    def stats(self, serial):
+        stats = self.latency[serial].as_dict()
+        stats['confirmed'] = self.confirmed[serial]
+        stats['unconfirmed'] = self.unconfirmed[serial]
+        stats['pending'] = len(self._pending.get(serial, ()))
+        return stats
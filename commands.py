@@ -37,6 +37,14 @@ class DysonCommands(object):
             
         return(self.device_command, command);
 
+    def request_sensors(self):
+        """creates request for current environmental sensor data message"""
+        command = json.dumps({
+                'msg': 'REQUEST-PRODUCT-ENVIRONMENT-CURRENT-SENSOR-DATA',
+                'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())})
+            
+        return(self.device_command, command);
+
     def _create_command(self, data):
         """create change state message"""
         command = json.dumps({
@@ -102,6 +110,11 @@ class DysonCommands(object):
         command = self._create_command({'qtar': arg})
         return(self.device_command, command);
 
+    def set_fields(self, data):
+        """Changes several fields in one command, data is a dict of field: wire value"""
+        command = self._create_command(dict(data))
+        return(self.device_command, command);
+
     def set_heat_target(self, target):
         """Sends the target temperature"""
         arg = HeatTarget.celsius(target)
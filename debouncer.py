@@ -0,0 +1,59 @@
+"""Debouncing of commands from sliders and selectors
+
+Dragging a setpoint fires a command for every step. The debounced fields of a
+device are collected, a later value of a field replaces the earlier one, and
+they are sent together once the device had no new value for the quiet window,
+or at the latest max_latency after the first one.
+"""
+
+import time
+
+class PendingFields(object):
+    __slots__ = ('data', 'first', 'last')
+
+    def __init__(self, now):
+        self.data = {}
+        self.first = now
+        self.last = now
+
+class CommandDebouncer(object):
+    """Last write wins buffer of the debounced fields per device"""
+
+    def __init__(self, quiet=1.0, max_latency=3.0):
+        self.quiet = quiet
+        self.max_latency = max_latency
+        self._pending = {}
+        self.received = 0
+        self.sent = 0
+
+    def add(self, serial, data, now=None):
+        now = time.monotonic() if now is None else now
+        pending = self._pending.get(serial)
+        if pending is None:
+            pending = self._pending[serial] = PendingFields(now)
+        pending.data.update(data)
+        pending.last = now
+        self.received += 1
+
+    def pending(self, serial):
+        """the buffered fields of serial, not removed"""
+        pending = self._pending.get(serial)
+        return dict(pending.data) if pending is not None else {}
+
+    def take(self, serial):
+        """remove and return the buffered fields of serial, e.g. to send them with another command"""
+        pending = self._pending.pop(serial, None)
+        if pending is None:
+            return {}
+        self.sent += 1
+        return pending.data
+
+    def due(self, now=None):
+        """remove and return (serial, data) of the devices that are due"""
+        now = time.monotonic() if now is None else now
+        due = [serial for serial, pending in self._pending.items()
+               if now - pending.last >= self.quiet or now - pending.first >= self.max_latency]
+        return [(serial, self.take(serial)) for serial in due]
+
+    def __len__(self):
+        return len(self._pending)
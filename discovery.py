@@ -0,0 +1,107 @@
+"""Discovery of Dyson devices on the local network
+
+A subnet is scanned concurrently for open MQTT ports (1883/8883). Every open
+port is then probed with an MQTT CONNECT using the serial and password of the
+devices looked for. A successful CONNACK alone does not identify the device,
+any broker that allows anonymous clients accepts it as well: the server must
+also refuse a wrong password and answer a REQUEST-CURRENT-STATE on the topics
+of the device. Found addresses are kept in the serial to address cache of
+discovery_cache, which the reconnect path of the plugin consults.
+"""
+
+import asyncio, ipaddress, json, ssl, time
+
+from mqtt_async import (AsyncMqttClient, MqttConnectionRefused, MqttProtocolError, PUBLISH,
+                        decode_payload, parse_publish, read_packet)
+
+PROBE_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, MqttProtocolError, MqttConnectionRefused)
+
+DEFAULT_PORTS = ('1883', '8883')
+
+class DysonDiscovery(object):
+    """Finds Dyson devices on a subnet by probing their MQTT credentials"""
+
+    def __init__(self, ports=DEFAULT_PORTS, timeout=1.0, concurrency=256):
+        self.ports = ports
+        self.timeout = timeout
+        self.concurrency = concurrency
+
+    async def _port_open(self, semaphore, address, port):
+        async with semaphore:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(address, int(port)), self.timeout)
+            except (OSError, asyncio.TimeoutError):
+                return None
+            writer.close()
+            return address, port
+
+    async def _connect(self, address, port, serial, password):
+        """the connected client and its reader when the MQTT server at address accepts the credentials, None otherwise"""
+        ssl_context = None
+        if port == '8883':
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        client = AsyncMqttClient(address, port, 'DysonDiscovery', username=serial, password=password,
+                                 ssl_context=ssl_context, connect_timeout=self.timeout * 2)
+        try:
+            reader, _ = await client.connect()
+        except PROBE_ERRORS:
+            return None
+        return client, reader
+
+    async def _is_device(self, address, port, serial, password, product_type):
+        """True when the MQTT server at address is the device with serial"""
+        connection = await self._connect(address, port, serial, password)
+        if connection is None:
+            return False
+        client, reader = connection
+        try:
+            #an open broker accepts any password
+            impostor = await self._connect(address, port, serial, password + '-wrong')
+            if impostor is not None:
+                impostor[0].stop()
+                return False
+            base_topic = '{0}/{1}'.format(product_type, serial)
+            client.subscribe([base_topic + '/status/current', base_topic + '/status'])
+            client.publish(base_topic + '/command', json.dumps({
+                'msg': 'REQUEST-CURRENT-STATE', 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}))
+            return await asyncio.wait_for(self._state_reply(reader, base_topic), self.timeout * 2)
+        except PROBE_ERRORS:
+            return False
+        finally:
+            client.stop()
+
+    @staticmethod
+    async def _state_reply(reader, base_topic):
+        """wait for a device message on the status topics of base_topic"""
+        while True:
+            header, body = await read_packet(reader)
+            if header & 0xF0 == PUBLISH:
+                topic, payload, _ = parse_publish(header, body)
+                message = decode_payload(payload)
+                if topic.startswith(base_topic + '/status') and isinstance(message, dict) and 'msg' in message:
+                    return True
+
+    async def scan(self, network, devices):
+        """scan network ('192.168.1.0/24') for devices (dict of serial: (password, product type)), returns dict of serial: (address, port)"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        hosts = [str(host) for host in ipaddress.ip_network(network, strict=False).hosts()]
+        results = await asyncio.gather(*[self._port_open(semaphore, host, port) for host in hosts for port in self.ports])
+        found = {}
+        for address, port in [result for result in results if result is not None]:
+            for serial, (password, product_type) in devices.items():
+                if serial not in found and await self._is_device(address, port, serial, password, product_type):
+                    found[serial] = (address, port)
+                    break
+            if len(found) == len(devices):
+                break
+        return found
+
+    def discover(self, network, devices):
+        """blocking version of scan, to be run on a background thread"""
+        return asyncio.run(self.scan(network, devices))
+
+def local_network(address, prefix=24):
+    """the network of an IPv4 address, e.g. '192.168.1.0/24'"""
+    return str(ipaddress.ip_network('{0}/{1}'.format(address, prefix), strict=False))
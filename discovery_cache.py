@@ -0,0 +1,43 @@
+"""Last known address of the devices
+
+Kept apart from discovery, which loads asyncio and ssl for scanning: the
+plugin reads this cache on every start, the scanner is only loaded when a
+device has to be looked for.
+"""
+
+import json, os, time
+
+CACHE_FILE = 'discovery_cache.json'
+
+class DiscoveryCache(object):
+    """Last known address of every device serial, stored as JSON"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        if path is not None:
+            try:
+                with open(path) as cache_file:
+                    self._entries = json.load(cache_file)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def get(self, serial):
+        """returns (address, port) of serial or None"""
+        entry = self._entries.get(serial)
+        return (entry['address'], entry['port']) if entry else None
+
+    def set(self, serial, address, port):
+        """store the address of serial, returns True when it changed"""
+        entry = self._entries.get(serial)
+        changed = entry is None or entry['address'] != address or entry['port'] != port
+        self._entries[serial] = {'address': address, 'port': port, 'seen': int(time.time())}
+        return changed
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(self._entries, cache_file)
+        os.replace(tmp_path, self.path)
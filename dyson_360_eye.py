@@ -0,0 +1,282 @@
+"""Dyson 360 Eye robot vacuum
+
+The robot reports on <type>/<serial>/status: CURRENT-STATE and STATE-CHANGE
+messages with its state, battery level, power mode and position, and while
+cleaning a MAP-GLOBAL message for every move. The positions of a clean go
+into a TrackBuffer: per point the difference to the previous one as 16 bit
+integers, 6 bytes a point instead of a dict. When the clean ends it is
+reduced to a summary and only the last few summaries are kept.
+"""
+
+import array, collections, json, math, time
+from enum import Enum
+from dyson_pure_link_device import DysonPureLinkDevice
+
+class VacuumState(Enum):
+    """States of the 360 Eye"""
+
+    FAULT_CALL_HELPLINE = "FAULT_CALL_HELPLINE"
+    FAULT_CONTACT_HELPLINE = "FAULT_CONTACT_HELPLINE"
+    FAULT_CRITICAL = "FAULT_CRITICAL"
+    FAULT_GETTING_INFO = "FAULT_GETTING_INFO"
+    FAULT_LOST = "FAULT_LOST"
+    FAULT_ON_DOCK = "FAULT_ON_DOCK"
+    FAULT_ON_DOCK_CHARGED = "FAULT_ON_DOCK_CHARGED"
+    FAULT_ON_DOCK_CHARGING = "FAULT_ON_DOCK_CHARGING"
+    FAULT_REPLACE_ON_DOCK = "FAULT_REPLACE_ON_DOCK"
+    FAULT_RETURN_TO_DOCK = "FAULT_RETURN_TO_DOCK"
+    FAULT_RUNNING_DIAGNOSTIC = "FAULT_RUNNING_DIAGNOSTIC"
+    FAULT_USER_RECOVERABLE = "FAULT_USER_RECOVERABLE"
+    FULL_CLEAN_ABANDONED = "FULL_CLEAN_ABANDONED"
+    FULL_CLEAN_ABORTED = "FULL_CLEAN_ABORTED"
+    FULL_CLEAN_CHARGING = "FULL_CLEAN_CHARGING"
+    FULL_CLEAN_DISCOVERING = "FULL_CLEAN_DISCOVERING"
+    FULL_CLEAN_FINISHED = "FULL_CLEAN_FINISHED"
+    FULL_CLEAN_INITIATED = "FULL_CLEAN_INITIATED"
+    FULL_CLEAN_NEEDS_CHARGE = "FULL_CLEAN_NEEDS_CHARGE"
+    FULL_CLEAN_PAUSED = "FULL_CLEAN_PAUSED"
+    FULL_CLEAN_RUNNING = "FULL_CLEAN_RUNNING"
+    FULL_CLEAN_TRAVERSING = "FULL_CLEAN_TRAVERSING"
+    INACTIVE_CHARGED = "INACTIVE_CHARGED"
+    INACTIVE_CHARGING = "INACTIVE_CHARGING"
+    INACTIVE_DISCHARGING = "INACTIVE_DISCHARGING"
+    MAPPING_ABORTED = "MAPPING_ABORTED"
+    MAPPING_CHARGING = "MAPPING_CHARGING"
+    MAPPING_FINISHED = "MAPPING_FINISHED"
+    MAPPING_INITIATED = "MAPPING_INITIATED"
+    MAPPING_NEEDS_CHARGE = "MAPPING_NEEDS_CHARGE"
+    MAPPING_PAUSED = "MAPPING_PAUSED"
+    MAPPING_RUNNING = "MAPPING_RUNNING"
+
+class VacuumPowerMode(Enum):
+    """Suction power of the 360 Eye"""
+
+    QUIET = "halfPower"
+    MAX = "fullPower"
+
+#states that end a clean, the other FULL_CLEAN_ and MAPPING_ states are part of one
+END_STATES = ('FULL_CLEAN_ABANDONED', 'FULL_CLEAN_ABORTED', 'FULL_CLEAN_FINISHED', 'MAPPING_ABORTED', 'MAPPING_FINISHED')
+PAUSED_STATES = ('FULL_CLEAN_PAUSED', 'MAPPING_PAUSED')
+
+#range of a stored step, larger steps are split
+DELTA_MIN, DELTA_MAX = -32768, 32767
+MAX_TIME_STEP = 65535
+
+def is_cleaning(state):
+    """whether the raw state string belongs to a running or paused clean"""
+    return state is not None and state.startswith(('FULL_CLEAN_', 'MAPPING_')) and state not in END_STATES
+
+class TrackBuffer(object):
+    """Positions of a clean, delta encoded in arrays of 16 bit integers
+
+    The first point is kept as is, every next one as the time (seconds) and
+    x, y steps from the previous one. When max_points is reached every other
+    point is dropped, the distance and bounds stay those of the full track.
+    """
+
+    def __init__(self, max_points=20000):
+        self.max_points = max_points
+        self._dt = array.array('H')
+        self._dx = array.array('h')
+        self._dy = array.array('h')
+        #(time, x, y) of the first and the last point
+        self.origin = None
+        self.last = None
+        self.distance = 0.0
+        self.bounds = None
+
+    def __len__(self):
+        return len(self._dx) + (1 if self.origin is not None else 0)
+
+    @property
+    def nbytes(self):
+        return sum(len(values) * values.itemsize for values in (self._dt, self._dx, self._dy))
+
+    def _encode(self, dt, dx, dy):
+        while not (dt <= MAX_TIME_STEP and DELTA_MIN <= dx <= DELTA_MAX and DELTA_MIN <= dy <= DELTA_MAX):
+            step_t = min(dt, MAX_TIME_STEP)
+            step_x = max(DELTA_MIN, min(dx, DELTA_MAX))
+            step_y = max(DELTA_MIN, min(dy, DELTA_MAX))
+            self._dt.append(step_t)
+            self._dx.append(step_x)
+            self._dy.append(step_y)
+            dt, dx, dy = dt - step_t, dx - step_x, dy - step_y
+        self._dt.append(dt)
+        self._dx.append(dx)
+        self._dy.append(dy)
+
+    def append(self, timestamp, x, y):
+        """add a position, returns False when the robot did not move"""
+        point = (int(timestamp), int(round(x)), int(round(y)))
+        if self.origin is None:
+            self.origin = self.last = point
+            self.bounds = [point[1], point[2], point[1], point[2]]
+            return True
+        if point[1:] == self.last[1:]:
+            return False
+        dt, dx, dy = max(0, point[0] - self.last[0]), point[1] - self.last[1], point[2] - self.last[2]
+        self.distance += math.hypot(dx, dy)
+        self.bounds = [min(self.bounds[0], point[1]), min(self.bounds[1], point[2]),
+                       max(self.bounds[2], point[1]), max(self.bounds[3], point[2])]
+        self._encode(dt, dx, dy)
+        self.last = (self.last[0] + dt, point[1], point[2])
+        if len(self) > self.max_points:
+            self._decimate()
+        return True
+
+    def points(self):
+        """the stored (time, x, y) points"""
+        if self.origin is None:
+            return
+        t, x, y = self.origin
+        yield t, x, y
+        for dt, dx, dy in zip(self._dt, self._dx, self._dy):
+            t, x, y = t + dt, x + dx, y + dy
+            yield t, x, y
+
+    def _decimate(self):
+        points = list(self.points())
+        kept = points[::2]
+        if kept[-1] != points[-1]:
+            kept.append(points[-1])
+        self._dt, self._dx, self._dy = array.array('H'), array.array('h'), array.array('h')
+        for previous, point in zip(kept, kept[1:]):
+            self._encode(point[0] - previous[0], point[1] - previous[1], point[2] - previous[2])
+
+class CleaningSession(object):
+    """A clean in progress"""
+
+    def __init__(self, clean_id, clean_type, start, battery, power_mode, max_points):
+        self.clean_id = clean_id
+        self.clean_type = clean_type
+        self.start = start
+        self.battery = battery
+        self.power_mode = power_mode
+        self.track = TrackBuffer(max_points)
+        self.paused = 0.0
+        self.paused_since = None
+
+    def set_paused(self, paused, now):
+        if paused and self.paused_since is None:
+            self.paused_since = now
+        elif not paused and self.paused_since is not None:
+            self.paused += now - self.paused_since
+            self.paused_since = None
+
+    def summary(self, end, state, battery):
+        """the clean reduced to a dict of plain values"""
+        self.set_paused(False, end)
+        return {
+            'clean_id': self.clean_id,
+            'type': self.clean_type,
+            'start': int(self.start),
+            'end': int(end),
+            'duration': int(end - self.start - self.paused),
+            'state': state,
+            'power_mode': self.power_mode,
+            'distance': int(self.track.distance),
+            'bounds': self.track.bounds,
+            'points': len(self.track),
+            'battery_used': self.battery - battery if self.battery is not None and battery is not None else None,
+        }
+
+def format_summary(summary):
+    """one line description of a clean summary"""
+    return "{0} {1} min, {2} ({3})".format(time.strftime('%Y-%m-%d %H:%M', time.localtime(summary['start'])),
+        summary['duration'] // 60, summary['state'].replace('_', ' ').lower(),
+        "battery -{0}%".format(summary['battery_used']) if summary['battery_used'] is not None else "battery unknown")
+
+class Dyson360Eye(DysonPureLinkDevice):
+    """360 Eye robot vacuum created from plugin parameters"""
+
+    def __init__(self, password, serialNumber, deviceType, name, max_points=20000, max_sessions=10):
+        super(Dyson360Eye, self).__init__(password, serialNumber, deviceType, name)
+        #raw state string, unknown states of newer firmware are kept as well
+        self.state = None
+        self.battery_level = None
+        self.power_mode = None
+        self.clean_id = None
+        self.clean_type = None
+        self.position = None
+        self.session = None
+        self.sessions = collections.deque(maxlen=max_sessions)
+        self._max_points = max_points
+
+    @property
+    def device_status(self):
+        return '{0}/{1}/status'.format(self.product_type, self.serial)
+
+    @property
+    def vacuum_state(self):
+        """state as VacuumState, None when unknown"""
+        try:
+            return VacuumState(self.state)
+        except ValueError:
+            return None
+
+    def _vacuum_command(self, msg, **fields):
+        command = {
+            'msg': msg,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'mode-reason': 'LAPP'}
+        command.update(fields)
+        return(self.device_command, json.dumps(command));
+
+    def start(self):
+        """Starts a full clean"""
+        return self._vacuum_command('START', fullCleanType='immediate')
+
+    def pause(self):
+        """Pauses the clean"""
+        return self._vacuum_command('PAUSE')
+
+    def resume(self):
+        """Resumes a paused clean"""
+        return self._vacuum_command('RESUME')
+
+    def abort(self):
+        """Stops the clean, the robot returns to its dock"""
+        return self._vacuum_command('ABORT')
+
+    def set_power_mode(self, mode):
+        """Changes the power mode: VacuumPowerMode or halfPower|fullPower"""
+        command = self._create_command({'defaultVacuumPowerMode': VacuumPowerMode(mode).value})
+        return(self.device_command, command);
+
+    def update(self, message, now=None):
+        """take in a status message, returns the summary of the clean it ended or None"""
+        now = time.time() if now is None else now
+        kind = message['msg']
+        if kind == 'CURRENT-STATE':
+            self.state = message['state']
+        elif kind == 'STATE-CHANGE':
+            self.state = message['newstate']
+        elif kind != 'MAP-GLOBAL':
+            return None
+        if kind == 'MAP-GLOBAL':
+            self.position = (message['x'], message['y'])
+        else:
+            self.battery_level = message.get('batteryChargeLevel', self.battery_level)
+            self.power_mode = message.get('currentVacuumPowerMode', self.power_mode)
+            #battery and position updates leave out the clean type
+            if 'fullCleanType' in message:
+                self.clean_type = message['fullCleanType'] or None
+            if message.get('globalPosition'):
+                self.position = tuple(message['globalPosition'][:2])
+        self.clean_id = message.get('cleanId') or self.clean_id
+        return self._update_session(now)
+
+    def _update_session(self, now):
+        summary = None
+        cleaning = is_cleaning(self.state)
+        if self.session is not None and (not cleaning or (self.clean_id and self.session.clean_id != self.clean_id)):
+            summary = self.session.summary(now, self.state, self.battery_level)
+            self.sessions.append(summary)
+            self.session = None
+        if cleaning and self.session is None:
+            self.session = CleaningSession(self.clean_id, self.clean_type, now, self.battery_level, self.power_mode, self._max_points)
+        if self.session is not None:
+            self.session.set_paused(self.state in PAUSED_STATES, now)
+            if self.position is not None:
+                self.session.track.append(now, *self.position)
+        return summary
@@ -19,6 +19,10 @@ class DysonPureLinkDevice(commands.DysonCommands):
     def password(self):
         return self._password
 
+    @property
+    def name(self):
+        return self._name
+
     @property
     def device_base_topic(self):
         return '{0}/{1}'.format(self.product_type, self.serial)
@@ -0,0 +1,173 @@
+"""Background task executor for slow I/O of the plugin
+
+Domoticz calls the plugin from a single thread, so blocking work (cloud HTTP
+requests, file writes) is handed to a small pool of worker threads. Results
+are not delivered from the workers: they are queued and the callbacks run
+when the plugin thread calls process_results() from onHeartbeat/onMessage.
+"""
+
+import queue, threading, time
+
+class TaskTimeout(Exception):
+    """Raised (passed to the errback) when a task did not finish within its timeout"""
+    pass
+
+class _Task(object):
+    __slots__ = ('name', 'func', 'args', 'kwargs', 'callback', 'errback', 'timeout',
+                 'submitted', 'started', 'finished', 'done')
+
+    def __init__(self, name, func, args, kwargs, callback, errback, timeout):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.errback = errback
+        self.timeout = timeout
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.done = False
+
+class TaskExecutor(object):
+    """Thread pool with bounded queues, per task timeouts and results marshalled to the caller thread"""
+
+    def __init__(self, workers=2, max_pending=32, max_results=64, timeout=60, name='DysonWorker'):
+        self._tasks = queue.Queue(maxsize=max_pending)
+        self._results = queue.Queue(maxsize=max_results)
+        self._timeout = timeout
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+        self.max_wait = 0.0
+        self.max_run = 0.0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name='{0}-{1}'.format(name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, callback=None, errback=None, timeout=None, name=None, **kwargs):
+        """queue func(*args, **kwargs) for a worker, returns False when the queue is full or stopping"""
+        if self._stopping:
+            self.rejected += 1
+            return False
+        task = _Task(name or getattr(func, '__name__', 'task'), func, args, kwargs, callback, errback,
+                     self._timeout if timeout is None else timeout)
+        try:
+            self._tasks.put_nowait(task)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.submitted += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._tasks.qsize())
+        return True
+
+    def _worker(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task.started = time.monotonic()
+            with self._lock:
+                self._running.add(task)
+            try:
+                result, error = task.func(*task.args, **task.kwargs), None
+            except Exception as inst:
+                result, error = None, inst
+            task.finished = time.monotonic()
+            with self._lock:
+                self._running.discard(task)
+            # blocks the worker when the plugin thread does not keep up, which bounds memory
+            self._results.put((task, result, error))
+
+    def process_results(self, max_items=None):
+        """run callbacks of finished tasks and errbacks of timed out tasks, to be called from the plugin thread"""
+        handled = 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [task for task in self._running if not task.done and task.timeout and now - task.started > task.timeout]
+        for task in expired:
+            task.done = True
+            self.timed_out += 1
+            self._call(task.errback, TaskTimeout("Task '{0}' did not finish within {1}s".format(task.name, task.timeout)))
+        while max_items is None or handled < max_items:
+            try:
+                task, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            handled += 1
+            wait = task.started - task.submitted
+            run = task.finished - task.started
+            self._wait_total += wait
+            self._run_total += run
+            self.max_wait = max(self.max_wait, wait)
+            self.max_run = max(self.max_run, run)
+            if task.done:
+                #already reported as timed out, drop the late result
+                continue
+            task.done = True
+            if error is None:
+                self.completed += 1
+                self._call(task.callback, result)
+            else:
+                self.failed += 1
+                self._call(task.errback, error)
+        return handled
+
+    @staticmethod
+    def _call(func, argument):
+        if func is not None:
+            func(argument)
+
+    @property
+    def queue_depth(self):
+        return self._tasks.qsize()
+
+    def metrics(self):
+        """counters and latencies (seconds) of the executor"""
+        finished = self.completed + self.failed
+        return {
+            'queue_depth': self._tasks.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'results_pending': self._results.qsize(),
+            'running': len(self._running),
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'timed_out': self.timed_out,
+            'rejected': self.rejected,
+            'avg_wait': self._wait_total / finished if finished else 0.0,
+            'max_wait': self.max_wait,
+            'avg_run': self._run_total / finished if finished else 0.0,
+            'max_run': self.max_run,
+        }
+
+    def shutdown(self, timeout=5):
+        """stop accepting tasks, drop the queued ones and wait for the workers to finish"""
+        self._stopping = True
+        while True:
+            try:
+                self._tasks.get_nowait()
+            except queue.Empty:
+                break
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            while thread.is_alive() and time.monotonic() < deadline:
+                #keep draining so a worker blocked on a full result queue can exit
+                try:
+                    self._results.get_nowait()
+                except queue.Empty:
+                    pass
+                thread.join(0.05)
+        return not any(thread.is_alive() for thread in self._threads)
@@ -0,0 +1,131 @@
+"""Filter replacement forecast from the filter_life history
+
+filter_life only goes down while the fan runs, and faster at higher speeds.
+Every state sample accumulates the runtime (and speed x runtime) since the
+previous one. Whenever filter_life drops, the consumption rate over that
+interval (life units per runtime hour) and the mean speed are fed to a
+recursive least squares fit of rate = a + b * speed, with exponential
+forgetting so the model follows an ageing filter. Together with the average
+share of the time the fan runs, this gives the expected replacement date.
+All updates are O(1) per sample.
+"""
+
+SECONDS_PER_HOUR = 3600.0
+
+#speed used for AUTO, the fan adjusts itself around the middle of the range
+AUTO_SPEED = 5.0
+
+class FilterForecast(object):
+    """Streaming regression of the filter consumption against runtime and fan speed"""
+
+    def __init__(self, forgetting=0.98, smoothing=0.05):
+        self.forgetting = forgetting
+        self.smoothing = smoothing
+        #RLS estimate of [a, b] and its 2x2 covariance
+        self.theta = [0.0, 0.0]
+        self.covariance = [[1000.0, 0.0], [0.0, 1000.0]]
+        self.observations = 0
+        self.last_time = None
+        self.last_life = None
+        self.last_running = False
+        self.last_speed = None
+        self.run_hours = 0.0
+        self.speed_hours = 0.0
+        self.total_life_used = 0.0
+        self.total_run_hours = 0.0
+        self.runtime_share = None
+        self.average_speed = None
+
+    @staticmethod
+    def speed_value(fan_speed):
+        """numeric fan speed of the wire value '0001'..'0010' or 'AUTO'"""
+        if fan_speed is None:
+            return None
+        if fan_speed == 'AUTO':
+            return AUTO_SPEED
+        try:
+            return float(int(fan_speed))
+        except ValueError:
+            return None
+
+    def _ewma(self, average, value):
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def add(self, timestamp, filter_life, fan_speed, running):
+        """add a state sample: remaining filter life, fan speed wire value and whether the fan runs"""
+        speed = self.speed_value(fan_speed)
+        if self.last_time is not None and timestamp > self.last_time:
+            hours = (timestamp - self.last_time) / SECONDS_PER_HOUR
+            run = hours if self.last_running else 0.0
+            self.run_hours += run
+            self.speed_hours += run * (self.last_speed or AUTO_SPEED)
+            self.runtime_share = self._ewma(self.runtime_share, run / hours)
+        if running and speed is not None:
+            self.average_speed = self._ewma(self.average_speed, speed)
+        if filter_life is not None:
+            if self.last_life is None or filter_life > self.last_life:
+                #first sample or new filter: start a new interval, keep the fitted model
+                self._restart_interval(filter_life)
+            elif filter_life < self.last_life:
+                used = self.last_life - filter_life
+                if self.run_hours > 0:
+                    self._observe(self.speed_hours / self.run_hours, used / self.run_hours)
+                    self.total_life_used += used
+                    self.total_run_hours += self.run_hours
+                self._restart_interval(filter_life)
+        self.last_time = timestamp
+        self.last_running = bool(running)
+        self.last_speed = speed if speed is not None else self.last_speed
+
+    def _restart_interval(self, filter_life):
+        self.last_life = filter_life
+        self.run_hours = 0.0
+        self.speed_hours = 0.0
+
+    def _observe(self, speed, rate):
+        """recursive least squares update of rate = a + b * speed"""
+        x = (1.0, speed)
+        p = self.covariance
+        px = (p[0][0] * x[0] + p[0][1] * x[1], p[1][0] * x[0] + p[1][1] * x[1])
+        denominator = self.forgetting + x[0] * px[0] + x[1] * px[1]
+        gain = (px[0] / denominator, px[1] / denominator)
+        error = rate - (self.theta[0] * x[0] + self.theta[1] * x[1])
+        self.theta = [self.theta[0] + gain[0] * error, self.theta[1] + gain[1] * error]
+        self.covariance = [[(p[i][j] - gain[i] * px[j]) / self.forgetting for j in range(2)] for i in range(2)]
+        self.observations += 1
+
+    def consumption_rate(self, speed=None):
+        """filter life used per runtime hour at speed (default the average speed)"""
+        speed = self.average_speed if speed is None else speed
+        if self.observations >= 3 and speed is not None:
+            rate = self.theta[0] + self.theta[1] * speed
+            if rate > 0:
+                return rate
+        #too few or inconsistent observations: overall average
+        if self.total_run_hours > 0 and self.total_life_used > 0:
+            return self.total_life_used / self.total_run_hours
+        return None
+
+    def hours_remaining(self):
+        """expected wall clock hours until the filter life reaches 0, None when unknown"""
+        rate = self.consumption_rate()
+        if rate is None or self.last_life is None or not self.runtime_share:
+            return None
+        return self.last_life / rate / self.runtime_share
+
+    def replacement_time(self):
+        """expected timestamp of the filter replacement, None when unknown"""
+        hours = self.hours_remaining()
+        return None if hours is None else self.last_time + hours * SECONDS_PER_HOUR
+
+    def to_dict(self):
+        return {key: (list(value) if isinstance(value, list) else value) for key, value in self.__dict__.items()}
+
+    @classmethod
+    def from_dict(cls, raw):
+        forecast = cls()
+        for key, value in (raw or {}).items():
+            if key in forecast.__dict__:
+                setattr(forecast, key, value)
+        forecast.covariance = [list(row) for row in forecast.covariance]
+        return forecast
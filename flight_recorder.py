@@ -0,0 +1,86 @@
+"""Flight recorder of the debug log
+
+Debug records are kept in a ring buffer with their arguments, the text is
+only formatted when the buffer is written out: on an error, on a lost
+connection or on demand (the /flight route of the metrics endpoint). So the
+debug context of the last minutes is there when something breaks, at the
+cost of a tuple per record. With the Debug or Verbose log level the records
+also go to the Domoticz log right away, as before.
+"""
+
+try:
+	import Domoticz
+except ImportError:
+	import fakeDomoticz as Domoticz
+import collections, os, threading, time
+
+#size of the flight log file before it is rotated to <file>.1
+MAX_FILE_SIZE = 1024 * 1024
+
+class FlightRecorder(object):
+    """Ring buffer of (time, level, message, args) records"""
+
+    def __init__(self, size=2000):
+        self.path = None
+        self.passthrough = False
+        self._records = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.flushes = 0
+
+    def configure(self, path=None, size=None, passthrough=False):
+        self.path = path
+        self.passthrough = passthrough
+        if size is not None and size != self._records.maxlen:
+            with self._lock:
+                self._records = collections.deque(self._records, maxlen=size)
+
+    def debug(self, message, *args):
+        """record a debug message, args are only formatted into it (with %) when written out"""
+        self._records.append((time.time(), 'DEBUG', message, args))
+        if self.passthrough:
+            Domoticz.Debug(message % args if args else message)
+
+    def log(self, message, *args):
+        self._records.append((time.time(), 'INFO', message, args))
+        Domoticz.Log(message % args if args else message)
+
+    def error(self, message, *args):
+        """log an error and write out the records leading to it"""
+        self._records.append((time.time(), 'ERROR', message, args))
+        Domoticz.Error(message % args if args else message)
+        self.flush('error')
+
+    @staticmethod
+    def _format(record):
+        timestamp, level, message, args = record
+        try:
+            text = message % args if args else message
+        except (TypeError, ValueError) as inst:
+            text = '{0} {1} ({2})'.format(message, args, inst)
+        return '{0}.{1:03d} {2:5} {3}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)),
+                                               int(timestamp * 1000) % 1000, level, text)
+
+    def dump(self, clear=False):
+        """the buffered records as text"""
+        with self._lock:
+            records = list(self._records)
+            if clear:
+                self._records.clear()
+        return ''.join(self._format(record) + '\n' for record in records)
+
+    def flush(self, reason):
+        """append the buffered records to the flight log file and empty the buffer"""
+        if self.path is None or not self._records:
+            return
+        text = '=== flight log written on {0} ===\n'.format(reason) + self.dump(clear=True)
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > MAX_FILE_SIZE:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'a') as log_file:
+                log_file.write(text)
+            self.flushes += 1
+        except OSError as inst:
+            Domoticz.Error("Writing flight log failed: '" + str(inst) + "'")
+
+#the recorder of the plugin
+recorder = FlightRecorder()
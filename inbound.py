@@ -0,0 +1,122 @@
+"""Inbound stage between the MQTT client and the message handling
+
+When the plugin falls behind, the device messages are not handled one by one.
+A newer sensor message replaces a pending one (a late, older one is queued
+with the other messages, ahead of the newer one). STATE-CHANGE messages are
+merged into one pending change set: for every field the old value of the
+first and the new value of the last message. A CURRENT-STATE replaces the
+pending CURRENT-STATE and takes the fields it reports out of the pending
+change set, it is handed out as a CURRENT-STATE ahead of the remaining
+changes. So a merge never turns a reported value into an [old, new] pair.
+Other messages are kept in a small bounded queue. So a burst never needs
+more than a few messages of memory and fresh data is never handled after
+stale data.
+
+The status messages of the 360 Eye robot do not pass the stage, its state
+transitions and positions are all needed in arrival order. Merged messages
+are not suited to confirm commands either, the plugin matches every
+STATE-CHANGE with the sent commands before it enters the stage.
+"""
+
+import collections, time
+
+STATE_MESSAGES = ('CURRENT-STATE', 'STATE-CHANGE')
+SENSOR_MESSAGES = ('ENVIRONMENTAL-CURRENT-SENSOR-DATA',)
+
+def merge_state_changes(pending, message):
+    """merge a STATE-CHANGE into the pending one"""
+    fields = dict(pending.get('product-state', {}))
+    for field, value in message.get('product-state', {}).items():
+        if field in fields and isinstance(fields[field], list) and isinstance(value, list):
+            value = [fields[field][0], value[-1]]
+        fields[field] = value
+    merged = dict(message)
+    merged['product-state'] = fields
+    return merged
+
+def without_fields(message, fields):
+    """the STATE-CHANGE without the given fields, None when nothing is left"""
+    remaining = {field: value for field, value in message.get('product-state', {}).items() if field not in fields}
+    if not remaining:
+        return None
+    message = dict(message)
+    message['product-state'] = remaining
+    return message
+
+class InboundStage(object):
+    """Bounded, collapsing buffer of the messages of the devices
+
+    Every message carries an opaque trace, handed out with it by drain(). A
+    merged change keeps the trace of the pending one, a message that replaces
+    a pending one brings its own."""
+
+    def __init__(self, max_other=16):
+        #topic: (message, trace) of the pending CURRENT-STATE and the pending STATE-CHANGE
+        self._current = {}
+        self._state = {}
+        self._sensors = {}
+        self._other = collections.deque(maxlen=max_other)
+        self.received = 0
+        self.collapsed = 0
+        self.dropped = 0
+        self.oldest = None
+
+    def __len__(self):
+        return len(self._current) + len(self._state) + len(self._sensors) + len(self._other)
+
+    def put(self, topic, message, now=None, trace=None):
+        now = time.monotonic() if now is None else now
+        self.received += 1
+        if self.oldest is None:
+            self.oldest = now
+        kind = message.get('msg') if isinstance(message, dict) else None
+        if kind == 'CURRENT-STATE':
+            if topic in self._current:
+                self.collapsed += 1
+            self._current[topic] = (message, trace)
+            pending = self._state.pop(topic, None)
+            if pending is not None:
+                #the reported values are newer than the pending changes of these fields
+                remaining = without_fields(pending[0], message.get('product-state', {}))
+                if remaining is None:
+                    self.collapsed += 1
+                else:
+                    self._state[topic] = (remaining, pending[1])
+        elif kind == 'STATE-CHANGE':
+            pending = self._state.get(topic)
+            if pending is not None:
+                message, trace = merge_state_changes(pending[0], message), pending[1]
+                self.collapsed += 1
+            self._state[topic] = (message, trace)
+        elif kind in SENSOR_MESSAGES:
+            pending = self._sensors.get(topic)
+            if pending is not None and str(message.get('time', '')) < str(pending[0].get('time', '')):
+                #a late reading does not replace a newer one, it goes to the history
+                self._queue(topic, message, trace)
+                return
+            if pending is not None:
+                self.collapsed += 1
+            self._sensors[topic] = (message, trace)
+        else:
+            self._queue(topic, message, trace)
+
+    def _queue(self, topic, message, trace):
+        if len(self._other) == self._other.maxlen:
+            self.dropped += 1
+        self._other.append((topic, message, trace))
+
+    def drain(self, now=None):
+        """remove and return the pending (topic, message, trace) and the lag of the oldest one in seconds"""
+        now = time.monotonic() if now is None else now
+        lag = now - self.oldest if self.oldest is not None else 0.0
+        messages = []
+        for pending in (self._current, self._state):
+            messages.extend((topic, message, trace) for topic, (message, trace) in pending.items())
+        messages.extend(self._other)
+        messages.extend((topic, message, trace) for topic, (message, trace) in self._sensors.items())
+        self._current.clear()
+        self._state.clear()
+        self._sensors.clear()
+        self._other.clear()
+        self.oldest = None
+        return messages, lag
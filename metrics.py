@@ -0,0 +1,120 @@
+"""Prometheus exporter of the device values and the plugin internals
+
+Values are recorded on the plugin thread. The exposition text is rendered
+there too, from the heartbeat and only when something changed, and then
+published as one immutable bytes object. The HTTP server thread
+(metrics_server, only loaded when a port is configured) hands out the latest
+rendered text, so a scrape never waits for the plugin or formats anything.
+"""
+
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(key, _escape(value)) for key, value in labels) + '}'
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class MetricsExporter(object):
+    """Gauges, counters and summaries with a pre-rendered exposition text"""
+
+    def __init__(self, prefix='dyson'):
+        self.prefix = prefix
+        #name: (type, help, {labels: value}), a summary value is [sum, count]
+        self._families = {}
+        self._text = b''
+        self.dirty = False
+        self.renders = 0
+
+    def _family(self, name, kind, help):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = (kind, help, {})
+        return family[2]
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items())) if labels else ()
+
+    def set(self, name, value, labels=None, help=''):
+        """set a gauge, a value of None removes it"""
+        values = self._family(name, 'gauge', help)
+        key = self._key(labels)
+        if value is None:
+            if values.pop(key, None) is not None:
+                self.dirty = True
+        elif values.get(key) != value:
+            values[key] = value
+            self.dirty = True
+
+    def inc(self, name, amount=1, labels=None, help=''):
+        """increase a counter"""
+        values = self._family(name, 'counter', help)
+        key = self._key(labels)
+        values[key] = values.get(key, 0) + amount
+        self.dirty = True
+
+    def observe(self, name, value, labels=None, help=''):
+        """add an observation (e.g. a duration in seconds) to a summary"""
+        values = self._family(name, 'summary', help)
+        key = self._key(labels)
+        summary = values.setdefault(key, [0.0, 0])
+        summary[0] += value
+        summary[1] += 1
+        self.dirty = True
+
+    def render(self):
+        """render the exposition text when something changed, to be called from the plugin thread"""
+        if not self.dirty and self.renders:
+            return False
+        lines = []
+        for name in sorted(self._families):
+            kind, help, values = self._families[name]
+            full_name = self.prefix + '_' + name
+            if kind == 'counter':
+                #the family has the name of its samples, HELP and TYPE included
+                full_name += '_total'
+            if help:
+                lines.append('# HELP {0} {1}'.format(full_name, help))
+            lines.append('# TYPE {0} {1}'.format(full_name, kind))
+            for labels, value in sorted(values.items()):
+                if kind == 'summary':
+                    lines.append('{0}_sum{1} {2}'.format(full_name, _format_labels(labels), _format_value(value[0])))
+                    lines.append('{0}_count{1} {2}'.format(full_name, _format_labels(labels), value[1]))
+                else:
+                    lines.append('{0}{1} {2}'.format(full_name, _format_labels(labels), _format_value(value)))
+        #replacing the reference is atomic, the server thread sees the old or the new text
+        self._text = ('\n'.join(lines) + '\n').encode()
+        self.dirty = False
+        self.renders += 1
+        return True
+
+    def exposition(self):
+        """latest rendered text, safe to call from any thread"""
+        return self._text
+
+class CallbackTimer(object):
+    """context manager adding the duration of a callback to a summary of the exporter"""
+
+    def __init__(self, exporter, callback):
+        self.exporter = exporter
+        self.labels = {'callback': callback}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.exporter is not None:
+            self.exporter.observe('callback_seconds', time.perf_counter() - self.start, self.labels,
+                                  help='Time spent in plugin callbacks')
+        return False
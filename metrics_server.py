@@ -0,0 +1,57 @@
+"""HTTP endpoint of the Prometheus exporter
+
+Separate from metrics so http.server is only loaded when metrics.port is
+set, most installs leave the endpoint off.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics import CONTENT_TYPE
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        route = self.server.routes.get(self.path.split('?')[0])
+        if route is None:
+            self.send_error(404)
+            return
+        content_type, producer = route
+        body = producer()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer(object):
+    """Optional HTTP server on its own thread, serves /metrics and any added route"""
+
+    def __init__(self, exporter, address='127.0.0.1', port=9850):
+        self.address = address
+        self.port = port
+        self.routes = {'/metrics': (CONTENT_TYPE, exporter.exposition)}
+        self._server = None
+        self._thread = None
+
+    def add_route(self, path, content_type, producer):
+        """serve the bytes returned by producer (called on the server thread) at path"""
+        self.routes[path] = (content_type, producer)
+        if self._server is not None:
+            self._server.routes = dict(self.routes)
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.address, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.routes = dict(self.routes)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -7,6 +7,8 @@ except ImportError:
 	debug = True
 import time
 import json
+from tracing import tracer
+from flight_recorder import recorder
 
 class MqttClient:
     Address = ""
@@ -37,24 +39,30 @@ class MqttClient:
             return "None"
 
     def Open(self):
-        Domoticz.Debug("MqttClient::Open")
+        recorder.debug("MqttClient::Open")
         if (self.mqttConn != None):
             self.Close()
         self.isConnected = False
 
         protocol = "MQTTS" if self.port == "8883" else "MQTT"
 
-        Domoticz.Debug("MqttClient::Open: setup Domoticz connection object with protocol: '"+protocol+"'")
+        recorder.debug("MqttClient::Open: setup Domoticz connection object with protocol: '%s'", protocol)
         self.mqttConn = Domoticz.Connection(Name=self.address, Transport="TCP/IP", Protocol=protocol, Address=self.address, Port=self.port)
-        Domoticz.Debug("MqttClient::Open: open connection")
+        recorder.debug("MqttClient::Open: open connection")
         self.mqttConn.Connect()
 
+    def SetAddress(self, destination, port):
+        recorder.debug("MqttClient::SetAddress %s:%s", destination, port)
+        self.address = destination
+        self.port = port
+        self.Open()
+
     def Connect(self):
-        Domoticz.Debug("MqttClient::Connect")
+        recorder.debug("MqttClient::Connect")
         if (self.mqttConn == None):
             self.Open()
         else:
-            Domoticz.Debug("MqttClient::MQTT CONNECT ID: '" + self.client_id + "'")
+            recorder.debug("MqttClient::MQTT CONNECT ID: '%s'", self.client_id)
             self.mqttConn.Send({'Verb': 'CONNECT', 'ID': self.client_id})
 
     def Ping(self):
@@ -65,14 +73,15 @@ class MqttClient:
             self.mqttConn.Send({'Verb': 'PING'})
 
     def Publish(self, topic, payload, retain = 0):
-        Domoticz.Debug("MqttClient::Publish " + topic + " (" + payload + ")")
+        recorder.debug("MqttClient::Publish %s (%s)", topic, payload)
         if (self.mqttConn == None or not self.isConnected):
             self.Open()
         else:
             self.mqttConn.Send({"Verb": "PUBLISH", "Topic": topic, "Payload": bytearray(payload, "utf-8"), "Retain": retain})
+            tracer.stamp('publish')
 
     def Subscribe(self, topics):
-        Domoticz.Debug("MqttClient::Subscribe to topics: " + str(topics))
+        recorder.debug("MqttClient::Subscribe to topics: %s", topics)
         subscriptionlist = []
         for topic in topics:
             subscriptionlist.append({'Topic':topic, 'QoS':0})
@@ -81,22 +90,26 @@ class MqttClient:
         else:
             self.mqttConn.Send({'Verb': 'SUBSCRIBE', 'Topics': subscriptionlist})
 
+    def Connecting(self):
+        """True while a connection attempt is in progress"""
+        return self.mqttConn is not None and self.mqttConn.Connecting()
+
     def Close(self):
-        Domoticz.Debug("MqttClient::Close")
+        recorder.debug("MqttClient::Close")
         #TODO: Disconnect from server
         self.mqttConn = None
         self.isConnected = False
 
     def onConnect(self, Connection, Status, Description):
-        Domoticz.Debug("MqttClient::onConnect")
+        recorder.debug("MqttClient::onConnect")
         if (Status == 0):
-            Domoticz.Debug("MqttClient::MQTT connected successfully.")
+            recorder.debug("MqttClient::MQTT connected successfully.")
             self.Connect()
         else:
             Domoticz.Log("MqttClient::Failed to connect to: " + Connection.Address + ":" + Connection.Port + ", Description: " + Description)
 
     def onDisconnect(self, Connection):
-        Domoticz.Debug("MqttClient::onDisonnect Disconnected from: " + Connection.Address+":" + Connection.Port)
+        recorder.debug("MqttClient::onDisonnect Disconnected from: %s:%s", Connection.Address, Connection.Port)
         self.Close()
         # TODO: Reconnect?
         if self.mqttDisconnectedCb != None:
@@ -105,22 +118,26 @@ class MqttClient:
     def onHeartbeat(self):
         #Domoticz.Debug("MqttClient::onHeartbeat")
         if self.mqttConn is None or (not self.mqttConn.Connecting() and not self.mqttConn.Connected() or not self.isConnected):
-            Domoticz.Debug("MqttClient::Reconnecting")
+            recorder.debug("MqttClient::Reconnecting")
             self.Open()
         else:
             self.Ping()
 
     def onMessage(self, Connection, Data):
         #Domoticz.Debug("MqttClient::onMessage")
+        trace = tracer.start(Data.get('Topic', '')) if Data['Verb'] == "PUBLISH" else None
+        try:
+            self.handleMessage(Connection, Data)
+        finally:
+            tracer.finish(trace)
+
+    def handleMessage(self, Connection, Data):
+        tracer.stamp('receive')
         topic = ''
         if 'Topic' in Data:
             topic = Data['Topic']
-        payloadStr = ''
-        if 'Payload' in Data:
-            payloadStr = Data['Payload'].decode('utf8','replace')
-            payloadStr = str(payloadStr.encode('unicode_escape'))
 
-        Domoticz.Debug("MqttClient::onMessage Topic '"+topic+"', Data[Verb]: '"+Data['Verb']+"'")
+        recorder.debug("MqttClient::onMessage Topic '%s', Data[Verb]: '%s'", topic, Data['Verb'])
         if Data['Verb'] == "CONNACK":
             self.isConnected = True
             if self.mqttConnectedCb != None:
@@ -139,5 +156,6 @@ class MqttClient:
                     message = json.loads(rawmessage)
                 except ValueError:
                     message = rawmessage
+                tracer.stamp('json')
                     
                 self.mqttPublishCb(topic, message)
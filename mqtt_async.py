@@ -0,0 +1,230 @@
+"""Minimal asyncio MQTT 3.1.1 client for running without Domoticz
+
+The plugin talks MQTT through the Domoticz connection object (see mqtt.py).
+The headless runners need their own transport, this client implements the
+small subset the Dyson devices use: CONNECT with username/password,
+SUBSCRIBE, PUBLISH (QoS 0, optionally retained) and keep alive pings.
+Callbacks follow the ones of MqttClient: connected, disconnected and
+publish(topic, message) with the payload decoded from JSON when possible.
+"""
+
+import asyncio, json, struct, time
+
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x82
+SUBACK = 0x90
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+class MqttProtocolError(Exception):
+    """Unexpected or malformed MQTT packet"""
+    pass
+
+class MqttConnectionRefused(Exception):
+    """The broker answered CONNECT with a non zero return code"""
+
+    def __init__(self, return_code):
+        super(MqttConnectionRefused, self).__init__(return_code)
+        self.return_code = return_code
+
+def _encode_length(length):
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        encoded.append(byte | 0x80 if length > 0 else byte)
+        if length == 0:
+            return bytes(encoded)
+
+def _encode_string(value):
+    data = value.encode('utf-8') if isinstance(value, str) else value
+    return struct.pack('!H', len(data)) + data
+
+def _packet(header, body=b''):
+    return bytes([header]) + _encode_length(len(body)) + body
+
+def connect_packet(client_id, username=None, password=None, keepalive=60):
+    flags = 0x02 #clean session
+    payload = _encode_string(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += _encode_string(username)
+    if password is not None:
+        flags |= 0x40
+        payload += _encode_string(password)
+    return _packet(CONNECT, _encode_string('MQTT') + bytes([4, flags]) + struct.pack('!H', keepalive) + payload)
+
+def publish_packet(topic, payload, retain=False):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return _packet(PUBLISH | (0x01 if retain else 0), _encode_string(topic) + payload)
+
+def subscribe_packet(packet_id, topics):
+    body = struct.pack('!H', packet_id)
+    for topic in topics:
+        body += _encode_string(topic) + b'\x00'
+    return _packet(SUBSCRIBE, body)
+
+async def read_packet(reader):
+    """read one packet, returns (header byte, body)"""
+    header = (await reader.readexactly(1))[0]
+    length, multiplier = 0, 1
+    for _ in range(4):
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 0x7F) * multiplier
+        if not byte & 0x80:
+            break
+        multiplier *= 128
+    else:
+        raise MqttProtocolError("Malformed remaining length")
+    return header, await reader.readexactly(length) if length else b''
+
+def parse_publish(header, body):
+    """returns (topic, payload bytes, packet id or None) of a PUBLISH packet"""
+    topic_length = struct.unpack('!H', body[:2])[0]
+    topic = body[2:2 + topic_length].decode('utf-8')
+    position = 2 + topic_length
+    packet_id = None
+    if (header >> 1) & 0x03:
+        packet_id = struct.unpack('!H', body[position:position + 2])[0]
+        position += 2
+    return topic, body[position:], packet_id
+
+def decode_payload(payload):
+    """decode a payload like MqttClient.onMessage: JSON when possible, text otherwise"""
+    rawmessage = payload.decode('utf8', 'replace')
+    try:
+        return json.loads(rawmessage)
+    except ValueError:
+        return rawmessage
+
+class AsyncMqttClient(object):
+    """MQTT client connection with automatic reconnect, driven by run()"""
+
+    def __init__(self, address, port, client_id, username=None, password=None,
+                 connected_cb=None, disconnected_cb=None, publish_cb=None,
+                 keepalive=60, ssl_context=None, connect_timeout=10,
+                 reconnect_delay=1, max_reconnect_delay=300, decode=True):
+        self.address = address
+        self.port = int(port)
+        self.client_id = client_id if client_id else 'Dyson_' + str(int(time.time()))
+        self.username = username
+        self.password = password
+        self.connected_cb = connected_cb
+        self.disconnected_cb = disconnected_cb
+        self.publish_cb = publish_cb
+        self.keepalive = keepalive
+        self.ssl_context = ssl_context
+        self.connect_timeout = connect_timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.decode = decode
+        self.is_connected = False
+        self.reconnects = 0
+        self._writer = None
+        self._packet_id = 0
+        self._stopped = False
+        self._stop_event = None
+
+    def __str__(self):
+        return "{0}:{1}".format(self.address, self.port)
+
+    async def connect(self):
+        """open the connection and do the CONNECT handshake, raises on failure"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, self.port, ssl=self.ssl_context), self.connect_timeout)
+        try:
+            writer.write(connect_packet(self.client_id, self.username, self.password, self.keepalive))
+            await writer.drain()
+            header, body = await asyncio.wait_for(read_packet(reader), self.connect_timeout)
+            if header & 0xF0 != CONNACK or len(body) != 2:
+                raise MqttProtocolError("Expected CONNACK, got packet type {0:#x}".format(header))
+            if body[1] != 0:
+                raise MqttConnectionRefused(body[1])
+        except BaseException:
+            writer.close()
+            raise
+        self._writer = writer
+        self.is_connected = True
+        return reader, writer
+
+    async def run(self):
+        """keep the connection open until stop() is called, reconnecting with exponential backoff"""
+        self._stop_event = asyncio.Event()
+        delay = self.reconnect_delay
+        while not self._stopped:
+            try:
+                reader, writer = await self.connect()
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, MqttProtocolError, MqttConnectionRefused):
+                await self._sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                self.reconnects += 1
+                continue
+            delay = self.reconnect_delay
+            if self.connected_cb is not None:
+                self.connected_cb()
+            pinger = asyncio.ensure_future(self._ping_loop())
+            try:
+                await self._read_loop(reader)
+            except (OSError, asyncio.IncompleteReadError, MqttProtocolError):
+                pass
+            finally:
+                pinger.cancel()
+                self.is_connected = False
+                self._writer = None
+                writer.close()
+            if self.disconnected_cb is not None:
+                self.disconnected_cb()
+            if not self._stopped:
+                self.reconnects += 1
+                await self._sleep(delay)
+
+    async def _sleep(self, delay):
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _read_loop(self, reader):
+        while not self._stopped:
+            header, body = await read_packet(reader)
+            packet_type = header & 0xF0
+            if packet_type == PUBLISH:
+                topic, payload, packet_id = parse_publish(header, body)
+                if packet_id is not None:
+                    self._send(_packet(PUBACK, struct.pack('!H', packet_id)))
+                if self.publish_cb is not None:
+                    self.publish_cb(topic, decode_payload(payload) if self.decode else payload)
+
+    async def _ping_loop(self):
+        while True:
+            await asyncio.sleep(max(1, self.keepalive / 2))
+            self._send(_packet(PINGREQ))
+
+    def _send(self, data):
+        if self._writer is None or not self.is_connected:
+            return False
+        self._writer.write(data)
+        return True
+
+    def publish(self, topic, payload, retain=False):
+        """send a QoS 0 message, returns False when not connected"""
+        return self._send(publish_packet(topic, payload, retain))
+
+    def subscribe(self, topics):
+        """subscribe to the topics with QoS 0, returns False when not connected"""
+        self._packet_id = self._packet_id % 0xFFFF + 1
+        return self._send(subscribe_packet(self._packet_id, topics))
+
+    def stop(self):
+        """disconnect and end run()"""
+        self._stopped = True
+        self._send(_packet(DISCONNECT))
+        if self._writer is not None:
+            self._writer.close()
+        if self._stop_event is not None:
+            self._stop_event.set()
@@ -72,12 +72,34 @@ except ImportError:
 	import fakeDomoticz as Domoticz
 	debug = True
 import json
+import os
 import time
 from mqtt import MqttClient
 from dyson_pure_link_device import DysonPureLinkDevice
-from cloud.account import DysonAccount
+from dyson_360_eye import Dyson360Eye, VacuumPowerMode, format_summary, is_cleaning, PAUSED_STATES
+from const import DEVICE_TYPE_360_EYE
+from snapshot import DeviceSnapshot, snapshot_path, write_snapshot
+from executor import TaskExecutor
+from scheduler import TimerWheel
+from discovery_cache import DiscoveryCache, CACHE_FILE
 
-from value_types import SensorsData, StateData
+from value_types import SensorsData, StateData, changed_fields
+from aqi import AirQualityEngine
+from filter_forecast import FilterForecast
+from settings import default_settings, load_settings, SettingsError
+from alerts import AlertEngine, AlertRuleError
+from metrics import CallbackTimer, MetricsExporter
+from tracing import tracer
+from command_tracker import CommandTracker
+from debouncer import CommandDebouncer
+from command_filter import CommandFilter
+from schedules import Schedule, ScheduleEngine, ScheduleError, command_data
+from cloud.exceptions import DysonException
+from throttle import WriteThrottle, SKIP, REFRESH
+from inbound import InboundStage
+from readings import ReadingDedupe, message_time
+from flight_recorder import recorder
+from session_cache import SessionCache, cache_dir, fetch_devices, LOCK_TIMEOUT
 
 class DysonPureLinkPlugin:
     #define class variables
@@ -109,9 +131,32 @@ class DysonPureLinkPlugin:
     heatStateUnit = 20
     particlesMatter25Unit = 21
     particlesMatter10Unit = 22
+    usAqiUnit = 23
+    caqiUnit = 24
+    filterForecastUnit = 25
+    alertUnit = 26
+    #for the 360 Eye robot vacuum
+    vacuumStateUnit = 27
+    vacuumBatteryUnit = 28
+    vacuumCleanUnit = 29
+    vacuumPowerUnit = 30
+    vacuumSessionUnit = 31
 
-    runCounter = 6
-    pingCounter = 3
+    #timing of the scheduled jobs, in seconds
+    heartbeatInterval = 10
+    pingInterval = 10
+    reconnectDelay = 10
+    maxReconnectDelay = 300
+    snapshotInterval = 60
+    readingsCompactInterval = 600
+    #the same command given again within this time is sent even when the device seems to have the values
+    repeatWindow = 10
+    #look for devices verified by another instance while an OTP code is pending
+    cloudSessionInterval = 60
+    #failed connection attempts before the device is looked for at another address
+    rediscoverAfter = 3
+    #minimal time between two network scans for the device (seconds)
+    rediscoverInterval = 600
 
     def __init__(self):
         self.myDevice = None
@@ -122,16 +167,51 @@ class DysonPureLinkPlugin:
         self.state_data = None
         self.mqttClient = None
         self.log_level = None
+        self.snapshot = None
+        self.snapshotFile = None
+        #background snapshot writes not reported back yet
+        self.snapshotWrites = 0
+        self.executor = None
+        self.discoveryCache = None
+        self.connectFailures = 0
+        self.discovering = False
+        self.nextDiscovery = 0
+        self.scheduler = None
+        self.pollInterval = None
+        self.reconnectJob = None
+        self.reconnectBackoff = self.reconnectDelay
+        self.airQuality = AirQualityEngine()
+        self.filterForecast = FilterForecast()
+        self.settings = None
+        self.alerts = None
+        self.stateValues = None
+        self.sensorValues = None
+        self.metrics = MetricsExporter()
+        self.metricsServer = None
+        self.commandTracker = None
+        self.optimistic = False
+        self.debouncer = None
+        self.commandFilter = None
+        self.lastPress = None
+        self.lastPressTime = 0
+        self.schedules = None
+        self.sensorThrottle = WriteThrottle({})
+        self.inbound = InboundStage()
+        self.drainInterval = 0
+        self.lastDrain = 0
+        self.currentHeartbeat = None
+        self.readings = ReadingDedupe()
+        self.disconnectedAt = None
+        self.challengeId = None
 
     def onStart(self):
-        Domoticz.Debug("onStart called")
+        recorder.debug("onStart called")
         #read out parameters for local connection
         self.ip_address = Parameters["Address"].strip()
         self.port_number = Parameters["Port"].strip()
         self.otp_code = Parameters['Mode1']
-        self.runCounter = int(Parameters['Mode2'])
+        self.pollInterval = int(Parameters['Mode2']) * self.heartbeatInterval
         self.log_level = Parameters['Mode4']
-        self.pingCounter = int(self.runCounter/2)
         self.account_password = Parameters['Mode3']
         self.account_email = Parameters['Mode5']
         self.machine_name = Parameters['Mode6']
@@ -147,86 +227,186 @@ class DysonPureLinkPlugin:
             Config = {}
             Config = Domoticz.Configuration(Config)
                 
-        #PureLink needs polling, get from config
-        Domoticz.Heartbeat(10)
+        #PureLink needs polling, the heartbeat drives the scheduled jobs
+        self.updateHeartbeat()
+        self.scheduler = TimerWheel(self.heartbeatInterval)
         
         self.checkVersion(self.version)
-        
-        mqtt_client_id = ""
-        
+
+        try:
+            self.settings = load_settings(Parameters['HomeFolder'], Parameters['HardwareID'])
+        except SettingsError as inst:
+            recorder.error(str(inst) + ", using the default settings")
+            self.settings = default_settings()
+        try:
+            self.alerts = AlertEngine(self.settings['alerts'], self.onAlert)
+        except AlertRuleError as inst:
+            recorder.error(str(inst) + ", alerts are disabled")
+        self.commandTracker = CommandTracker(float(self.settings['commands']['deadline']))
+        self.optimistic = bool(self.settings['commands'].get('optimistic'))
+        self.sensorThrottle = WriteThrottle(self.settings['sensor_writes'])
+        self.inbound = InboundStage(int(self.settings['inbound']['max_other']))
+        self.drainInterval = float(self.settings['inbound']['drain_interval'])
+        readings = self.settings['readings']
+        self.readings = ReadingDedupe(float(readings['max_age']), float(readings['clock_reset']))
+        debounce = self.settings['commands']['debounce']
+        if debounce.get('quiet'):
+            self.debouncer = CommandDebouncer(float(debounce['quiet']), float(debounce.get('max_latency', 3)))
+        if self.settings['commands']['filter_max_age']:
+            self.commandFilter = CommandFilter(float(self.settings['commands']['filter_max_age']))
+        recorder.configure(os.path.join(Parameters['HomeFolder'], "flight_" + str(Parameters['HardwareID']) + ".log"),
+            int(self.settings['flight_recorder']['size']), self.log_level in ('Debug', 'Verbose'))
+        tracer.configure(self.settings['tracing'].get('enabled'), self.settings['tracing'].get('size'))
+        self.startMetricsServer(self.settings['metrics'])
+
+        self.executor = TaskExecutor()
+
         #create a Dyson account
         deviceList = self.get_device_names()
 
         if deviceList != None and len(deviceList)>0:
-            Domoticz.Debug("Number of devices found in plugin configuration: '"+str(len(deviceList))+"'")
+            recorder.debug("Number of devices found in plugin configuration: '%s'", len(deviceList))
+            self.startDevice(deviceList)
         else:
             Domoticz.Log("No devices found in plugin configuration, request from Dyson cloud account")
+            self.provisionFromCloud()
 
-            #new authentication
-            Domoticz.Debug("=== start making connection to Dyson account, new method as of 2021 ===")
-            dysonAccount2 = DysonAccount()
-            challenge_id = getConfigItem(Key="challenge_id", Default = "")
-            setConfigItem(Key="challenge_id", Value = "") #clear after use
-            if challenge_id == "":
-                #request otp code via email when no code entered
-                challenge_id = dysonAccount2.login_email_otp(self.account_email, "NL")
-                setConfigItem(Key="challenge_id", Value = challenge_id)
-                Domoticz.Log('==== An OTP verification code had been requested, please check email and paste code into plugin=====')
-                return
+    def startMetricsServer(self, config):
+        """serve the Prometheus metrics when a port is configured"""
+        if not config.get('port'):
+            return
+        from metrics_server import MetricsServer
+        self.metricsServer = MetricsServer(self.metrics, config.get('address', '127.0.0.1'), int(config['port']))
+        try:
+            self.metricsServer.start()
+        except OSError as inst:
+            recorder.error("Metrics endpoint could not be started on port " + str(config['port']) + ": '" + str(inst) + "'")
+            self.metricsServer = None
+            return
+        if tracer.enabled:
+            self.metricsServer.add_route('/trace', 'application/json', tracer.dump)
+        self.metricsServer.add_route('/flight', 'text/plain; charset=utf-8', lambda: recorder.dump().encode())
+        Domoticz.Log("Metrics served on http://" + self.metricsServer.address + ":" + str(self.metricsServer.port) + "/metrics")
+
+    def provisionFromCloud(self, poll=False):
+        """get the devices from the Dyson cloud account through the session cache shared with the other instances, the requests run in the background
+
+        poll only looks for the devices another instance got meanwhile, it does not use or request an OTP code"""
+        recorder.debug("=== start making connection to Dyson account, new method as of 2021 ===")
+        otp_code = self.otp_code if self.otp_code not in ("", "0") and not poll else None
+        if otp_code is not None and len(otp_code) < 6:
+            recorder.error("invalid verification code supplied")
+            return
+        cache = SessionCache(cache_dir(Parameters['HomeFolder'], self.account_email))
+        #after a reset the manifest is fetched again, with the cached token when it is still valid
+        max_age = 0 if self.log_level == 'Reset' else None
+        self.executor.submit(fetch_devices, cache, self.account_email, self.account_password, otp_code, "NL", not poll, max_age,
+            callback=self.onCloudSession, errback=self.onCloudError, timeout=LOCK_TIMEOUT + 60, name="fetch_devices")
+
+    def onCloudSession(self, result):
+        deviceList, challenge_id, log = result
+        self.logCloudRequests(log)
+        if deviceList is not None:
+            self.onCloudDevices(deviceList)
+            return
+        if challenge_id is None:
+            recorder.error("The OTP verification code is no longer valid, restart the plugin to request a new one")
+            return
+        if challenge_id != self.challengeId:
+            self.challengeId = challenge_id
+            Domoticz.Log('==== An OTP verification code had been requested, please check email and paste code into plugin=====')
+        #the code may be entered in another instance, which puts the devices in the shared cache
+        self.scheduler.schedule("cloud.session", lambda: self.provisionFromCloud(poll=True), self.cloudSessionInterval)
+
+    def logCloudRequests(self, log):
+        """log the lines of the cloud requests made on a worker thread"""
+        for level, text in log:
+            if level == 'error':
+                recorder.error(text)
             else:
-                #verify the received code
-                if len(self.otp_code) < 6:
-                    Domoticz.Error("invalid verification code supplied")
-                    return
-                dysonAccount2.verify(self.otp_code, self.account_email, self.account_password, challenge_id)
-                setConfigItem(Key="challenge_id", Value = "") #reset challenge id as it is no longer valid
-                Parameters['Mode1'] = "0" #reset the stored otp code
-                #get list of devices info's
-                deviceList = dysonAccount2.devices()
-                deviceNames = list(deviceList.keys())
-                Domoticz.Log("Received new devices: " + str(deviceNames) + ", they will be stored in plugin configuration")
-                i=0
-                for device in deviceList:
-                    setConfigItem(Key="{0}.name".format(i), Value = deviceNames[i]) #store the name of the machine
-                    Domoticz.Debug('Key="{0}.name", Value = {1}'.format(i, deviceNames[i])) #store the name of the machine
-                    setConfigItem(Key="{0}.credential".format(deviceList[deviceNames[i]].name), Value = deviceList[deviceNames[i]].credential) #store the credential
-                    Domoticz.Debug('Key="{0}.credential", Value = {1}'.format(deviceList[deviceNames[i]].name, deviceList[deviceNames[i]].credential)) #store the credential
-                    setConfigItem(Key="{0}.serial".format(deviceList[deviceNames[i]].name), Value = deviceList[deviceNames[i]].serial) #store the serial
-                    Domoticz.Debug('Key="{0}.serial", Value =  {1}'.format(deviceList[deviceNames[i]].name, deviceList[deviceNames[i]].serial)) #store the serial
-                    setConfigItem(Key="{0}.product_type".format(deviceList[deviceNames[i]].name), Value = deviceList[deviceNames[i]].product_type) #store the product_type
-                    Domoticz.Debug('Key="{0}.product_type" , Value = {1}'.format(deviceList[deviceNames[i]].name, deviceList[deviceNames[i]].product_type)) #store the product_type
-                    i = i + 1
+                #the request data holds credentials, kept out of the flight recorder
+                Domoticz.Debug(text)
+
+    def onCloudDevices(self, deviceList):
+        Parameters['Mode1'] = "0" #reset the stored otp code
+        deviceNames = list(deviceList.keys())
+        Domoticz.Log("Received new devices: " + str(deviceNames) + ", they will be stored in plugin configuration")
+        i=0
+        for device in deviceList:
+            setConfigItem(Key="{0}.name".format(i), Value = deviceNames[i]) #store the name of the machine
+            recorder.debug('Key="%s.name", Value = %s', i, deviceNames[i]) #store the name of the machine
+            setConfigItem(Key="{0}.credential".format(deviceList[deviceNames[i]].name), Value = deviceList[deviceNames[i]].credential) #store the credential
+            Domoticz.Debug('Key="{0}.credential", Value = {1}'.format(deviceList[deviceNames[i]].name, deviceList[deviceNames[i]].credential)) #store the credential
+            setConfigItem(Key="{0}.serial".format(deviceList[deviceNames[i]].name), Value = deviceList[deviceNames[i]].serial) #store the serial
+            recorder.debug('Key="%s.serial", Value =  %s', deviceList[deviceNames[i]].name, deviceList[deviceNames[i]].serial) #store the serial
+            setConfigItem(Key="{0}.product_type".format(deviceList[deviceNames[i]].name), Value = deviceList[deviceNames[i]].product_type) #store the product_type
+            recorder.debug('Key="%s.product_type" , Value = %s', deviceList[deviceNames[i]].name, deviceList[deviceNames[i]].product_type) #store the product_type
+            i = i + 1
+        self.startDevice(deviceList)
+
+    def onCloudError(self, error):
+        self.logCloudRequests(getattr(error, 'log', ()))
+        recorder.error("Dyson cloud request failed: '" + repr(error) + "'")
+
+    def startDevice(self, deviceList):
+        """select the device to connect to, create its units and open the connection"""
+        mqtt_client_id = ""
 
         if deviceList == None or len(deviceList)<1:
-            Domoticz.Error("No devices found in plugin configuration or Dyson cloud account")
+            recorder.error("No devices found in plugin configuration or Dyson cloud account")
             return
         else:
-            Domoticz.Debug("Number of devices in plugin: '"+str(len(deviceList))+"'")
+            recorder.debug("Number of devices in plugin: '%s'", len(deviceList))
 
         if deviceList != None and len(deviceList) > 0:
             if len(self.machine_name) > 0:
                 if self.machine_name in deviceList:
                     password, serialNumber, deviceType= self.get_device_config(self.machine_name)
-                    Domoticz.Debug("password: {0}, serialNumber: {1}, deviceType: {2}".format(password, serialNumber, deviceType))
-                    self.myDevice = DysonPureLinkDevice(password, serialNumber, deviceType, self.machine_name)
+                    recorder.debug("serialNumber: %s, deviceType: %s", serialNumber, deviceType)
+                    if deviceType == DEVICE_TYPE_360_EYE:
+                        self.myDevice = Dyson360Eye(password, serialNumber, deviceType, self.machine_name)
+                    else:
+                        self.myDevice = DysonPureLinkDevice(password, serialNumber, deviceType, self.machine_name)
                 else:
-                    Domoticz.Error("The configured device name '" + self.machine_name + "' was not found in the cloud account. Available options: " + str(list(deviceList)))
+                    recorder.error("The configured device name '" + self.machine_name + "' was not found in the cloud account. Available options: " + str(list(deviceList)))
                     return
             elif len(deviceList) == 1:
                 self.myDevice = deviceList[list(deviceList)[0]]
                 Domoticz.Log("1 device found in plugin, none configured, assuming we need this one: '" + self.myDevice.name + "'")
             else:
                 #more than 1 device returned in cloud and no name configured, which the the plugin can't handle
-                Domoticz.Error("More than 1 device found in cloud account but no device name given to select. Select and filter one from available options: " + str(list(deviceList)))
+                recorder.error("More than 1 device found in cloud account but no device name given to select. Select and filter one from available options: " + str(list(deviceList)))
                 return
             #the Domoticz connection object takes username and pwd from the Parameters so write them back
             Parameters['Username'] = self.myDevice.serial #take username from account
             Parameters['Password'] = self.myDevice.password #override the default password with the one returned from the cloud
         else:
-            Domoticz.Error("No usable credentials found")
+            recorder.error("No usable credentials found")
             return
 
-        #check, per device, if it is created. If not,create it
+        if isinstance(self.myDevice, Dyson360Eye):
+            self.createVacuumUnits()
+        else:
+            self.createFanUnits()
+
+        Domoticz.Log("Device instance created: " + str(self.myDevice))
+        self.base_topic = self.myDevice.device_base_topic
+        recorder.debug("base topic defined: '%s'", self.base_topic)
+
+        #warm start: restore the last known state before the device answers
+        self.snapshotFile = snapshot_path(Parameters['HomeFolder'], Parameters['HardwareID'])
+        self.restoreSnapshot()
+
+        self.discoveryCache = DiscoveryCache(os.path.join(Parameters['HomeFolder'], CACHE_FILE))
+
+        #create the connection
+        if self.myDevice != None:
+            self.mqttClient = MqttClient(self.ip_address, self.port_number, mqtt_client_id, self.onMQTTConnected, self.onMQTTDisconnected, self.onMQTTPublish, self.onMQTTSubscribed)
+            self.scheduleDeviceJobs()
+            self.loadSchedules()
+
+    def createFanUnits(self):
+        """check, per device, if it is created. If not,create it"""
         Options = {"LevelActions" : "|||",
                    "LevelNames" : "|OFF|ON|AUTO",
                    "LevelOffHidden" : "true",
@@ -291,31 +471,125 @@ class DysonPureLinkPlugin:
             Domoticz.Device(Name='Heat mode', Unit=self.heatModeUnit, TypeName="Selector Switch", Image=7, Options=Options).Create()
         if self.heatTargetUnit not in Devices:
             Domoticz.Device(Name='Heat target', Unit=self.heatTargetUnit, Type=242, Subtype=1).Create()
+        if self.usAqiUnit not in Devices:
+            Domoticz.Device(Name='Air quality index (US AQI)', Unit=self.usAqiUnit, TypeName="Air Quality").Create()
+        if self.caqiUnit not in Devices:
+            Domoticz.Device(Name='Air quality index (EU CAQI)', Unit=self.caqiUnit, TypeName="Air Quality").Create()
+        if self.filterForecastUnit not in Devices:
+            Domoticz.Device(Name='Filter replacement in', Unit=self.filterForecastUnit, TypeName="Custom", Options={"Custom": "1;days"}).Create()
+        if self.alertUnit not in Devices and self.alerts is not None and len(self.alerts.rules) > 0:
+            Domoticz.Device(Name='Alerts', Unit=self.alertUnit, TypeName="Alert").Create()
 
-        Domoticz.Log("Device instance created: " + str(self.myDevice))
-        self.base_topic = self.myDevice.device_base_topic
-        Domoticz.Debug("base topic defined: '"+self.base_topic+"'")
+    def createVacuumUnits(self):
+        """units of the 360 Eye robot vacuum"""
+        if self.vacuumStateUnit not in Devices:
+            Domoticz.Device(Name='Vacuum state', Unit=self.vacuumStateUnit, TypeName="Text", Image=7).Create()
+        if self.vacuumBatteryUnit not in Devices:
+            Domoticz.Device(Name='Battery', Unit=self.vacuumBatteryUnit, TypeName="Percentage").Create()
+        if self.vacuumCleanUnit not in Devices:
+            Options = {"LevelActions" : "||||",
+                       "LevelNames" : "|Start|Pause|Resume|Abort",
+                       "LevelOffHidden" : "true",
+                       "SelectorStyle" : "0"}
+            Domoticz.Device(Name='Cleaning', Unit=self.vacuumCleanUnit, TypeName="Selector Switch", Image=7, Options=Options).Create()
+        if self.vacuumPowerUnit not in Devices:
+            Options = {"LevelActions" : "||",
+                       "LevelNames" : "|Quiet|Max",
+                       "LevelOffHidden" : "true",
+                       "SelectorStyle" : "1"}
+            Domoticz.Device(Name='Power mode', Unit=self.vacuumPowerUnit, TypeName="Selector Switch", Image=7, Options=Options).Create()
+        if self.vacuumSessionUnit not in Devices:
+            Domoticz.Device(Name='Last clean', Unit=self.vacuumSessionUnit, TypeName="Text", Image=7).Create()
 
-        #create the connection
-        if self.myDevice != None:
-            self.mqttClient = MqttClient(self.ip_address, self.port_number, mqtt_client_id, self.onMQTTConnected, self.onMQTTDisconnected, self.onMQTTPublish, self.onMQTTSubscribed)
+    def scheduleDeviceJobs(self):
+        """periodic jobs of the device, each with its own interval"""
+        serial = self.myDevice.serial
+        self.scheduler.schedule(serial + ".poll", self.pollDevice, self.pollInterval, self.pollInterval)
+        self.scheduler.schedule(serial + ".ping", self.checkConnection, self.pingInterval, self.pingInterval)
+        self.scheduler.schedule(serial + ".snapshot", self.saveSnapshot, self.snapshotInterval, self.snapshotInterval)
+        self.scheduler.schedule(serial + ".readings", self.compactReadings, self.readingsCompactInterval, self.readingsCompactInterval)
     
+    def loadSchedules(self):
+        """compile the schedules of this device from the settings and catch up on missed fires"""
+        schedules = []
+        for raw in self.settings['schedules']:
+            try:
+                schedule = Schedule(raw)
+                if not schedule.applies_to(self.myDevice.name, self.settings['groups']):
+                    continue
+                #build the command once so an invalid action shows at start
+                command_data(self.myDevice, schedule.actions)
+            except (ScheduleError, ValueError, DysonException) as inst:
+                recorder.error("Schedule ignored: " + str(inst))
+                continue
+            schedules.append(schedule)
+        if not schedules:
+            return
+        self.schedules = ScheduleEngine(schedules, self.snapshot.extra.get('schedules'))
+        Domoticz.Log(str(len(schedules)) + " schedules loaded, next at " + time.strftime('%Y-%m-%d %H:%M', time.localtime(self.schedules.next_fire())))
+        missed = self.schedules.missed()
+        if missed:
+            Domoticz.Log("Catching up on missed schedules: " + str([schedule.name for schedule in missed]))
+            self.runSchedules(missed)
+
+    def runSchedules(self, schedules):
+        """send the actions of the due schedules as one command, later schedules win"""
+        data = {}
+        for schedule in schedules:
+            Domoticz.Log("Schedule '" + schedule.name + "': " + str(schedule.actions))
+            data.update(command_data(self.myDevice, schedule.actions))
+        self.snapshot.extra['schedules'] = dict(self.schedules.last_fires)
+        self.snapshot.dirty = True
+        self.sendCommand(*self.myDevice.set_fields(data))
+
     def onStop(self):
-        Domoticz.Debug("onStop called")
+        recorder.debug("onStop called")
+        if self.executor is not None:
+            if not self.executor.shutdown():
+                recorder.error("Background tasks did not finish in time")
+        if self.snapshotWrites and self.snapshot is not None:
+            #shutdown drops queued writes and the results of finished ones, write the last state here
+            self.snapshot.dirty = True
+        self.saveSnapshot(background=False)
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        if tracer.enabled:
+            self.saveTrace()
+
+    def saveTrace(self):
+        path = os.path.join(Parameters['HomeFolder'], "trace_" + str(Parameters['HardwareID']) + ".json")
+        try:
+            tracer.dump(path)
+            Domoticz.Log("Message traces written to '" + path + "'")
+        except OSError as inst:
+            recorder.error("Writing message traces failed: '" + str(inst) + "'")
 
     def onCommand(self, Unit, Command, Level, Hue):
-        Domoticz.Debug("DysonPureLink plugin: onCommand called for Unit " + str(Unit) + ": Parameter '" + str(Command) + "', Level: " + str(Level))
+        recorder.debug("DysonPureLink plugin: onCommand called for Unit %s: Parameter '%s', Level: %s", Unit, Command, Level)
+        trace = tracer.start("command unit " + str(Unit), 'outbound')
+        try:
+            self.handleCommand(Unit, Command, Level, Hue)
+        finally:
+            tracer.finish(trace)
+
+    def handleCommand(self, Unit, Command, Level, Hue):
         topic = ''
         payload = ''
         arg = '' 
         fan_pwr_list = ['438','520','527'] 
+        if isinstance(self.myDevice, Dyson360Eye):
+            self.handleVacuumCommand(Unit, Command, Level)
+            return
+        force = self.repeatedPress(Unit, Command, Level)
+        #sliders fire a command for every step, only the last value is sent
+        debounce = Unit in (self.fanSpeedUnit, self.heatTargetUnit) and Level<=100 and not force
         
         if Unit == self.qualityTargetUnit and Level<=100:
             topic, payload = self.myDevice.set_quality_target(Level)
         if Unit == self.fanSpeedUnit and Level<=100:
             arg="0000"+str(Level//10)
             topic, payload = self.myDevice.set_fan_speed(arg[-4:]) #use last 4 characters as speed level or AUTO
-            self.mqttClient.Publish(topic, payload)
+            self.sendCommand(topic, payload, debounce, force)
             if Level>0:
                 #when setting a speed value, make sure that the fan is actually on
                 if self.myDevice.product_type in fan_pwr_list:
@@ -333,7 +607,7 @@ class DysonPureLinkPlugin:
                     arg="ON"
                     #Switch to Auto
                     topic, payload = self.myDevice.set_fan_power(arg) 
-                    self.mqttClient.Publish(topic, payload)
+                    self.sendCommand(topic, payload, force=force)
                     topic, payload = self.myDevice.set_fan_mode_auto(arg) 
                 elif Level == 20:
                     arg="ON"
@@ -367,53 +641,208 @@ class DysonPureLinkPlugin:
         if Unit == self.heatTargetUnit:
             topic, payload = self.myDevice.set_heat_target(Level) 
 
+        self.sendCommand(topic, payload, debounce, force)
+
+    def handleVacuumCommand(self, Unit, Command, Level):
+        """commands of the robot vacuum, the device reports their effect as a state change, not as STATE-SET fields"""
+        topic = ''
+        payload = ''
+        if Unit == self.vacuumCleanUnit:
+            if Level == 10: topic, payload = self.myDevice.start()
+            if Level == 20: topic, payload = self.myDevice.pause()
+            if Level == 30: topic, payload = self.myDevice.resume()
+            if Level == 40: topic, payload = self.myDevice.abort()
+        if Unit == self.vacuumPowerUnit:
+            if Level == 10: topic, payload = self.myDevice.set_power_mode(VacuumPowerMode.QUIET)
+            if Level == 20: topic, payload = self.myDevice.set_power_mode(VacuumPowerMode.MAX)
+        if topic:
+            self.mqttClient.Publish(topic, payload)
+
+    def repeatedPress(self, Unit, Command, Level):
+        """True when the unit gets the same command again within repeatWindow seconds"""
+        now = time.monotonic()
+        press = (Unit, Command, Level)
+        repeated = press == self.lastPress and now - self.lastPressTime <= self.repeatWindow
+        self.lastPress, self.lastPressTime = press, now
+        if repeated:
+            recorder.debug("Command repeated for unit %s, sent even if the device has the values", Unit)
+        return repeated
+
+    def sendCommand(self, topic, payload, debounce=False, force=False):
+        """publish a command to the device, STATE-SET commands are tracked until the device confirms them
+
+        debounced commands are held back and merged, later commands take the held back fields along.
+        Fields the device already has are not sent, unless force is set (a repeated press)"""
+        if not topic:
+            return
+        command = json.loads(payload)
+        if command['msg'] != 'STATE-SET':
+            self.mqttClient.Publish(topic, payload)
+            return
+        data = command['data']
+        if self.debouncer is not None:
+            if debounce:
+                self.debouncer.add(self.myDevice.serial, data)
+                self.updateHeartbeat()
+                if self.optimistic:
+                    self.refreshDevices()
+                return
+            held = self.debouncer.take(self.myDevice.serial)
+            if held:
+                held.update(data)
+                data = held
+                topic, payload = self.myDevice.set_fields(data)
+        self.publishState(topic, payload, data, force)
+
+    def publishState(self, topic, payload, data, force=False):
+        if self.commandFilter is not None and not force:
+            pending = set(field for command in self.commandTracker.pending(self.myDevice.serial) for field in command.data)
+            needed = self.commandFilter.prune(data, self.snapshot.state, self.snapshot.state_time, pending)
+            if not needed:
+                recorder.debug("Command %s not sent, the device already has these values", data)
+                self.metrics.inc('commands_suppressed', labels={'serial': self.myDevice.serial}, help='Commands not sent as the device already had the values')
+                return
+            if len(needed) < len(data):
+                self.metrics.inc('command_fields_pruned', len(data) - len(needed), {'serial': self.myDevice.serial}, 'Command fields not sent as the device already had the value')
+                data = needed
+                topic, payload = self.myDevice.set_fields(data)
+        self.commandTracker.sent(self.myDevice.serial, data)
         self.mqttClient.Publish(topic, payload)
+        if self.optimistic:
+            #show the result right away, the device confirms or the command times out
+            self.refreshDevices()
+
+    def flushCommands(self):
+        """send the debounced fields of which the quiet window or maximum latency passed"""
+        for serial, data in self.debouncer.due():
+            topic, payload = self.myDevice.set_fields(data)
+            recorder.debug("Sending debounced fields %s", data)
+            self.publishState(topic, payload, data)
+        self.updateHeartbeat()
+
+    def updateHeartbeat(self):
+        """beat every second while commands or messages are held back, so they are handled in time"""
+        waiting = len(self.inbound) > 0 or (self.debouncer is not None and len(self.debouncer) > 0)
+        interval = 1 if waiting else self.heartbeatInterval
+        if interval != self.currentHeartbeat:
+            Domoticz.Heartbeat(interval)
+            self.currentHeartbeat = interval
+
+    def checkCommands(self):
+        """report the commands the device did not confirm in time"""
+        expired = self.commandTracker.expire()
+        for command in expired:
+            recorder.error("Command " + str(command.data) + " was not confirmed by the device within " + str(self.commandTracker.deadline) + "s")
+            self.metrics.inc('commands_unconfirmed', labels={'serial': command.serial}, help='Commands not confirmed by the device in time')
+        if expired and self.optimistic:
+            #roll back the units to the state the device confirmed
+            self.refreshDevices()
+
+    def refreshDevices(self):
+        """update the units from the device state, with the unconfirmed commands applied in optimistic mode"""
+        if self.snapshot is None or not self.snapshot.has_state:
+            return
+        pending = [command.data for command in self.commandTracker.pending(self.myDevice.serial)]
+        if self.debouncer is not None:
+            pending.append(self.debouncer.pending(self.myDevice.serial))
+        if not (self.optimistic and any(pending)):
+            self.updateDevices()
+            return
+        message = self.snapshot.state_message()
+        for data in pending:
+            message['product-state'].update(data)
+        self.updateDevices(StateData(message))
+
+    def confirmCommands(self, message):
+        """match a STATE-CHANGE as received from the device with the sent commands"""
+        if not isinstance(message, dict) or message.get('msg') != 'STATE-CHANGE' or not isinstance(message.get('product-state'), dict):
+            return
+        for command in self.commandTracker.state_changed(self.myDevice.serial, message['product-state'], device_time=message_time(message)):
+            latency = time.monotonic() - command.sent
+            recorder.debug("Command %s confirmed after %.3fs", command.data, latency)
+            self.metrics.observe('command_round_trip_seconds', latency, {'serial': command.serial}, 'Time from STATE-SET to the confirming STATE-CHANGE')
 
     def onConnect(self, Connection, Status, Description):
-        Domoticz.Debug("onConnect called: Connection '"+str(Connection)+"', Status: '"+str(Status)+"', Description: '"+Description+"'")
+        recorder.debug("onConnect called: Connection '%s', Status: '%s', Description: '%s'", Connection, Status, Description)
         self.mqttClient.onConnect(Connection, Status, Description)
+        if Status != 0:
+            self.connectFailures = self.connectFailures + 1
+            if self.connectFailures >= self.rediscoverAfter:
+                self.locateDevice()
 
     def onDisconnect(self, Connection):
         self.mqttClient.onDisconnect(Connection)
 
     def onMessage(self, Connection, Data):
         self.mqttClient.onMessage(Connection, Data)
+        self.executor.process_results()
+        if self.debouncer is not None and len(self.debouncer):
+            self.flushCommands()
 
     def onNotification(self, Name, Subject, Text, Status, Priority, Sound, ImageFile):
         Domoticz.Log("DysonPureLink plugin: onNotification: " + Name + "," + Subject + "," + Text + "," + Status + "," + str(Priority) + "," + Sound + "," + ImageFile)
 
     def onHeartbeat(self):
-        if self.myDevice != None:
-            self.runCounter = self.runCounter - 1
-            # self.pingCounter = self.pingCounter - 1
-            # if self.pingCounter <= 0 and self.runCounter > 0:
-                # self.mqttClient.onHeartbeat()
-                # self.pingCounter = int(int(Parameters['Mode2'])/2)
-            if self.runCounter <= 0:
-                Domoticz.Debug("DysonPureLink plugin: Poll unit")
-                self.runCounter = int(Parameters['Mode2'])
-                #self.pingCounter = int(int(Parameters['Mode2'])/2)
-                topic, payload = self.myDevice.request_state()
-                self.mqttClient.Publish(topic, payload) #ask for update of current status
-                
-            else:
-                Domoticz.Debug("Polling unit in " + str(self.runCounter) + " heartbeats.")
-                self.mqttClient.onHeartbeat()
+        if self.executor is not None:
+            self.executor.process_results()
+        if len(self.inbound):
+            self.drainInbound()
+        if self.scheduler is not None:
+            self.scheduler.advance()
+        if self.alerts is not None:
+            self.alerts.check_pending(time.time())
+        if self.debouncer is not None and len(self.debouncer):
+            self.flushCommands()
+        if self.schedules is not None and self.schedules.next_fire() is not None and self.schedules.next_fire() <= time.time():
+            self.runSchedules(self.schedules.due())
+        if self.commandTracker is not None:
+            self.checkCommands()
+        if self.metricsServer is not None:
+            self.exportPluginMetrics()
+            self.metrics.render()
+
+    def pollDevice(self):
+        recorder.debug("DysonPureLink plugin: Poll unit")
+        recorder.debug("Background tasks: %s", self.executor.metrics())
+        topic, payload = self.myDevice.request_state()
+        self.mqttClient.Publish(topic, payload) #ask for update of current status
+
+    def checkConnection(self):
+        """ping the device, or plan a reconnect with increasing delay when the connection is lost"""
+        if self.mqttClient.isConnected:
+            self.mqttClient.Ping()
+        elif self.mqttClient.Connecting():
+            recorder.debug("Not connected, connection attempt in progress")
+        elif self.reconnectJob is None:
+            recorder.debug("Not connected, reconnecting in %ss", self.reconnectBackoff)
+            self.reconnectJob = self.scheduler.schedule(self.myDevice.serial + ".reconnect", self.reconnect, self.reconnectBackoff)
+
+    def reconnect(self):
+        recorder.debug("MqttClient::Reconnecting")
+        self.reconnectJob = None
+        if self.mqttClient.isConnected or self.mqttClient.Connecting():
+            #the previous attempt is still in flight or succeeded meanwhile
+            return
+        self.reconnectBackoff = min(self.reconnectBackoff * 2, self.maxReconnectDelay)
+        self.metrics.inc('reconnects', help='Reconnect attempts to the device')
+        self.mqttClient.Open()
 
     def onDeviceRemoved(self, unit):
         Domoticz.Log("DysonPureLink plugin: onDeviceRemoved called for unit '" + str(unit) + "'")
     
-    def updateDevices(self):
-        """Update the defined devices from incoming mesage info"""
+    def updateDevices(self, state_data=None):
+        """Update the defined devices from incoming mesage info, or from state_data when given"""
+        if state_data is None:
+            state_data = self.state_data
         #update the devices
-        if self.state_data.oscillation is not None:
-            UpdateDevice(self.fanOscillationUnit, self.state_data.oscillation.state, str(self.state_data.oscillation))
-        if self.state_data.night_mode is not None:
-            UpdateDevice(self.nightModeUnit, self.state_data.night_mode.state, str(self.state_data.night_mode))
+        if state_data.oscillation is not None:
+            UpdateDevice(self.fanOscillationUnit, state_data.oscillation.state, str(state_data.oscillation))
+        if state_data.night_mode is not None:
+            UpdateDevice(self.nightModeUnit, state_data.night_mode.state, str(state_data.night_mode))
 
         # Fan speed  
-        if self.state_data.fan_speed is not None:
-            f_rate = self.state_data.fan_speed
+        if state_data.fan_speed is not None:
+            f_rate = state_data.fan_speed
     
             if (f_rate == "AUTO"):
                 nValueNew = 110
@@ -421,103 +850,429 @@ class DysonPureLinkPlugin:
             else:
                 nValueNew = (int(f_rate))*10
                 sValueNew = str((int(f_rate)) * 10)
-            if self.state_data.fan_mode is not None:
-                Domoticz.Debug("update fanspeed, state of FanMode: " + str(self.state_data.fan_mode))
-                if self.state_data.fan_mode.state == 0:
+            if state_data.fan_mode is not None:
+                recorder.debug("update fanspeed, state of FanMode: %s", state_data.fan_mode)
+                if state_data.fan_mode.state == 0:
                     nValueNew = 0
                     sValueNew = "0"
                     
             UpdateDevice(self.fanSpeedUnit, nValueNew, sValueNew)
         
-        if self.state_data.fan_mode is not None:
-            UpdateDevice(self.fanModeUnit, self.state_data.fan_mode.state, str((self.state_data.fan_mode.state+1)*10))
-        if self.state_data.fan_state is not None:
-            UpdateDevice(self.fanStateUnit, self.state_data.fan_state.state, str((self.state_data.fan_state.state+1)*10))
-        if self.state_data.filter_life is not None:
-            UpdateDevice(self.filterLifeUnit, self.state_data.filter_life, str(self.state_data.filter_life))
-        if self.state_data.quality_target is not None:
-            UpdateDevice(self.qualityTargetUnit, self.state_data.quality_target.state, str((self.state_data.quality_target.state+1)*10))
-        if self.state_data.standby_monitoring is not None:
-            UpdateDevice(self.standbyMonitoringUnit, self.state_data.standby_monitoring.state, str((self.state_data.standby_monitoring.state+1)*10))
-        if self.state_data.fan_mode_auto is not None:
-            UpdateDevice(self.fanModeAutoUnit, self.state_data.fan_mode_auto.state, str((self.state_data.fan_mode_auto.state+1)*10))
-        if self.state_data.focus is not None:
-            UpdateDevice(self.fanFocusUnit, self.state_data.focus.state, str(self.state_data.focus))
-        if self.state_data.heat_mode is not None:
-            UpdateDevice(self.heatModeUnit, self.state_data.heat_mode.state, str((self.state_data.heat_mode.state+1)*10))
-        if self.state_data.heat_target is not None:
-            UpdateDevice(self.heatTargetUnit, 0, str(self.state_data.heat_target))
-        if self.state_data.heat_state is not None:
-            UpdateDevice(self.heatStateUnit, self.state_data.heat_state.state, str((self.state_data.heat_state.state+1)*10))
-        Domoticz.Debug("update StateData: " + str(self.state_data))
+        if state_data.fan_mode is not None:
+            UpdateDevice(self.fanModeUnit, state_data.fan_mode.state, str((state_data.fan_mode.state+1)*10))
+        if state_data.fan_state is not None:
+            UpdateDevice(self.fanStateUnit, state_data.fan_state.state, str((state_data.fan_state.state+1)*10))
+        if state_data.filter_life is not None:
+            UpdateDevice(self.filterLifeUnit, state_data.filter_life, str(state_data.filter_life))
+        if state_data.quality_target is not None:
+            UpdateDevice(self.qualityTargetUnit, state_data.quality_target.state, str((state_data.quality_target.state+1)*10))
+        if state_data.standby_monitoring is not None:
+            UpdateDevice(self.standbyMonitoringUnit, state_data.standby_monitoring.state, str((state_data.standby_monitoring.state+1)*10))
+        if state_data.fan_mode_auto is not None:
+            UpdateDevice(self.fanModeAutoUnit, state_data.fan_mode_auto.state, str((state_data.fan_mode_auto.state+1)*10))
+        if state_data.focus is not None:
+            UpdateDevice(self.fanFocusUnit, state_data.focus.state, str(state_data.focus))
+        if state_data.heat_mode is not None:
+            UpdateDevice(self.heatModeUnit, state_data.heat_mode.state, str((state_data.heat_mode.state+1)*10))
+        if state_data.heat_target is not None:
+            UpdateDevice(self.heatTargetUnit, 0, str(state_data.heat_target))
+        if state_data.heat_state is not None:
+            UpdateDevice(self.heatStateUnit, state_data.heat_state.state, str((state_data.heat_state.state+1)*10))
+        recorder.debug("update StateData: %s", state_data)
+        self.exportStateMetrics()
 
 
     def updateSensors(self):
         """Update the defined devices from incoming mesage info"""
         #update the devices
         if self.sensor_data.temperature is not None and self.sensor_data.humidity is not None :
-            tempNum = int(self.sensor_data.temperature)
-            humNum = int(self.sensor_data.humidity)
-            UpdateDevice(self.tempHumUnit, 1, str(self.sensor_data.temperature)[:4] +';'+ str(self.sensor_data.humidity) + ";1")
+            self.writeSensor(self.tempHumUnit, [('temperature', self.sensor_data.temperature), ('humidity', self.sensor_data.humidity)],
+                1, str(self.sensor_data.temperature)[:4] +';'+ str(self.sensor_data.humidity) + ";1")
         if self.sensor_data.volatile_compounds is not None:
-            UpdateDevice(self.volatileUnit, self.sensor_data.volatile_compounds, str(self.sensor_data.volatile_compounds))
+            self.writeSensor(self.volatileUnit, [('voc', self.sensor_data.volatile_compounds)], self.sensor_data.volatile_compounds, str(self.sensor_data.volatile_compounds))
         if self.sensor_data.particles is not None:
-            UpdateDevice(self.particlesUnit, self.sensor_data.particles, str(self.sensor_data.particles))
+            self.writeSensor(self.particlesUnit, [('particles', self.sensor_data.particles)], self.sensor_data.particles, str(self.sensor_data.particles))
         if self.sensor_data.particles2_5 is not None:
-            UpdateDevice(self.particles2_5Unit, self.sensor_data.particles2_5, str(self.sensor_data.particles2_5))
+            self.writeSensor(self.particles2_5Unit, [('particles', self.sensor_data.particles2_5)], self.sensor_data.particles2_5, str(self.sensor_data.particles2_5))
         if self.sensor_data.particles10 is not None:
-            UpdateDevice(self.particles10Unit, self.sensor_data.particles10, str(self.sensor_data.particles10))
+            self.writeSensor(self.particles10Unit, [('particles', self.sensor_data.particles10)], self.sensor_data.particles10, str(self.sensor_data.particles10))
         if self.sensor_data.particulate_matter_25 is not None:
-            UpdateDevice(self.particlesMatter25Unit, self.sensor_data.particulate_matter_25, str(self.sensor_data.particulate_matter_25))
+            self.writeSensor(self.particlesMatter25Unit, [('particles', self.sensor_data.particulate_matter_25)], self.sensor_data.particulate_matter_25, str(self.sensor_data.particulate_matter_25))
         if self.sensor_data.particulate_matter_10 is not None:
-            UpdateDevice(self.particlesMatter10Unit, self.sensor_data.particulate_matter_10, str(self.sensor_data.particulate_matter_10))
+            self.writeSensor(self.particlesMatter10Unit, [('particles', self.sensor_data.particulate_matter_10)], self.sensor_data.particulate_matter_10, str(self.sensor_data.particulate_matter_10))
         if self.sensor_data.nitrogenDioxideDensity is not None:
-            UpdateDevice(self.nitrogenDioxideDensityUnit, self.sensor_data.nitrogenDioxideDensity, str(self.sensor_data.nitrogenDioxideDensity))
+            self.writeSensor(self.nitrogenDioxideDensityUnit, [('no2', self.sensor_data.nitrogenDioxideDensity)], self.sensor_data.nitrogenDioxideDensity, str(self.sensor_data.nitrogenDioxideDensity))
         if self.sensor_data.heat_target is not None:
             UpdateDevice(self.heatTargetUnit, self.sensor_data.heat_target, str(self.sensor_data.heat_target))
         UpdateDevice(self.sleepTimeUnit, self.sensor_data.sleep_timer, str(self.sensor_data.sleep_timer))
-        Domoticz.Debug("update SensorData: " + str(self.sensor_data))
+        recorder.debug("update SensorData: %s", self.sensor_data)
+        self.exportSensorMetrics()
         #Domoticz.Debug("update StateData: " + str(self.state_data))
 
+    def writeSensor(self, Unit, values, nValue, sValue):
+        """update a sensor unit when its values moved beyond the deadband, or when the update is due"""
+        result = self.sensorThrottle.check(Unit, values, time.monotonic())
+        if result == SKIP:
+            self.metrics.inc('sensor_writes_skipped', help='Sensor unit updates skipped by the deadband or interval limits')
+            return
+        UpdateDevice(Unit, nValue, sValue, AlwaysUpdate=result == REFRESH)
+
+    def updateFilterForecast(self, timestamp=None):
+        """add the filter life to the forecast (when timestamp is given) and update the replacement device"""
+        if timestamp is not None:
+            fan = self.state_data.fan_state if self.state_data.fan_state is not None else self.state_data.fan_mode
+            running = fan is not None and fan.state != 0
+            self.filterForecast.add(timestamp, self.state_data.filter_life, self.state_data.fan_speed, running)
+        hours = self.filterForecast.hours_remaining()
+        if hours is not None:
+            days = round(hours / 24, 1)
+            UpdateDevice(self.filterForecastUnit, 0, str(days))
+            recorder.debug("Filter replacement expected in %s days", days)
+
+    def updateAirQuality(self, timestamp=None, sensor_data=None):
+        """add the particle readings (of sensor_data when given) to the air quality engine when timestamp is given and update the index devices"""
+        if timestamp is not None:
+            if sensor_data is None:
+                sensor_data = self.sensor_data
+            pm25 = sensor_data.particulate_matter_25 if sensor_data.particulate_matter_25 is not None else sensor_data.particles2_5
+            pm10 = sensor_data.particulate_matter_10 if sensor_data.particulate_matter_10 is not None else sensor_data.particles10
+            self.airQuality.add(timestamp, pm25, pm10, sensor_data.volatile_compounds, sensor_data.nitrogenDioxideDensity)
+        us_aqi = self.airQuality.us_aqi()
+        if us_aqi is not None:
+            UpdateDevice(self.usAqiUnit, us_aqi[0], str(us_aqi[0]))
+        caqi = self.airQuality.caqi_hourly()
+        if caqi is not None:
+            UpdateDevice(self.caqiUnit, caqi[0], str(caqi[0]))
+
+    def dedupeReading(self, message):
+        """add the sensor reading to the air quality history unless it is there already"""
+        now = time.time()
+        timestamp = message_time(message, now)
+        resets = self.readings.clock_resets
+        if not self.readings.merge(timestamp):
+            recorder.debug("sensor reading of %s is already in the history", message.get('time'))
+            self.updateAirQuality()
+            return
+        if self.readings.clock_resets != resets:
+            Domoticz.Log("The device clock went back to " + str(message.get('time')) + ", the air quality history continues from it")
+        #readings are placed by the device time, unless the device clock is off
+        self.updateAirQuality(timestamp if abs(timestamp - now) <= self.readings.clock_reset else now)
+
+    def compactReadings(self):
+        expired = self.readings.compact()
+        if expired:
+            recorder.debug("%s sensor reading times expired", expired)
+
     def onMQTTConnected(self):
         """connection to device established"""
-        Domoticz.Debug("onMQTTConnected called")
+        recorder.debug("onMQTTConnected called")
         Domoticz.Log("MQTT connection established")
-        self.mqttClient.Subscribe([self.base_topic + '/status/current', self.base_topic + '/status/connection', self.base_topic + '/status/faults']) #subscribe to all topics on the machine
+        if self.snapshot is not None:
+            self.snapshot.set_connection(address=self.ip_address, port=self.port_number, connected=int(time.time()))
+        self.connectFailures = 0
+        self.reconnectBackoff = self.reconnectDelay
+        if self.reconnectJob is not None:
+            self.reconnectJob.cancel()
+            self.reconnectJob = None
+        if self.discoveryCache.set(self.myDevice.serial, self.ip_address, self.port_number):
+            self.saveDiscoveryCache()
+        self.mqttClient.Subscribe([self.myDevice.device_status, self.base_topic + '/status/connection', self.base_topic + '/status/faults']) #subscribe to all topics on the machine
         topic, payload = self.myDevice.request_state()
         self.mqttClient.Publish(topic, payload) #ask for update of current status
+        if not isinstance(self.myDevice, Dyson360Eye):
+            #the sensors are only reported periodically, close the gap of a lost connection at once
+            topic, payload = self.myDevice.request_sensors()
+            self.mqttClient.Publish(topic, payload)
+        if self.disconnectedAt is not None:
+            self.metrics.observe('connection_gap_seconds', time.time() - self.disconnectedAt, help='Time without connection to the device')
+            self.disconnectedAt = None
 
     def onMQTTDisconnected(self):
-        Domoticz.Debug("onMQTTDisconnected")
+        recorder.debug("onMQTTDisconnected")
+        self.disconnectedAt = time.time()
+        recorder.flush('disconnect')
 
     def onMQTTSubscribed(self):
-        Domoticz.Debug("onMQTTSubscribed")
+        recorder.debug("onMQTTSubscribed")
         
     def onMQTTPublish(self, topic, message):
-        Domoticz.Debug("MQTT Publish: MQTT message incoming: " + topic + " " + str(message))
+        recorder.debug("MQTT Publish: MQTT message incoming: %s %s", topic, message)
+        if isinstance(self.myDevice, Dyson360Eye):
+            #the robot's state transitions and positions all count in arrival order, none is collapsed
+            if topic == self.myDevice.device_status:
+                with CallbackTimer(self.metrics, 'mqtt_publish'):
+                    self.handleVacuumMessage(message)
+            return
+        if topic == self.base_topic + '/status/current':
+            #match the commands before the inbound stage merges the change with others
+            self.confirmCommands(message)
+        tracer.stamp('queued')
+        #the trace waits with the message, it is finished when the message is handled
+        self.inbound.put(topic, message, trace=tracer.hold())
+        if time.monotonic() - self.lastDrain >= self.drainInterval:
+            self.drainInbound()
+        else:
+            self.updateHeartbeat()
 
+    def drainInbound(self):
+        """handle the pending messages, superseded ones have been collapsed meanwhile"""
+        messages, lag = self.inbound.drain()
+        self.lastDrain = time.monotonic()
+        self.metrics.observe('inbound_lag_seconds', lag, help='Time the oldest message waited before handling')
+        with CallbackTimer(self.metrics, 'mqtt_publish'):
+            for topic, message, trace in messages:
+                tracer.resume(trace)
+                try:
+                    self.handleMessage(topic, message)
+                finally:
+                    tracer.finish(trace)
+        self.updateHeartbeat()
+
+    def handleMessage(self, topic, message):
         if (topic == self.base_topic + '/status/current'):
+            if not isinstance(message, dict) or 'msg' not in message:
+                recorder.error("Message from device could not be decoded: '" + str(message) + "'")
+                self.metrics.inc('decode_errors', help='Messages that could not be decoded')
+                return
+            self.metrics.inc('messages', labels={'msg': message['msg']}, help='Messages received from the device')
             #update of the machine's status
-            if StateData.is_state_data(message):
-                Domoticz.Debug("machine state or state change recieved")
-                self.state_data = StateData(message)
-                self.updateDevices()
-            if SensorsData.is_sensors_data(message):
-                Domoticz.Debug("sensor state recieved")
-                self.sensor_data = SensorsData(message)
-                self.updateSensors()
+            try:
+                if StateData.is_state_data(message):
+                    recorder.debug("machine state or state change recieved")
+                    self.snapshot.merge_state(message['product-state'])
+                    #the inbound stage may hand out part of a change, the snapshot holds every field
+                    if self.snapshot.has_state:
+                        self.state_data = StateData(self.snapshot.state_message())
+                        tracer.stamp('StateData')
+                        self.refreshDevices()
+                        self.updateFilterForecast(time.time())
+                        self.stateValues = self.checkAlerts(self.stateValues, self.state_data.as_dict())
+                    else:
+                        recorder.debug("Waiting for the complete machine state")
+                if SensorsData.is_sensors_data(message):
+                    recorder.debug("sensor state recieved")
+                    self.snapshot.merge_sensors(message['data'])
+                    self.sensor_data = SensorsData(message)
+                    tracer.stamp('SensorsData')
+                    self.updateSensors()
+                    self.dedupeReading(message)
+                    self.sensorValues = self.checkAlerts(self.sensorValues, self.sensor_data.as_dict())
+            except (KeyError, ValueError, TypeError) as inst:
+                recorder.error("Message from device could not be decoded: '" + repr(inst) + "'")
+                self.metrics.inc('decode_errors', help='Messages that could not be decoded')
 
         if (topic == self.base_topic + '/status/connection'):
             #connection status received
-            Domoticz.Debug("connection state recieved")
+            recorder.debug("connection state recieved")
 
         if (topic == self.base_topic + '/status/software'):
             #connection status received
-            Domoticz.Debug("software state recieved")
+            recorder.debug("software state recieved")
             
         if (topic == self.base_topic + '/status/summary'):
             #connection status received
-            Domoticz.Debug("summary state recieved")
+            recorder.debug("summary state recieved")
+
+    def handleVacuumMessage(self, message):
+        if not isinstance(message, dict) or 'msg' not in message:
+            recorder.error("Message from device could not be decoded: '" + str(message) + "'")
+            self.metrics.inc('decode_errors', help='Messages that could not be decoded')
+            return
+        self.metrics.inc('messages', labels={'msg': message['msg']}, help='Messages received from the device')
+        try:
+            summary = self.myDevice.update(message)
+        except (KeyError, ValueError, TypeError) as inst:
+            recorder.error("Message from device could not be decoded: '" + repr(inst) + "'")
+            self.metrics.inc('decode_errors', help='Messages that could not be decoded')
+            return
+        if summary is not None:
+            Domoticz.Log("Clean finished: " + str(summary))
+            UpdateDevice(self.vacuumSessionUnit, 0, format_summary(summary))
+            self.snapshot.dirty = True
+        if message['msg'] != 'MAP-GLOBAL':
+            self.updateVacuum()
+
+    def updateVacuum(self):
+        """update the units of the robot vacuum"""
+        state = self.myDevice.state
+        battery = self.myDevice.battery_level
+        if state is not None:
+            UpdateDevice(self.vacuumStateUnit, 0, state.replace('_', ' ').capitalize(), battery if battery is not None else 255)
+            if state in PAUSED_STATES:
+                UpdateDevice(self.vacuumCleanUnit, 1, "20")
+            elif is_cleaning(state):
+                UpdateDevice(self.vacuumCleanUnit, 1, "10")
+            else:
+                UpdateDevice(self.vacuumCleanUnit, 0, "0")
+        if battery is not None:
+            UpdateDevice(self.vacuumBatteryUnit, 0, str(battery))
+        if self.myDevice.power_mode == VacuumPowerMode.QUIET.value:
+            UpdateDevice(self.vacuumPowerUnit, 1, "10")
+        if self.myDevice.power_mode == VacuumPowerMode.MAX.value:
+            UpdateDevice(self.vacuumPowerUnit, 1, "20")
+
+    def exportStateMetrics(self):
+        labels = {'serial': self.myDevice.serial}
+        fan_speed = self.state_data.fan_speed
+        self.metrics.set('fan_speed', int(fan_speed) if fan_speed is not None and fan_speed.isdigit() else None, labels, 'Fan speed 1-10, absent in AUTO')
+        self.metrics.set('filter_life', self.state_data.filter_life, labels, 'Remaining filter life')
+        self.metrics.set('heat_target_celsius', self.state_data.heat_target, labels, 'Heating target temperature')
+
+    def exportSensorMetrics(self):
+        labels = {'serial': self.myDevice.serial}
+        self.metrics.set('temperature_celsius', self.sensor_data.temperature, labels, 'Temperature')
+        self.metrics.set('humidity_percent', self.sensor_data.humidity, labels, 'Relative humidity')
+        self.metrics.set('pm25', self.sensor_data.particulate_matter_25 if self.sensor_data.particulate_matter_25 is not None else self.sensor_data.particles2_5, labels, 'PM2.5 (ug/m3)')
+        self.metrics.set('pm10', self.sensor_data.particulate_matter_10 if self.sensor_data.particulate_matter_10 is not None else self.sensor_data.particles10, labels, 'PM10 (ug/m3)')
+        self.metrics.set('voc_index', self.sensor_data.volatile_compounds, labels, 'Volatile organic compounds index')
+        self.metrics.set('no2_index', self.sensor_data.nitrogenDioxideDensity, labels, 'Nitrogen dioxide index')
+
+    def exportPluginMetrics(self):
+        """internals that are not counted where they happen"""
+        for key, value in self.executor.metrics().items():
+            self.metrics.set('executor_' + key, value, help='Background task executor')
+        self.metrics.set('connected', int(self.mqttClient is not None and self.mqttClient.isConnected), help='MQTT connection to the device is up')
+        self.metrics.set('inbound_received', self.inbound.received, help='Messages received by the inbound stage')
+        self.metrics.set('inbound_collapsed', self.inbound.collapsed, help='Messages merged into or replaced by a newer one')
+        self.metrics.set('inbound_dropped', self.inbound.dropped, help='Messages dropped as the inbound queue was full')
+        if self.myDevice is not None:
+            stats = self.commandTracker.stats(self.myDevice.serial)
+            for quantile in ('p50', 'p95'):
+                self.metrics.set('command_round_trip_' + quantile + '_seconds', stats[quantile], {'serial': self.myDevice.serial},
+                                 'Command round trip latency (bucket upper bound)')
+            self.metrics.set('commands_pending', stats['pending'], {'serial': self.myDevice.serial}, 'Commands waiting for confirmation')
+
+    def checkAlerts(self, previous, values):
+        """evaluate the alert rules of the fields that changed since the previous message, returns the new values"""
+        values = {field: value for field, value in values.items() if value is not None}
+        if self.alerts is not None:
+            self.alerts.evaluate(changed_fields(previous, values), previous, time.time())
+        return values
+
+    def onAlert(self, rule, active):
+        if active:
+            text = "{0}: {1} is {2}".format(rule.name, rule.field, rule.value)
+            Domoticz.Status("Alert " + text)
+            UpdateDevice(self.alertUnit, rule.level, text)
+            return
+        Domoticz.Status("Alert cleared " + rule.name)
+        #show the most severe alert that is still active
+        remaining = sorted(self.alerts.active(), key=lambda other: other.level)
+        if remaining:
+            UpdateDevice(self.alertUnit, remaining[-1].level, "{0}: {1} is {2}".format(remaining[-1].name, remaining[-1].field, remaining[-1].value))
+        else:
+            UpdateDevice(self.alertUnit, 1, "No alerts")
+
+    def locateDevice(self):
+        """the device does not answer on its address, try the cached address or scan the subnet"""
+        cached = self.discoveryCache.get(self.myDevice.serial)
+        if cached is not None and cached != (self.ip_address, self.port_number):
+            Domoticz.Log("Device not reachable at " + self.ip_address + ", trying last known address " + cached[0])
+            self.moveDevice(*cached)
+            return
+        if self.discovering or time.time() < self.nextDiscovery:
+            return
+        #the scanner loads asyncio and ssl, only when a scan is due
+        from discovery import DysonDiscovery, local_network
+        try:
+            network = local_network(self.ip_address)
+        except ValueError:
+            recorder.error("Device not reachable at '" + self.ip_address + "' and no network to scan for it")
+            return
+        Domoticz.Log("Device not reachable at " + self.ip_address + ", scanning " + network)
+        self.nextDiscovery = time.time() + self.rediscoverInterval
+        self.discovering = self.executor.submit(DysonDiscovery().discover, network,
+            {self.myDevice.serial: (self.myDevice.password, self.myDevice.product_type)},
+            callback=self.onDeviceLocated, errback=self.onDiscoveryError, timeout=120, name="discover")
+
+    def onDeviceLocated(self, found):
+        self.discovering = False
+        self.connectFailures = 0
+        if self.myDevice.serial not in found:
+            recorder.error("Device '" + self.myDevice.serial + "' not found on the network, retrying at " + self.ip_address)
+            return
+        address, port = found[self.myDevice.serial]
+        Domoticz.Log("Device found at " + address + ":" + port)
+        if self.discoveryCache.set(self.myDevice.serial, address, port):
+            self.saveDiscoveryCache()
+        self.moveDevice(address, port)
+
+    def onDiscoveryError(self, error):
+        self.discovering = False
+        self.connectFailures = 0
+        recorder.error("Scanning for the device failed: '" + repr(error) + "'")
+
+    def moveDevice(self, address, port):
+        """continue with the device at another address"""
+        self.connectFailures = 0
+        self.ip_address = address
+        self.port_number = port
+        self.mqttClient.SetAddress(address, port)
+
+    def saveDiscoveryCache(self):
+        try:
+            self.discoveryCache.save()
+        except OSError as inst:
+            recorder.error("Writing device address cache failed: '" + str(inst) + "'")
+
+    def restoreSnapshot(self):
+        """seed the state cache and the devices from the snapshot of the previous run"""
+        self.snapshot = DeviceSnapshot.load(self.snapshotFile, self.myDevice.serial)
+        if self.snapshot is None:
+            recorder.debug("No usable state snapshot found at '%s'", self.snapshotFile)
+            self.snapshot = DeviceSnapshot(self.myDevice.serial, self.myDevice.product_type)
+            return
+        try:
+            if self.snapshot.has_state:
+                self.state_data = StateData(self.snapshot.state_message())
+                self.updateDevices()
+            if self.snapshot.has_sensors:
+                self.sensor_data = SensorsData(self.snapshot.sensors_message())
+                self.updateSensors()
+                #the first live reading replaces the restored values at once
+                self.sensorThrottle.reset()
+            self.airQuality = AirQualityEngine.from_dict(self.snapshot.extra.get('aqi'))
+            self.updateAirQuality()
+            self.filterForecast = FilterForecast.from_dict(self.snapshot.extra.get('filter'))
+            self.updateFilterForecast()
+            self.readings.restore(self.snapshot.extra.get('readings'))
+            if isinstance(self.myDevice, Dyson360Eye):
+                self.myDevice.sessions.extend(self.snapshot.extra.get('sessions', []))
+        except (KeyError, ValueError, TypeError) as inst:
+            recorder.error("State snapshot could not be decoded, ignoring it: '" + str(inst) + "'")
+            self.snapshot = DeviceSnapshot(self.myDevice.serial, self.myDevice.product_type)
+            return
+        Domoticz.Log("Last known state restored from snapshot")
+
+    def saveSnapshot(self, background=True):
+        """write the state snapshot when changed, scheduled every snapshotInterval"""
+        if self.snapshot is None or self.snapshotFile is None or not self.snapshot.dirty:
+            return
+        self.snapshot.extra['aqi'] = self.airQuality.to_dict()
+        self.snapshot.extra['filter'] = self.filterForecast.to_dict()
+        self.snapshot.extra['readings'] = self.readings.to_dict()
+        if isinstance(self.myDevice, Dyson360Eye):
+            self.snapshot.extra['sessions'] = list(self.myDevice.sessions)
+        data = self.snapshot.mark_saved()
+        if background and self.executor.submit(write_snapshot, self.snapshotFile, data, callback=self.onSnapshotWritten, errback=self.onSnapshotWriteFailed):
+            self.snapshotWrites += 1
+            return
+        try:
+            write_snapshot(self.snapshotFile, data)
+            recorder.debug("State snapshot written to '%s'", self.snapshotFile)
+        except OSError as inst:
+            self.onSnapshotError(inst)
+
+    def onSnapshotWritten(self, result):
+        self.snapshotWrites -= 1
+
+    def onSnapshotWriteFailed(self, error):
+        self.snapshotWrites -= 1
+        self.onSnapshotError(error)
+
+    def onSnapshotError(self, error):
+        recorder.error("Writing state snapshot failed: '" + str(error) + "'")
+        self.snapshot.dirty = True
 
     def checkVersion(self, version):
         """checks actual version against stored version as 'Ma.Mi.Pa' and checks if updates needed"""
@@ -526,7 +1281,7 @@ class DysonPureLinkPlugin:
         Domoticz.Log("Starting version: " + version )
         MaCurrent,MiCurrent,PaCurrent = version.split('.')
         MaConf,MiConf,PaConf = ConfVersion.split('.')
-        Domoticz.Debug("checking versions: current '{0}', config '{1}'".format(version, ConfVersion))
+        recorder.debug("checking versions: current '%s', config '%s'", version, ConfVersion)
         if int(MaConf) < int(MaCurrent):
             Domoticz.Log("Major version upgrade: {0} -> {1}".format(MaConf,MaCurrent))
             #add code to perform MAJOR upgrades
@@ -554,7 +1309,7 @@ class DysonPureLinkPlugin:
         Configurations = getConfigItem()
         for x in Configurations:
             if x.split(".")[1] == "name":
-                Domoticz.Debug("Found a machine name: " + x + " value: '" + str(Configurations[x]) + "'")
+                recorder.debug("Found a machine name: %s value: '%s'", x, Configurations[x])
                 if Configurations[x] == name:
                     password = getConfigItem(Key="{0}.{1}".format(name, "credential"))
                     serialNumber = getConfigItem(Key="{0}.{1}".format(name, "serial"))
@@ -570,7 +1325,7 @@ class DysonPureLinkPlugin:
 
     def _setVersion(self, major, minor, patch):
         #set configs
-        Domoticz.Debug("Setting version to {0}.{1}.{2}".format(major, minor, patch))
+        recorder.debug("Setting version to %s.%s.%s", major, minor, patch)
         setConfigItem(Key="MajorVersion", Value=major)
         setConfigItem(Key="MinorVersion", Value=minor)
         setConfigItem(Key="patchVersion", Value=patch)
@@ -597,13 +1352,13 @@ def getConfigItem(Key=None, Default={}):
    except KeyError:
        Value = Default
    except Exception as inst:
-       Domoticz.Error("Domoticz.Configuration read failed: '"+str(inst)+"'")
+       recorder.error("Domoticz.Configuration read failed: '"+str(inst)+"'")
    return Value
    
 def setConfigItem(Key=None, Value=None):
     Config = {}
     if type(Value) not in (str, int, float, bool, bytes, bytearray, list, dict):
-        Domoticz.Error("A value is specified of a not allowed type: '" + str(type(Value)) + "'")
+        recorder.error("A value is specified of a not allowed type: '" + str(type(Value)) + "'")
         return Config
     try:
        Config = Domoticz.Configuration()
@@ -613,7 +1368,7 @@ def setConfigItem(Key=None, Value=None):
            Config = Value  # set whole configuration if no key specified
        Config = Domoticz.Configuration(Config)
     except Exception as inst:
-       Domoticz.Error("Domoticz.Configuration operation failed: '"+str(inst)+"'")
+       recorder.error("Domoticz.Configuration operation failed: '"+str(inst)+"'")
     return Config
        
 def UpdateDevice(Unit, nValue, sValue, BatteryLevel=255, AlwaysUpdate=False):
@@ -624,13 +1379,15 @@ def UpdateDevice(Unit, nValue, sValue, BatteryLevel=255, AlwaysUpdate=False):
         or AlwaysUpdate == True:
 
         Devices[Unit].Update(nValue, str(sValue), BatteryLevel=BatteryLevel)
+        if tracer.current is not None:
+            tracer.stamp('update ' + Devices[Unit].Name)
 
-        Domoticz.Debug("Update %s: nValue %s - sValue %s - BatteryLevel %s" % (
+        recorder.debug("Update %s: nValue %s - sValue %s - BatteryLevel %s",
             Devices[Unit].Name,
             nValue,
             sValue,
             BatteryLevel
-        ))
+        )
         
 global _plugin
 _plugin = DysonPureLinkPlugin()
@@ -0,0 +1,75 @@
+"""Dedupe of the sensor readings by their device time
+
+The sensor readings feed the rolling windows of the air quality indexes.
+Readings missed while the connection was down are not backfilled: the local
+MQTT protocol has no request for stored readings, only for the current
+values. After a reconnect the plugin asks for the current sensor data right
+away, which shortens the gap, and the reconnect also brings repeated
+deliveries of readings that were already handled.
+
+Every reading is merged once by its device timestamp: repeated deliveries of
+the same reading, and readings from before the last plugin run (already in
+the restored windows), are ignored. A timestamp far before the newest one is
+not a late reading but a device clock that was reset (e.g. after a power cut
+without time sync), the merged timestamps are forgotten and the history goes
+on from the new clock.
+"""
+
+import calendar, time
+
+def message_time(message, default=None):
+    """epoch seconds of the 'time' of a device message, default when absent or invalid"""
+    try:
+        return calendar.timegm(time.strptime(message['time'][:19], '%Y-%m-%dT%H:%M:%S'))
+    except (KeyError, TypeError, ValueError):
+        return default
+
+class ReadingDedupe(object):
+    """Timestamps of the readings merged into the air quality history"""
+
+    def __init__(self, max_age=86400, clock_reset=900):
+        self.max_age = max_age
+        #seconds a device time may go back before it counts as a reset clock
+        self.clock_reset = clock_reset
+        #newest merged reading, and the newest one of the previous run
+        self.latest = None
+        self.floor = None
+        self._seen = set()
+        self.merged = 0
+        self.duplicates = 0
+        self.clock_resets = 0
+
+    def __len__(self):
+        return len(self._seen)
+
+    def merge(self, timestamp):
+        """add a reading, True when it was not in the history yet"""
+        if self.latest is not None and timestamp < self.latest - self.clock_reset:
+            self.clock_resets += 1
+            self.latest = self.floor = None
+            self._seen.clear()
+        if timestamp in self._seen or (self.floor is not None and timestamp <= self.floor):
+            self.duplicates += 1
+            return False
+        self._seen.add(timestamp)
+        self.merged += 1
+        if self.latest is None or timestamp > self.latest:
+            self.latest = timestamp
+        return True
+
+    def compact(self):
+        """forget the readings more than max_age before the newest one, returns how many"""
+        if self.latest is None:
+            return 0
+        cutoff = self.latest - self.max_age
+        expired = set(timestamp for timestamp in self._seen if timestamp < cutoff)
+        self._seen -= expired
+        return len(expired)
+
+    def to_dict(self):
+        return {'latest': self.latest}
+
+    def restore(self, raw):
+        """continue after the readings of the previous run"""
+        if raw and raw.get('latest') is not None:
+            self.latest = self.floor = raw['latest']
@@ -0,0 +1,104 @@
+"""Timer wheel scheduler driven by the plugin heartbeat
+
+Jobs (polls, pings, reconnects, snapshot flushes, ...) are kept in a
+hierarchical timer wheel. Every level has a fixed number of slots, a slot of
+level n spans slots**n ticks. A tick only looks at one slot of the lowest
+level and, once per revolution, moves the jobs of one slot of a higher level
+down. So the cost of a tick does not depend on the number of jobs, only on
+the jobs that are due.
+"""
+
+import time
+
+class Job(object):
+    """Scheduled callback, periodic when period (in ticks) is set"""
+    __slots__ = ('name', 'callback', 'period', 'expires', 'cancelled')
+
+    def __init__(self, name, callback, period, expires):
+        self.name = name
+        self.callback = callback
+        self.period = period
+        self.expires = expires
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __repr__(self):
+        return "Job '{0}' due at tick {1}".format(self.name, self.expires)
+
+class TimerWheel(object):
+    """Hierarchical timer wheel, one tick is tick_length seconds"""
+
+    def __init__(self, tick_length=10, slots=64, levels=4):
+        self.tick_length = tick_length
+        self.slots = slots
+        self.levels = levels
+        self.ticks = 0
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self._last_advance = None
+        self.jobs_run = 0
+
+    def to_ticks(self, seconds):
+        """number of ticks for a duration in seconds, at least 1"""
+        return max(1, int(-(-seconds // self.tick_length)))
+
+    def schedule(self, name, callback, delay, period=None):
+        """run callback after delay seconds, then every period seconds when given. Returns the Job"""
+        job = Job(name, callback, self.to_ticks(period) if period else None, self.ticks + self.to_ticks(delay))
+        self._insert(job)
+        return job
+
+    def _insert(self, job):
+        delta = job.expires - self.ticks
+        span = self.slots
+        for level in range(self.levels):
+            if delta < span or level == self.levels - 1:
+                #beyond the top level the job is parked and cascaded again later
+                slot = (min(job.expires, self.ticks + span - 1) // (span // self.slots)) % self.slots
+                self._wheels[level][slot].append(job)
+                return
+            span *= self.slots
+
+    def _cascade(self, level):
+        slot = (self.ticks // self.slots ** level) % self.slots
+        jobs, self._wheels[level][slot] = self._wheels[level][slot], []
+        for job in jobs:
+            if not job.cancelled:
+                self._insert(job)
+
+    def tick(self):
+        """advance one tick and run the due jobs"""
+        self.ticks += 1
+        level = 1
+        while level < self.levels and self.ticks % self.slots ** level == 0:
+            level += 1
+        for cascade_level in range(level - 1, 0, -1):
+            self._cascade(cascade_level)
+        slot = self.ticks % self.slots
+        jobs, self._wheels[0][slot] = self._wheels[0][slot], []
+        for job in jobs:
+            if job.cancelled:
+                continue
+            if job.expires > self.ticks:
+                #parked job with an expiry beyond the wheel range
+                self._insert(job)
+                continue
+            if job.period:
+                job.expires = self.ticks + job.period
+                self._insert(job)
+            self.jobs_run += 1
+            job.callback()
+
+    def advance(self, now=None):
+        """run the ticks elapsed since the previous call, to be called from onHeartbeat"""
+        now = time.monotonic() if now is None else now
+        if self._last_advance is None:
+            self._last_advance = now - self.tick_length
+        ticks = int((now - self._last_advance) // self.tick_length)
+        #a late heartbeat catches up, but a long stall does not replay every missed tick
+        for _ in range(min(ticks, self.slots)):
+            self.tick()
+        if ticks > 0:
+            self._last_advance += ticks * self.tick_length
+        return ticks
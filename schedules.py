@@ -0,0 +1,197 @@
+"""Schedules hosted by the plugin
+
+A schedule sets device fields at times given by a cron expression
+(minute hour day-of-month month day-of-week, local time):
+
+    {"name": "Night", "cron": "0 22 * * *", "set": {"night_mode": "ON", "fan_speed": 2}}
+
+The actions are the DysonCommands setters without 'set_' (fan_speed,
+night_mode, oscilation, heat_target, ...) with the setter argument as value;
+fan_speed takes a number or AUTO. "devices" limits a schedule to machine
+names or groups from the "groups" setting.
+
+The next fire time of every schedule is kept in a min-heap, so a heartbeat
+only looks at the top. Fires missed while the plugin was not running (or
+stalled) are handled the same way every time: a schedule with "catch_up": N
+runs its latest missed fire once when it is at most N seconds ago, otherwise
+missed fires are skipped. Either way the next fire is the first one after now.
+"""
+
+import datetime, heapq, json, time
+
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+#seconds a fire may be late (heartbeat interval, busy plugin) and still run without catch_up
+LATE_TOLERANCE = 60
+
+#search limit for the next fire, a day-of-month/month combination may be rare (Feb 29)
+MAX_SEARCH_DAYS = 366 * 8
+
+class ScheduleError(ValueError):
+    """A schedule of the settings can not be used"""
+    pass
+
+def _parse_field(text, low, high):
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+        if part == '*':
+            first, last = low, high
+        elif '-' in part:
+            first, last = [int(value) for value in part.split('-', 1)]
+        else:
+            first = last = int(part)
+            if step != 1:
+                last = high
+        if first < low or last > high or first > last or step < 1:
+            raise ValueError(part)
+        values.update(range(first, last + 1, step))
+    return values
+
+class CronExpression(object):
+    """Five field cron expression with * , - and / """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ScheduleError("Cron expression '{0}' needs 5 fields".format(expression))
+        try:
+            self.minutes, self.hours, self.days, self.months, weekdays = [
+                _parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)]
+        except ValueError as inst:
+            raise ScheduleError("Cron expression '{0}' is invalid at '{1}'".format(expression, inst))
+        #cron counts Sunday as 0 or 7, datetime.weekday() has Monday 0
+        self.weekdays = set((day - 1) % 7 for day in weekdays)
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+        self.expression = expression
+
+    def _day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = day.weekday() in self.weekdays
+        #like cron: when both are restricted either one matches
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, moment):
+        """first matching minute strictly after moment (naive local datetime)"""
+        moment = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = moment.date()
+        for _ in range(MAX_SEARCH_DAYS):
+            if self._day_matches(day):
+                start = (moment.hour, moment.minute) if day == moment.date() else (0, 0)
+                for hour in sorted(self.hours):
+                    if hour < start[0]:
+                        continue
+                    for minute in sorted(self.minutes):
+                        if hour == start[0] and minute < start[1]:
+                            continue
+                        return datetime.datetime.combine(day, datetime.time(hour, minute))
+            day += datetime.timedelta(days=1)
+        return None
+
+    def previous_before(self, moment, limit):
+        """last matching minute at or before moment and after limit, None when there is none"""
+        fire = self.next_after(limit)
+        previous = None
+        while fire is not None and fire <= moment:
+            previous = fire
+            fire = self.next_after(fire)
+        return previous
+
+class Schedule(object):
+
+    def __init__(self, raw):
+        try:
+            self.name = raw['name']
+            self.cron = CronExpression(raw['cron'])
+            self.actions = dict(raw['set'])
+        except (KeyError, TypeError, AttributeError) as inst:
+            raise ScheduleError("Schedule '{0}' needs a name, cron and set: {1}".format(raw, inst))
+        self.devices = raw.get('devices')
+        self.catch_up = float(raw.get('catch_up', 0))
+        self.next_fire = None
+
+    def applies_to(self, machine_name, groups):
+        if not self.devices:
+            return True
+        for target in self.devices:
+            if target == machine_name or machine_name in groups.get(target, ()):
+                return True
+        return False
+
+    def __repr__(self):
+        return "Schedule '{0}' ({1}) next at {2}".format(self.name, self.cron.expression, self.next_fire)
+
+def command_data(device, actions):
+    """wire fields of the actions, built with the DysonCommands setters of device"""
+    data = {}
+    for action, value in actions.items():
+        setter = getattr(device, 'set_' + action, None)
+        if setter is None or action == 'fields':
+            raise ScheduleError("Unknown schedule action '{0}'".format(action))
+        if action == 'fan_speed' and str(value).upper() != 'AUTO':
+            value = '{0:04d}'.format(int(value))
+        _, payload = setter(value)
+        data.update(json.loads(payload)['data'])
+    return data
+
+class ScheduleEngine(object):
+    """Min-heap of the next fire times of the schedules"""
+
+    def __init__(self, schedules, last_fires=None, now=None):
+        self.schedules = schedules
+        #schedule name: timestamp of the last fire, to handle missed fires after a restart
+        self.last_fires = dict(last_fires or {})
+        self._heap = []
+        self._sequence = 0
+        now = time.time() if now is None else now
+        for schedule in schedules:
+            self._push(schedule, now)
+
+    def _push(self, schedule, now):
+        fire = schedule.cron.next_after(datetime.datetime.fromtimestamp(now))
+        if fire is None:
+            return
+        schedule.next_fire = fire.timestamp()
+        self._sequence += 1
+        heapq.heappush(self._heap, (schedule.next_fire, self._sequence, schedule))
+
+    def missed(self, now=None):
+        """schedules of which the latest fire since their last run should be caught up, call once at start"""
+        now = time.time() if now is None else now
+        due = []
+        for schedule in self.schedules:
+            last = self.last_fires.get(schedule.name)
+            if not schedule.catch_up or last is None:
+                continue
+            previous = schedule.cron.previous_before(datetime.datetime.fromtimestamp(now),
+                                                     datetime.datetime.fromtimestamp(max(last, now - schedule.catch_up)))
+            if previous is not None:
+                self.last_fires[schedule.name] = previous.timestamp()
+                due.append(schedule)
+        return due
+
+    def next_fire(self):
+        return self._heap[0][0] if self._heap else None
+
+    def due(self, now=None):
+        """schedules that are due in fire order, each at most once however many fires were passed"""
+        now = time.time() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire, _, schedule = heapq.heappop(self._heap)
+            if now - fire > max(LATE_TOLERANCE, schedule.catch_up):
+                #stalled past the fire and no catch up allowed
+                self._push(schedule, now)
+                continue
+            self.last_fires[schedule.name] = fire
+            due.append(schedule)
+            self._push(schedule, now)
+        return due
@@ -0,0 +1,166 @@
+"""Dyson cloud session shared by the plugin instances
+
+With one plugin instance per device every instance used to log in to the
+Dyson cloud on its own, each with its own OTP challenge, which runs into
+the rate limit of the cloud (DysonOTPTooFrequently). The instances now share
+a cache directory per account (a hash of the email address, the address
+itself is not written) in the plugin folder. It holds the auth token, the
+pending OTP challenge and the device manifest with the local credentials.
+
+All cloud requests are made while holding an exclusive lock on the cache,
+so instances starting together do one login between them: the first one
+requests the OTP code or fetches the manifest, the others wait for the lock
+and find the result in the cache. The lock is a flock, which also separates
+the instances that Domoticz runs in one process; where fcntl is missing a
+lock file created exclusively is used instead.
+"""
+
+import contextlib, hashlib, json, os, time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CACHE_DIR = 'cloud_cache'
+SESSION_FILE = 'session.json'
+LOCK_FILE = 'lock'
+
+#an OTP code sent by mail can be used for 10 minutes
+CHALLENGE_TTL = 600
+#seconds to wait for another instance, and after which a left over lock file is removed
+LOCK_TIMEOUT = 120
+STALE_LOCK = 300
+
+class SessionCacheError(Exception):
+    """The shared cloud session cache can not be used"""
+    pass
+
+def cache_dir(home_folder, email):
+    """cache directory of an account"""
+    key = hashlib.sha256(email.strip().lower().encode('utf-8')).hexdigest()[:16]
+    return os.path.join(home_folder, CACHE_DIR, key)
+
+class SessionCache(object):
+    """JSON session file of an account, guarded by an advisory lock"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, SESSION_FILE)
+
+    @contextlib.contextmanager
+    def lock(self, timeout=LOCK_TIMEOUT):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        lock_path = os.path.join(self.directory, LOCK_FILE)
+        if fcntl is not None:
+            with open(lock_path, 'a') as lock_file:
+                deadline = time.monotonic() + timeout
+                while True:
+                    try:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except OSError:
+                        if time.monotonic() > deadline:
+                            raise SessionCacheError("Cloud session cache '{0}' stays locked".format(self.directory))
+                        time.sleep(0.2)
+                try:
+                    yield self
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            return
+        lock_path += '.excl'
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > STALE_LOCK:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise SessionCacheError("Cloud session cache '{0}' stays locked".format(self.directory))
+                time.sleep(0.2)
+        try:
+            yield self
+        finally:
+            os.remove(lock_path)
+
+    def load(self):
+        """the cached session, empty when there is none"""
+        try:
+            with open(self.path) as session_file:
+                session = json.load(session_file)
+        except (OSError, ValueError):
+            return {}
+        return session if isinstance(session, dict) else {}
+
+    def save(self, session):
+        """write the session atomically, readable for the owner only"""
+        tmp_path = self.path + '.tmp'
+        with open(os.open(tmp_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600), 'w') as session_file:
+            json.dump(session, session_file)
+        os.replace(tmp_path, self.path)
+
+def _device_infos(manifest):
+    from cloud.device_info import DysonDeviceInfo
+    return {raw['name']: DysonDeviceInfo(**raw) for raw in manifest}
+
+def fetch_devices(cache, email, password, otp_code=None, region='NL', request_otp=True, max_age=None, now=None):
+    """devices of the account as (name: DysonDeviceInfo, None, log), or (None, challenge id, log) while an OTP code is needed
+
+    Uses the cached manifest when it is at most max_age seconds old (any age
+    when None), otherwise the cached token, otherwise the OTP code with the
+    pending challenge. A new OTP code is only requested when no challenge is
+    pending and request_otp is set. Runs on a background thread, so the
+    (level, text) log lines of the cloud requests are returned, or set as the
+    log attribute of a raised error, to be logged on the plugin thread."""
+    log = []
+    try:
+        devices, challenge_id = _fetch_devices(cache, email, password, otp_code, region, request_otp, max_age, now, log)
+    except Exception as inst:
+        inst.log = log
+        raise
+    return devices, challenge_id, log
+
+def _fetch_devices(cache, email, password, otp_code, region, request_otp, max_age, now, log):
+    from cloud.account import DysonAccount
+    from cloud.exceptions import DysonAuthRequired, DysonInvalidAuth
+    with cache.lock():
+        now = time.time() if now is None else now
+        session = cache.load()
+        if 'manifest' in session and (max_age is None or now - session.get('fetched', 0) <= max_age):
+            return _device_infos(session['manifest']), None
+        account = None
+        if session.get('auth'):
+            account = DysonAccount(session['auth'], log)
+        elif otp_code and session.get('challenge_id'):
+            account = DysonAccount(log=log)
+            try:
+                session['auth'] = account.verify(otp_code, email, password, session['challenge_id'])
+            finally:
+                #a code is used once, right or wrong
+                session.pop('challenge_id', None)
+                session.pop('challenged', None)
+                cache.save(session)
+        if account is not None:
+            try:
+                devices = account.devices()
+            except (DysonAuthRequired, DysonInvalidAuth):
+                session.pop('auth', None)
+                cache.save(session)
+                raise
+            session['manifest'] = [vars(info) for info in devices.values()]
+            session['fetched'] = now
+            cache.save(session)
+            return devices, None
+        if session.get('challenge_id') and now - session.get('challenged', 0) <= CHALLENGE_TTL:
+            return None, session['challenge_id']
+        if not request_otp:
+            return None, None
+        session['challenge_id'] = DysonAccount(log=log).login_email_otp(email, region)
+        session['challenged'] = now
+        cache.save(session)
+        return None, session['challenge_id']
@@ -0,0 +1,89 @@
+"""Optional plugin settings
+
+The Domoticz hardware page has no room for more parameters, so the optional
+features are configured in settings.json in the plugin folder. Settings of a
+single plugin instance go in "instances" under its hardware id and override
+the general ones:
+
+    {
+        "alerts": [{"name": "Dust", "when": "particulate_matter_25 > 35", "for": 600, "clear": 30}],
+        "instances": {"5": {"alerts": []}}
+    }
+
+Settings that are not given keep the defaults below.
+"""
+
+import copy, json, os
+
+SETTINGS_FILE = 'settings.json'
+
+DEFAULTS = {
+    'alerts': [
+        {'name': 'Filter needs replacement', 'when': 'warning_code == FLTR', 'level': 3},
+        {'name': 'Device error', 'when': 'error_code != NONE', 'level': 4},
+        {'name': 'High PM2.5', 'when': 'particulate_matter_25 > 35', 'for': 600, 'clear': 30, 'cooldown': 3600, 'level': 3},
+    ],
+    #Prometheus endpoint http://address:port/metrics, disabled when port is 0
+    'metrics': {'address': '127.0.0.1', 'port': 0},
+    #message and command traces, served at /trace of the metrics endpoint and written at stop
+    'tracing': {'enabled': False, 'size': 1024},
+    #seconds the device has to confirm a command with a STATE-CHANGE, optimistic shows
+    #the commanded values until then and rolls back when the command is not confirmed
+    #the fan speed and heat target sliders are sent once no new value came for debounce.quiet
+    #seconds, or at the latest after debounce.max_latency seconds; quiet 0 sends every step
+    #fields the device reported less than filter_max_age seconds ago are not sent again, 0 sends all
+    'commands': {'deadline': 10, 'optimistic': False, 'debounce': {'quiet': 1, 'max_latency': 3}, 'filter_max_age': 300},
+    #sensor units are written when a value moved at least the deadband, at most every
+    #min_interval and at least every max_interval seconds, see throttle.py
+    'sensor_writes': {
+        'temperature': {'deadband': 0.2, 'min_interval': 30, 'max_interval': 900},
+        'humidity': {'deadband': 1, 'min_interval': 30, 'max_interval': 900},
+        'particles': {'deadband': 1, 'min_interval': 30, 'max_interval': 900},
+        'voc': {'deadband': 1, 'min_interval': 30, 'max_interval': 900},
+        'no2': {'deadband': 1, 'min_interval': 30, 'max_interval': 900},
+    },
+    #messages arriving within drain_interval seconds of the previous handling are collapsed, see inbound.py
+    'inbound': {'drain_interval': 0.5, 'max_other': 16},
+    #sensor readings are added to the air quality history once by their time, a time more than
+    #clock_reset seconds back is a reset device clock, see readings.py
+    'readings': {'max_age': 86400, 'clock_reset': 900},
+    #debug records kept in memory and written to flight_<HardwareID>.log on errors and disconnects
+    'flight_recorder': {'size': 2000},
+    #schedules, see schedules.py, and groups of machine names they can refer to
+    'schedules': [],
+    'groups': {},
+}
+
+class SettingsError(Exception):
+    """The settings file can not be used"""
+    pass
+
+def _merge(base, override):
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+def default_settings():
+    return copy.deepcopy(DEFAULTS)
+
+def load_settings(home_folder, hardware_id=None):
+    """defaults merged with the settings file and the section of the plugin instance"""
+    settings = default_settings()
+    path = os.path.join(home_folder, SETTINGS_FILE)
+    if not os.path.exists(path):
+        return settings
+    try:
+        with open(path) as settings_file:
+            raw = json.load(settings_file)
+    except (OSError, ValueError) as inst:
+        raise SettingsError("'{0}' can not be read: {1}".format(path, inst))
+    if not isinstance(raw, dict):
+        raise SettingsError("'{0}' should contain a JSON object".format(path))
+    instances = raw.pop('instances', {})
+    _merge(settings, raw)
+    if hardware_id is not None and str(hardware_id) in instances:
+        _merge(settings, instances[str(hardware_id)])
+    return settings
@@ -0,0 +1,222 @@
+"""Headless multi-process runner for large Dyson device fleets
+
+The devices are read from a JSON file holding the plugin configuration
+entries (<name>.serial, <name>.credential, <name>.product_type) completed
+with the local address of every device (<name>.address, optional
+<name>.port). The devices are spread over a number of worker processes. Every
+worker owns the MQTT sessions of its shard and does the JSON decoding and
+state diffing; only the decoded change sets travel to the coordinator, as
+compact JSON frames over a pipe.
+
+usage: python shard_runner.py devices.json [workers]
+"""
+
+import asyncio, json, multiprocessing, os, sys, time
+from multiprocessing.connection import wait
+
+from commands import DysonCommands
+from mqtt_async import AsyncMqttClient
+from snapshot import DeviceSnapshot
+from value_types import SensorsData, StateData, changed_fields
+
+#seconds between two REQUEST-CURRENT-STATE polls of a device
+POLL_INTERVAL = 300
+#seconds change sets are gathered before a frame is sent to the coordinator
+FLUSH_INTERVAL = 0.05
+
+def load_devices(config):
+    """build device descriptions from plugin configuration entries"""
+    devices = []
+    for key in sorted(config):
+        name, _, item = key.rpartition('.')
+        if item != 'serial' or not name:
+            continue
+        if "{0}.address".format(name) not in config:
+            print("Device '{0}' has no '{0}.address' entry, skipped".format(name), file=sys.stderr)
+            continue
+        devices.append({
+            'name': name,
+            'serial': config[key],
+            'credential': config["{0}.credential".format(name)],
+            'product_type': config["{0}.product_type".format(name)],
+            'address': config["{0}.address".format(name)],
+            'port': str(config.get("{0}.port".format(name), "1883")),
+        })
+    return devices
+
+def shard_devices(devices, workers):
+    """divide the devices round robin over the workers, ordered by serial so the shards are stable"""
+    shards = [[] for _ in range(max(1, min(workers, len(devices))))]
+    for index, device in enumerate(sorted(devices, key=lambda device: device['serial'])):
+        shards[index % len(shards)].append(device)
+    return shards
+
+class ShardDevice(DysonCommands):
+    """Dyson device of a shard, the password is already decrypted by the coordinator"""
+
+    def __init__(self, name, serial, product_type, password):
+        super(ShardDevice, self).__init__()
+        self._name = name
+        self._serial = serial
+        self._product_type = product_type
+        self.password = password
+
+class DeviceSession(object):
+    """MQTT session of one device: decodes its messages and emits the changed values"""
+
+    def __init__(self, description, emit):
+        self.device = ShardDevice(description['name'], description['serial'], description['product_type'], description['password'])
+        self.emit = emit
+        self.snapshot = DeviceSnapshot(self.device.serial, self.device.product_type)
+        self.state_values = None
+        self.sensor_values = None
+        self.decode_errors = 0
+        self.client = AsyncMqttClient(description['address'], description['port'], '',
+            username=self.device.serial, password=self.device.password,
+            connected_cb=self.on_connected, disconnected_cb=self.on_disconnected, publish_cb=self.on_publish)
+
+    def on_connected(self):
+        base_topic = self.device.device_base_topic
+        self.client.subscribe([base_topic + '/status/current', base_topic + '/status/connection', base_topic + '/status/faults'])
+        self.client.publish(*self.device.request_state())
+        self.emit(self.device.serial, 'connection', {'connected': True, 'reconnects': self.client.reconnects})
+
+    def on_disconnected(self):
+        self.emit(self.device.serial, 'connection', {'connected': False})
+
+    def on_publish(self, topic, message):
+        if topic != self.device.device_status or not isinstance(message, dict):
+            return
+        try:
+            if StateData.is_state_data(message):
+                if self.snapshot.merge_state(message['product-state']) and self.snapshot.has_state:
+                    values = StateData(self.snapshot.state_message()).as_dict()
+                    changes = changed_fields(self.state_values, values)
+                    self.state_values = values
+                    if changes:
+                        self.emit(self.device.serial, 'state', changes)
+            elif SensorsData.is_sensors_data(message):
+                if self.snapshot.merge_sensors(message['data']) and self.snapshot.has_sensors:
+                    values = SensorsData(self.snapshot.sensors_message()).as_dict()
+                    changes = changed_fields(self.sensor_values, values)
+                    self.sensor_values = values
+                    if changes:
+                        self.emit(self.device.serial, 'sensors', changes)
+        except (KeyError, ValueError, TypeError):
+            self.decode_errors += 1
+
+    async def poll(self, interval, offset):
+        await asyncio.sleep(offset)
+        while True:
+            self.client.publish(*self.device.request_state())
+            await asyncio.sleep(interval)
+
+class ChangeChannel(object):
+    """Gathers change sets and sends them to the coordinator in frames"""
+
+    def __init__(self, connection, flush_interval=FLUSH_INTERVAL):
+        self.connection = connection
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._scheduled = False
+
+    def emit(self, serial, kind, changes):
+        self._pending.append([serial, kind, changes])
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_event_loop().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        if self._pending:
+            frame, self._pending = self._pending, []
+            self.connection.send_bytes(json.dumps(frame, separators=(',', ':')).encode('utf-8'))
+
+async def run_shard(shard, connection, poll_interval=POLL_INTERVAL):
+    channel = ChangeChannel(connection)
+    sessions = [DeviceSession(description, channel.emit) for description in shard]
+    tasks = []
+    for index, session in enumerate(sessions):
+        tasks.append(asyncio.ensure_future(session.client.run()))
+        #spread the polls of the shard over the interval
+        tasks.append(asyncio.ensure_future(session.poll(poll_interval, poll_interval * (index + 1) / len(sessions))))
+    await asyncio.gather(*tasks)
+
+def worker_main(shard, connection, poll_interval=POLL_INTERVAL):
+    """entry point of a worker process"""
+    try:
+        asyncio.run(run_shard(shard, connection, poll_interval))
+    except KeyboardInterrupt:
+        pass
+
+class ShardCoordinator(object):
+    """Starts the worker processes and collects their change sets"""
+
+    def __init__(self, devices, workers=None, on_changes=None, poll_interval=POLL_INTERVAL):
+        from cloud.utils import credentials
+        #decrypt all credentials once, before the work is divided
+        passwords = credentials.decrypt_many([device['credential'] for device in devices])
+        devices = [dict(device, password=passwords[device['credential']]) for device in devices]
+        self.shards = shard_devices(devices, workers or os.cpu_count() or 1)
+        self.on_changes = on_changes or print_changes
+        self.poll_interval = poll_interval
+        self.processes = []
+        self.connections = []
+        self.frames = 0
+        self.changes = 0
+
+    def start(self):
+        for index, shard in enumerate(self.shards):
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=worker_main, args=(shard, sender, self.poll_interval),
+                                              name='DysonShard-{0}'.format(index), daemon=True)
+            process.start()
+            sender.close()
+            self.processes.append(process)
+            self.connections.append(receiver)
+
+    def run(self):
+        """dispatch change sets until all workers have stopped"""
+        connections = list(self.connections)
+        while connections:
+            for connection in wait(connections):
+                try:
+                    frame = json.loads(connection.recv_bytes())
+                except EOFError:
+                    connections.remove(connection)
+                    continue
+                self.frames += 1
+                for serial, kind, changes in frame:
+                    self.changes += 1
+                    self.on_changes(serial, kind, changes)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+def print_changes(serial, kind, changes):
+    print(json.dumps({'time': time.time(), 'serial': serial, 'kind': kind, 'changes': changes}), flush=True)
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    with open(argv[1]) as config_file:
+        devices = load_devices(json.load(config_file))
+    if not devices:
+        print("No devices found in '{0}'".format(argv[1]), file=sys.stderr)
+        return 1
+    coordinator = ShardCoordinator(devices, int(argv[2]) if len(argv) > 2 else None)
+    coordinator.start()
+    try:
+        coordinator.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        coordinator.stop()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,135 @@
+"""Warm-start snapshot of the last known device state"""
+
+import json, os, threading, time
+
+SNAPSHOT_VERSION = 1
+
+class DeviceSnapshot(object):
+    """Last known raw state and sensor fields of a device, persisted between plugin runs.
+
+    The wire values are cached as reported by the device (the new value of a
+    STATE-CHANGE pair), so merging a message tells which fields really changed.
+    """
+
+    def __init__(self, serial=None, product_type=None):
+        self.serial = serial
+        self.product_type = product_type
+        self.state = {}
+        self.sensors = {}
+        self.connection = {}
+        #derived data of other modules (e.g. rolling windows), stored as given
+        self.extra = {}
+        self.state_time = None
+        self.sensors_time = None
+        self.dirty = False
+        self.saved_at = 0
+
+    @staticmethod
+    def _field_value(field):
+        """Get the current value of a field, STATE-CHANGE reports [old, new]"""
+        return field[-1] if isinstance(field, list) else field
+
+    def _merge(self, cache, data):
+        changed = {}
+        for key, field in data.items():
+            value = self._field_value(field)
+            if key not in cache or cache[key] != value:
+                cache[key] = value
+                changed[key] = value
+        if changed:
+            self.dirty = True
+        return changed
+
+    def merge_state(self, data):
+        """merge 'product-state' fields, returns the changed fields with their new value"""
+        self.state_time = time.time()
+        return self._merge(self.state, data)
+
+    def merge_sensors(self, data):
+        """merge environmental sensor fields, returns the changed fields with their new value"""
+        self.sensors_time = time.time()
+        return self._merge(self.sensors, data)
+
+    def set_connection(self, **kwargs):
+        """store connection metadata (address, port, last connect time, ...)"""
+        for key, value in kwargs.items():
+            if self.connection.get(key) != value:
+                self.connection[key] = value
+                self.dirty = True
+
+    @property
+    def has_state(self):
+        return 'ercd' in self.state and 'wacd' in self.state
+
+    @property
+    def has_sensors(self):
+        return 'hact' in self.sensors and 'tact' in self.sensors and 'sltm' in self.sensors
+
+    def state_message(self):
+        """cached state as a CURRENT-STATE message, to be decoded by StateData"""
+        return {'msg': 'CURRENT-STATE', 'product-state': dict(self.state)}
+
+    def sensors_message(self):
+        """cached sensors as an ENVIRONMENTAL-CURRENT-SENSOR-DATA message, to be decoded by SensorsData"""
+        return {'msg': 'ENVIRONMENTAL-CURRENT-SENSOR-DATA', 'data': dict(self.sensors)}
+
+    def to_dict(self):
+        """copy of the snapshot as plain data, safe to serialize from another thread"""
+        return {
+            'version': SNAPSHOT_VERSION,
+            'serial': self.serial,
+            'product_type': self.product_type,
+            'state': dict(self.state),
+            'sensors': dict(self.sensors),
+            'connection': dict(self.connection),
+            'extra': dict(self.extra),
+            'state_time': self.state_time,
+            'sensors_time': self.sensors_time,
+        }
+
+    @classmethod
+    def from_dict(cls, raw):
+        snapshot = cls(raw.get('serial'), raw.get('product_type'))
+        snapshot.state = dict(raw.get('state') or {})
+        snapshot.sensors = dict(raw.get('sensors') or {})
+        snapshot.connection = dict(raw.get('connection') or {})
+        snapshot.extra = dict(raw.get('extra') or {})
+        snapshot.state_time = raw.get('state_time')
+        snapshot.sensors_time = raw.get('sensors_time')
+        return snapshot
+
+    def save(self, path):
+        """write the snapshot atomically to file"""
+        write_snapshot(path, self.mark_saved())
+
+    def mark_saved(self):
+        """mark the snapshot as written, returns the data to write"""
+        self.dirty = False
+        self.saved_at = time.time()
+        return self.to_dict()
+
+    @classmethod
+    def load(cls, path, serial=None):
+        """read a snapshot from file, returns None when absent, unreadable or for another device"""
+        try:
+            with open(path) as snapshot_file:
+                raw = json.load(snapshot_file)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(raw, dict) or raw.get('version') != SNAPSHOT_VERSION:
+            return None
+        if serial is not None and raw.get('serial') != serial:
+            return None
+        return cls.from_dict(raw)
+
+def write_snapshot(path, data):
+    """write snapshot data atomically to file"""
+    #a write of a worker may still run while the plugin thread writes on stop
+    tmp_path = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as snapshot_file:
+        json.dump(data, snapshot_file, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+def snapshot_path(home_folder, hardware_id):
+    """location of the snapshot file of a plugin instance"""
+    return os.path.join(home_folder, 'snapshot_{0}.json'.format(hardware_id))
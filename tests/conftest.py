@@ -0,0 +1,4 @@
+import os, sys
+
+#the plugin modules are top level modules of the plugin folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
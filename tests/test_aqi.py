@@ -0,0 +1,32 @@
+import pytest
+
+from aqi import (CAQI_HOURLY_GRID, PM10_AQI_BREAKPOINTS, PM25_AQI_BREAKPOINTS, aqi_from_concentration,
+                 caqi_from_concentration, nowcast)
+
+def test_nowcast():
+    #a weight factor below the minimum of 0.5 is raised to it
+    assert nowcast([40.0, 10.0]) == pytest.approx(30.0)
+    assert nowcast([12.0] * 12) == pytest.approx(12.0)
+    #two of the three newest hours are needed
+    assert nowcast([None, 30.0, None]) is None
+
+@pytest.mark.parametrize('concentration, breakpoints, decimals, expected', [
+    (35.4, PM25_AQI_BREAKPOINTS, 1, 100),
+    (9.0, PM25_AQI_BREAKPOINTS, 1, 50),
+    #truncated to 20.0 first
+    (20.04, PM25_AQI_BREAKPOINTS, 1, 71),
+    (154.9, PM10_AQI_BREAKPOINTS, 0, 100),
+    #above the scale
+    (800, PM10_AQI_BREAKPOINTS, 0, 500),
+])
+def test_us_aqi_breakpoints(concentration, breakpoints, decimals, expected):
+    assert aqi_from_concentration(concentration, breakpoints, decimals) == expected
+
+@pytest.mark.parametrize('concentration, pollutant, expected', [
+    (15, 'pm25', 25),
+    (60, 'pm10', 56),
+    #extrapolated above 100
+    (220, 'pm25', 150),
+])
+def test_caqi_grid(concentration, pollutant, expected):
+    assert caqi_from_concentration(concentration, CAQI_HOURLY_GRID[pollutant]) == expected
@@ -0,0 +1,80 @@
+import io, json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+import batch_decoder
+
+def sensors(time, **data):
+    return {'msg': 'ENVIRONMENTAL-CURRENT-SENSOR-DATA', 'time': time, 'data': data}
+
+def change(time, **fields):
+    return {'msg': 'STATE-CHANGE', 'time': time, 'product-state': fields}
+
+def current(time, **fields):
+    return {'msg': 'CURRENT-STATE', 'time': time, 'product-state': fields}
+
+def assert_columns(columns, expected):
+    assert sorted(columns) == sorted(expected)
+    for name in expected:
+        np.testing.assert_array_equal(columns[name], expected[name], err_msg=name)
+
+def test_scanned_lines_match_the_message_decoders():
+    messages = [sensors('2024-01-01T10:00:00.000Z', tact='2950', hact='0045', pm25='0012', pm10='0020', va10='INIT', sltm='OFF'),
+                change('2024-01-01T10:00:30.000Z', fnsp=['0004', 'AUTO'], filf=['4000', '3999'], hmax=['OFF', '2960'], ercd=['NONE', '02C0']),
+                sensors('2024-01-01T10:01:00.000Z', tact='OFF', hact='0044', vact='0003', pact='0001', sltm='0030'),
+                current('2024-01-01T10:01:30.000Z', fnsp='0007', hflr='0080', cflr='0060', wacd='NONE')]
+    lines = [json.dumps(messages[0]) + '\n', json.dumps(messages[1], separators=(',', ':')) + '\n',
+             json.dumps(messages[2], indent=None).replace(': ', ' :  ') + '\n', ' ' + json.dumps(messages[3]) + ' \n']
+    sensor_columns, state_columns = batch_decoder.decode_lines(lines)
+    assert_columns(sensor_columns, batch_decoder.decode_sensors([messages[0], messages[2]]))
+    assert_columns(state_columns, batch_decoder.decode_state([messages[1], messages[3]]))
+
+def test_unscannable_lines_are_decoded_with_json_in_archive_order():
+    messages = [sensors('2024-01-01T10:00:00.000Z', tact='2950', hact='0045'),
+                sensors('2024-01-01T10:00:30.000Z', tact='2951', hact='0046'),
+                change('2024-01-01T10:01:00.000Z', fnsp=['0004', '0005']),
+                sensors('2024-01-01T10:01:30.000Z', tact='2952', hact='0047'),
+                change('2024-01-01T10:02:00.000Z', fnsp=['0005', '0006'], ercd=['NONE', 'E"1'])]
+    text = '\n'.join([json.dumps(messages[0]),
+                      #a capture record, with the message under "message"
+                      json.dumps({'topic': '438/NN2/status/current', 'message': messages[1]}),
+                      json.dumps(messages[2]),
+                      #a number instead of a string, the json path reads it
+                      json.dumps(messages[3]).replace('"0047"', '47'),
+                      #an escaped quote
+                      json.dumps(messages[4]),
+                      #the last line of an archive that is still written
+                      json.dumps(messages[0])[:40]]) + '\n'
+    messages[3]['data']['hact'] = 47
+    sensor_columns, state_columns = batch_decoder.decode_archive(io.StringIO(text), chunk_size=4)
+    assert_columns(sensor_columns, batch_decoder.decode_sensors(messages[0:2] + messages[3:4]))
+    assert_columns(state_columns, batch_decoder.decode_state([messages[2], messages[4]]))
+    assert list(state_columns['error_code']) == ['', 'E"1']
+
+def test_other_messages_are_skipped():
+    lines = [json.dumps({'msg': 'HELLO', 'time': '2024-01-01T10:00:00.000Z'}) + '\n',
+             json.dumps(sensors('2024-01-01T10:00:30.000Z', tact='2950')) + '\n']
+    sensor_columns, state_columns = batch_decoder.decode_lines(lines)
+    assert state_columns == {}
+    assert list(sensor_columns['time']) == [np.datetime64('2024-01-01T10:00:30.000')]
+    assert sensor_columns['temperature'][0] == pytest.approx(21.85)
+
+def test_column_values_equal_the_per_message_classes():
+    from value_types import SensorsData, StateData
+    sensor_messages = [sensors('2024-01-01T10:00:00.000Z', tact='2950', hact='0045', sltm='OFF', pm25='0012', pm10='0020', va10='0003', noxl='0001'),
+                       sensors('2024-01-01T10:00:30.000Z', tact='INIT', hact='INV', sltm='0030', pact='OFF', vact='INIT'),
+                       sensors('2024-01-01T10:01:00.000Z', tact='OFF', hact='OFF', sltm='INIT', p25r='INV', p10r='0007')]
+    state_messages = [current('2024-01-01T10:00:00.000Z', fnsp='AUTO', hflr='0080', cflr='0061', hmax='2960', ercd='NONE', wacd='FLTR'),
+                      change('2024-01-01T10:00:30.000Z', fnsp=['AUTO', '0007'], hflr=['0080', 'INIT'], cflr=['0061', '0060'], hmax=['2960', 'OFF'],
+                             ercd=['NONE', '02C0'], wacd=['FLTR', 'NONE']),
+                      current('2024-01-01T10:01:00.000Z', fnsp='0010', filf='3999', hmax='2934', ercd='NONE', wacd='NONE')]
+    lines = [json.dumps(message) + '\n' for message in sensor_messages + state_messages]
+    for sensor_columns, state_columns in (batch_decoder.decode_lines(lines),
+                                          (batch_decoder.decode_sensors(sensor_messages), batch_decoder.decode_state(state_messages))):
+        for columns, decoded in ((sensor_columns, [SensorsData(message) for message in sensor_messages]),
+                                 (state_columns, [StateData(message) for message in state_messages])):
+            for row, message in enumerate(decoded):
+                expected = message.as_dict()
+                for field in set(columns) - {'time'}:
+                    assert batch_decoder.as_python(columns[field][row], field) == expected[field], (field, row)
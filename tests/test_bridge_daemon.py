@@ -0,0 +1,99 @@
+import asyncio, json
+
+import pytest
+
+import bridge_daemon
+from shard_runner import ShardDevice
+
+SERIAL = 'NN2-EU-ABC1234A'
+
+class FakeClient(object):
+    """MQTT client recording what is published"""
+
+    def __init__(self, *args, **kwargs):
+        self.connected_cb = kwargs.get('connected_cb')
+        self.publish_cb = kwargs.get('publish_cb')
+        self.is_connected = True
+        self.published = []
+        self.subscribed = []
+
+    def publish(self, topic, payload, retain=False):
+        self.published.append((topic, payload, retain))
+        return True
+
+    def subscribe(self, topics):
+        self.subscribed.extend(topics)
+        return True
+
+class FakeSession(object):
+
+    def __init__(self, description, emit):
+        self.device = ShardDevice(description['name'], description['serial'], description['product_type'], 'password')
+        self.emit = emit
+        self.client = FakeClient()
+
+@pytest.fixture
+def daemon():
+    devices = [{'name': 'Living room', 'serial': SERIAL, 'product_type': '438'}]
+    return bridge_daemon.BridgeDaemon(devices, broker_factory=FakeClient, session_factory=FakeSession)
+
+def sent_data(daemon):
+    """the product-state fields of the STATE-SET messages sent to the device"""
+    return [json.loads(payload)['data'] for _, payload, _ in daemon.sessions[SERIAL].client.published]
+
+def request(daemon, method, path, body=None, headers=()):
+    """(status, JSON response) of an HTTP request to the API of daemon"""
+    async def run():
+        server = await asyncio.start_server(daemon.handle_http, '127.0.0.1', 0)
+        try:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            data = json.dumps(body).encode() if body is not None else b''
+            lines = ['{0} {1} HTTP/1.0'.format(method, path), 'Content-Length: {0}'.format(len(data))] + list(headers)
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+            response = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+        head, _, payload = response.partition(b'\r\n\r\n')
+        return int(head.split()[1]), json.loads(payload)
+    return asyncio.run(run())
+
+def test_changes_are_republished_and_served(daemon):
+    daemon.on_changes(SERIAL, 'connection', {'connected': True})
+    daemon.on_changes(SERIAL, 'state', {'fan_speed': '0005'})
+    assert ('dyson/' + SERIAL + '/state/fan_speed', '"0005"', True) in daemon.broker.published
+    status, response = request(daemon, 'GET', '/devices/' + SERIAL)
+    assert status == 200
+    assert response == {'name': 'Living room', 'connected': True, 'state': {'fan_speed': '0005'}, 'sensors': {}}
+    assert request(daemon, 'GET', '/devices/unknown')[0] == 404
+
+def test_http_command_is_sent_as_one_state_set(daemon):
+    status, response = request(daemon, 'POST', '/devices/' + SERIAL + '/command', {'fan_speed': 5, 'oscillation': 'on'})
+    assert status == 202
+    assert sent_data(daemon) == [{'fnsp': '0005', 'oson': 'ON'}]
+    topic, _, _ = daemon.sessions[SERIAL].client.published[0]
+    assert topic == '438/' + SERIAL + '/command'
+
+def test_invalid_commands_are_refused(daemon):
+    assert request(daemon, 'POST', '/devices/' + SERIAL + '/command', {'fan_speed': 'fast'})[0] == 409
+    assert request(daemon, 'POST', '/devices/' + SERIAL + '/command', {'colour': 'red'})[0] == 409
+    daemon.sessions[SERIAL].client.is_connected = False
+    assert request(daemon, 'POST', '/devices/' + SERIAL + '/command', {'fan_speed': 5})[0] == 409
+    assert sent_data(daemon) == []
+
+def test_token_is_required_when_configured(daemon):
+    daemon.http_token = 'token-1'
+    assert request(daemon, 'GET', '/devices')[0] == 401
+    assert request(daemon, 'GET', '/devices', headers=['Authorization: Bearer wrong'])[0] == 401
+    assert request(daemon, 'GET', '/devices', headers=['Authorization: Bearer token-1'])[0] == 200
+
+def test_commands_from_the_local_broker(daemon):
+    daemon.on_broker_connected()
+    assert daemon.broker.subscribed == ['dyson/+/set/+']
+    daemon.broker.publish_cb('dyson/' + SERIAL + '/set/fan_speed', 7)
+    daemon.broker.publish_cb('dyson/' + SERIAL + '/set/fan_speed', 'auto')
+    daemon.broker.publish_cb('dyson/' + SERIAL + '/set/heat_target', 'hot')
+    assert sent_data(daemon) == [{'fnsp': '0007'}, {'fnsp': 'AUTO'}]
+
+def test_the_api_listens_on_localhost_by_default(daemon):
+    assert daemon.http_address == '127.0.0.1'
@@ -0,0 +1,59 @@
+from command_tracker import CommandTracker
+
+SERIAL = 'NN2-EU-ABC1234A'
+
+def test_change_of_the_field_confirms():
+    tracker = CommandTracker(deadline=10)
+    command = tracker.sent(SERIAL, {'fnsp': '0005'}, now=100.0, sent_at=1000.0)
+    assert tracker.state_changed(SERIAL, {'fnsp': ['0003', '0005']}, now=100.4) == [command]
+    assert tracker.pending(SERIAL) == []
+    assert tracker.stats(SERIAL)['confirmed'] == 1
+
+def test_repeated_value_from_before_the_command_does_not_confirm():
+    tracker = CommandTracker(deadline=10)
+    tracker.sent(SERIAL, {'fnsp': '0005'}, now=100.0, sent_at=1000.0)
+    #an unrelated change and a periodic echo of the value the device already had
+    assert tracker.state_changed(SERIAL, {'fnsp': ['0005', '0005'], 'oson': ['OFF', 'ON']}, now=100.2, device_time=999) == []
+    assert tracker.state_changed(SERIAL, {'fnsp': ['0005', '0005']}, now=100.3) == []
+    assert len(tracker.pending(SERIAL)) == 1
+
+def test_repeated_value_stamped_after_the_command_confirms():
+    tracker = CommandTracker(deadline=10)
+    command = tracker.sent(SERIAL, {'fnsp': '0005', 'oson': 'ON'}, now=100.0, sent_at=1000.0)
+    assert tracker.state_changed(SERIAL, {'fnsp': ['0003', '0005'], 'oson': ['ON', 'ON']}, now=100.5, device_time=1001) == [command]
+
+def test_other_value_does_not_confirm_and_expires():
+    tracker = CommandTracker(deadline=10)
+    command = tracker.sent(SERIAL, {'fnsp': '0005'}, now=100.0, sent_at=1000.0)
+    assert tracker.state_changed(SERIAL, {'fnsp': ['0003', '0004']}, now=100.5, device_time=1001) == []
+    assert tracker.expire(now=109.0) == []
+    assert tracker.expire(now=110.0) == [command]
+    assert tracker.stats(SERIAL)['unconfirmed'] == 1
+
+def test_latency_percentiles():
+    tracker = CommandTracker(deadline=10)
+    for latency in (0.05, 0.2, 0.3, 4.0):
+        tracker.sent(SERIAL, {'fnsp': '0005'}, now=0.0, sent_at=0.0)
+        tracker.state_changed(SERIAL, {'fnsp': ['0004', '0005']}, now=latency)
+    stats = tracker.stats(SERIAL)
+    assert stats['count'] == 4
+    assert stats['p50'] == 0.25
+    assert stats['max'] == 4.0
+
+def test_repeated_press_is_sent_even_when_the_device_has_the_value(monkeypatch):
+    import plugin
+    from command_filter import CommandFilter
+    from shard_runner import ShardDevice
+    from snapshot import DeviceSnapshot
+    dyson = plugin.DysonPureLinkPlugin()
+    dyson.myDevice = ShardDevice('fan', SERIAL, '438', 'password')
+    dyson.commandTracker = CommandTracker(deadline=10)
+    dyson.commandFilter = CommandFilter(max_age=300)
+    dyson.snapshot = DeviceSnapshot(SERIAL, '438')
+    dyson.snapshot.merge_state({'fnsp': '0004', 'oson': 'ON', 'fpwr': 'ON'})
+    published = []
+    monkeypatch.setattr(dyson, 'mqttClient', type('Client', (), {'Publish': lambda self, topic, payload: published.append(payload)})(), raising=False)
+    dyson.handleCommand(dyson.fanOscillationUnit, 'On', 0, None)
+    assert published == []
+    dyson.handleCommand(dyson.fanOscillationUnit, 'On', 0, None)
+    assert len(published) == 1 and '"oson": "ON"' in published[0]
@@ -0,0 +1,56 @@
+import asyncio, json, struct
+
+from discovery import DysonDiscovery
+from mqtt_async import CONNACK, CONNECT, PUBLISH, SUBACK, SUBSCRIBE, _packet, parse_publish, publish_packet, read_packet
+
+SERIAL = 'NN2-EU-ABC1234A'
+PASSWORD = 'secret'
+
+def credentials(body):
+    """username and password of a CONNECT body"""
+    position = 2 + struct.unpack('!H', body[:2])[0] + 4
+    fields = []
+    while position < len(body):
+        length = struct.unpack('!H', body[position:position + 2])[0]
+        fields.append(body[position + 2:position + 2 + length].decode())
+        position += 2 + length
+    return fields[1], fields[2]
+
+def server(device):
+    """MQTT server answering like a Dyson device, or like an open broker when device is False"""
+    async def handle(reader, writer):
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header & 0xF0
+                if kind == CONNECT:
+                    accepted = not device or credentials(body) == (SERIAL, PASSWORD)
+                    writer.write(_packet(CONNACK, bytes([0, 0 if accepted else 5])))
+                elif kind == SUBSCRIBE & 0xF0:
+                    writer.write(_packet(SUBACK, body[:2] + b'\x00'))
+                elif kind == PUBLISH and device:
+                    topic, payload, _ = parse_publish(header, body)
+                    if topic == '438/' + SERIAL + '/command' and json.loads(payload)['msg'] == 'REQUEST-CURRENT-STATE':
+                        writer.write(publish_packet('438/' + SERIAL + '/status/current', json.dumps({'msg': 'CURRENT-STATE'})))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+    return handle
+
+def scan(device):
+    async def run():
+        broker = await asyncio.start_server(server(device), '127.0.0.1', 0)
+        port = str(broker.sockets[0].getsockname()[1])
+        try:
+            return await DysonDiscovery(ports=(port,), timeout=0.5).scan('127.0.0.1/32', {SERIAL: (PASSWORD, '438')}), port
+        finally:
+            broker.close()
+    return asyncio.run(run())
+
+def test_the_device_is_found():
+    found, port = scan(device=True)
+    assert found == {SERIAL: ('127.0.0.1', port)}
+
+def test_an_open_broker_is_not_taken_for_the_device():
+    found, _ = scan(device=False)
+    assert found == {}
@@ -0,0 +1,98 @@
+import pytest
+
+import dyson_pure_link_device
+from dyson_360_eye import Dyson360Eye, TrackBuffer
+
+@pytest.fixture(autouse=True)
+def plain_password(monkeypatch):
+    #the message handling does not need the decrypted credential
+    monkeypatch.setattr(dyson_pure_link_device, 'decrypt_password', lambda password: password)
+
+def robot():
+    return Dyson360Eye('password', 'EYE-SERIAL', 'N223', 'robot')
+
+def state(msg, **fields):
+    key = 'state' if msg == 'CURRENT-STATE' else 'newstate'
+    message = {'msg': msg, key: fields.pop('state')}
+    message.update(fields)
+    return message
+
+def test_partial_update_keeps_the_clean_type():
+    eye = robot()
+    eye.update(state('CURRENT-STATE', state='FULL_CLEAN_RUNNING', fullCleanType='immediate', cleanId='c1',
+                     batteryChargeLevel=90, currentVacuumPowerMode='fullPower'), now=1000)
+    #battery and position only
+    eye.update(state('STATE-CHANGE', state='FULL_CLEAN_RUNNING', batteryChargeLevel=85), now=1010)
+    eye.update(state('STATE-CHANGE', state='FULL_CLEAN_RUNNING', globalPosition=[10, 20]), now=1020)
+    assert eye.clean_type == 'immediate'
+    assert eye.battery_level == 85
+    assert eye.power_mode == 'fullPower'
+    assert eye.clean_id == 'c1'
+    assert eye.position == (10, 20)
+
+def test_empty_clean_type_clears_it():
+    eye = robot()
+    eye.update(state('CURRENT-STATE', state='FULL_CLEAN_RUNNING', fullCleanType='immediate'), now=1000)
+    eye.update(state('STATE-CHANGE', state='INACTIVE_CHARGING', fullCleanType=''), now=1010)
+    assert eye.clean_type is None
+
+def test_clean_summary_after_partial_updates():
+    eye = robot()
+    eye.update(state('CURRENT-STATE', state='FULL_CLEAN_RUNNING', fullCleanType='immediate', cleanId='c1', batteryChargeLevel=90), now=1000)
+    eye.update({'msg': 'MAP-GLOBAL', 'x': 0, 'y': 0}, now=1001)
+    eye.update({'msg': 'MAP-GLOBAL', 'x': 300, 'y': 400}, now=1002)
+    eye.update(state('STATE-CHANGE', state='FULL_CLEAN_RUNNING', batteryChargeLevel=70), now=1100)
+    summary = eye.update(state('STATE-CHANGE', state='FULL_CLEAN_FINISHED', batteryChargeLevel=60), now=1200)
+    assert summary['type'] == 'immediate'
+    assert summary['duration'] == 200
+    assert summary['distance'] == 500
+    assert summary['battery_used'] == 30
+    assert eye.session is None
+
+def test_track_buffer_round_trip_with_large_steps():
+    track = TrackBuffer(max_points=100)
+    for point in [(0, 0, 0), (5, 40000, -1), (70000, 40000, 5), (70001, 40000, 5)]:
+        track.append(*point)
+    assert list(track.points())[-1] == (70000, 40000, 5)
+    assert track.distance == pytest.approx(40006, abs=0.01)
+
+class FakeUnit(object):
+
+    def __init__(self, name):
+        self.Name = name
+        self.nValue = 0
+        self.sValue = ''
+        self.BatteryLevel = 255
+
+    def Update(self, nValue, sValue, BatteryLevel=255):
+        self.nValue, self.sValue, self.BatteryLevel = nValue, sValue, BatteryLevel
+
+class FakeSnapshot(object):
+    dirty = False
+
+def test_plugin_handles_robot_messages_in_arrival_order(monkeypatch):
+    import plugin
+    units = dict((unit, FakeUnit(str(unit))) for unit in range(27, 32))
+    #Devices is provided by Domoticz
+    monkeypatch.setattr(plugin, 'Devices', units, raising=False)
+    dyson = plugin.DysonPureLinkPlugin()
+    dyson.myDevice = robot()
+    dyson.snapshot = FakeSnapshot()
+    #a long drain interval, every message would wait in the inbound stage
+    dyson.drainInterval = 3600
+    dyson.lastDrain = float('inf')
+    topic = dyson.myDevice.device_status
+    dyson.onMQTTPublish(topic, state('STATE-CHANGE', state='FULL_CLEAN_RUNNING', fullCleanType='immediate', cleanId='c1', batteryChargeLevel=90))
+    for x in range(20):
+        dyson.onMQTTPublish(topic, {'msg': 'MAP-GLOBAL', 'x': x * 100, 'y': 0})
+    dyson.onMQTTPublish(topic, state('STATE-CHANGE', state='FULL_CLEAN_RUNNING', batteryChargeLevel=80))
+    dyson.onMQTTPublish(topic, state('STATE-CHANGE', state='FULL_CLEAN_FINISHED', batteryChargeLevel=70))
+    dyson.onMQTTPublish(topic, state('CURRENT-STATE', state='INACTIVE_CHARGING', batteryChargeLevel=70))
+    assert len(dyson.inbound) == 0
+    summary = dyson.myDevice.sessions[-1]
+    assert summary['type'] == 'immediate'
+    assert summary['state'] == 'FULL_CLEAN_FINISHED'
+    assert summary['distance'] == 1900
+    assert summary['battery_used'] == 20
+    assert dyson.snapshot.dirty
+    assert units[dyson.vacuumStateUnit].sValue == 'Inactive charging'
@@ -0,0 +1,81 @@
+from inbound import InboundStage
+
+TOPIC = '438/NN2-EU-ABC1234A/status/current'
+
+def change(time, **fields):
+    return {'msg': 'STATE-CHANGE', 'time': time, 'product-state': fields}
+
+def current(time, **fields):
+    return {'msg': 'CURRENT-STATE', 'time': time, 'product-state': fields}
+
+def drain(stage):
+    messages, _ = stage.drain(now=0)
+    return [message for _, message, _ in messages]
+
+def test_changes_merge_to_first_old_and_last_new():
+    stage = InboundStage()
+    stage.put(TOPIC, change('T1', fnsp=['0003', '0004'], oson=['OFF', 'ON']), now=0)
+    stage.put(TOPIC, change('T2', fnsp=['0004', '0007']), now=0)
+    assert drain(stage) == [change('T2', fnsp=['0003', '0007'], oson=['OFF', 'ON'])]
+    assert stage.collapsed == 1
+
+def test_current_state_is_not_turned_into_pairs():
+    stage = InboundStage()
+    stage.put(TOPIC, current('T1', fnsp='0004', oson='ON'), now=0)
+    stage.put(TOPIC, change('T2', fnsp=['0004', '0006']), now=0)
+    #the reported values first, the newer change after them
+    assert drain(stage) == [current('T1', fnsp='0004', oson='ON'), change('T2', fnsp=['0004', '0006'])]
+
+def test_current_state_supersedes_the_changes_of_its_fields():
+    stage = InboundStage()
+    stage.put(TOPIC, change('T1', fnsp=['0003', '0004'], hmax=['2950', '2960']), now=0)
+    stage.put(TOPIC, current('T2', fnsp='0005', oson='ON'), now=0)
+    assert drain(stage) == [current('T2', fnsp='0005', oson='ON'), change('T1', hmax=['2950', '2960'])]
+    stage.put(TOPIC, change('T3', fnsp=['0003', '0004']), now=0)
+    stage.put(TOPIC, current('T4', fnsp='0004'), now=0)
+    assert drain(stage) == [current('T4', fnsp='0004')]
+
+def test_current_states_replace_each_other():
+    stage = InboundStage()
+    stage.put(TOPIC, current('T1', fnsp='0004'), now=0)
+    stage.put(TOPIC, current('T2', fnsp='0005'), now=0)
+    assert drain(stage) == [current('T2', fnsp='0005')]
+
+def test_late_sensor_reading_does_not_replace_a_newer_one():
+    stage = InboundStage()
+    newer = {'msg': 'ENVIRONMENTAL-CURRENT-SENSOR-DATA', 'time': '2024-01-01T10:00:30.000Z', 'data': {}}
+    older = {'msg': 'ENVIRONMENTAL-CURRENT-SENSOR-DATA', 'time': '2024-01-01T10:00:00.000Z', 'data': {}}
+    stage.put(TOPIC, newer, now=0)
+    stage.put(TOPIC, older, now=0)
+    assert drain(stage) == [older, newer]
+
+def test_messages_keep_their_trace():
+    stage = InboundStage()
+    stage.put(TOPIC, change('T1', fnsp=['0003', '0004']), now=0, trace='first')
+    stage.put(TOPIC, change('T2', fnsp=['0004', '0005']), now=0, trace='second')
+    stage.put('other', {'msg': 'HELLO'}, now=0, trace='hello')
+    messages, _ = stage.drain(now=0)
+    #the merged change waited since the first one
+    assert [(topic, trace) for topic, _, trace in messages] == [(TOPIC, 'first'), ('other', 'hello')]
+
+def test_plugin_decodes_a_partial_change_with_the_snapshot(monkeypatch):
+    import plugin
+    from snapshot import DeviceSnapshot
+    dyson = plugin.DysonPureLinkPlugin()
+    dyson.base_topic = '438/NN2-EU-ABC1234A'
+    dyson.snapshot = DeviceSnapshot('NN2-EU-ABC1234A', '438')
+    monkeypatch.setattr(dyson, 'refreshDevices', lambda: None)
+    monkeypatch.setattr(dyson, 'updateFilterForecast', lambda timestamp: None)
+    stage = InboundStage()
+    stage.put(TOPIC, current('T1', fnsp='0004', oson='ON', ercd='NONE', wacd='NONE'), now=0)
+    for topic, message, _ in stage.drain(now=0)[0]:
+        dyson.handleMessage(topic, message)
+    #a CURRENT-STATE leaves the stage with the part of the change it does not report
+    stage.put(TOPIC, change('T2', fnsp=['0004', '0006'], ercd=['NONE', 'NONE'], wacd=['NONE', 'NONE']), now=0)
+    stage.put(TOPIC, current('T3', ercd='NONE', wacd='NONE'), now=0)
+    for topic, message, _ in stage.drain(now=0)[0]:
+        dyson.handleMessage(topic, message)
+    dyson.metrics.render()
+    assert b'decode_errors' not in dyson.metrics.exposition()
+    assert dyson.state_data.fan_speed == '0006'
+    assert dyson.state_data.oscillation is not None
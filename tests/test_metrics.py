@@ -0,0 +1,14 @@
+from metrics import MetricsExporter
+
+def test_counter_family_is_named_like_its_samples():
+    metrics = MetricsExporter()
+    metrics.inc('commands_suppressed', labels={'serial': 'NN2'}, help='Commands not sent')
+    metrics.set('fan_speed', 4)
+    metrics.render()
+    assert metrics.exposition().decode().splitlines() == [
+        '# HELP dyson_commands_suppressed_total Commands not sent',
+        '# TYPE dyson_commands_suppressed_total counter',
+        'dyson_commands_suppressed_total{serial="NN2"} 1',
+        '# TYPE dyson_fan_speed gauge',
+        'dyson_fan_speed 4',
+    ]
@@ -0,0 +1,39 @@
+from readings import ReadingDedupe, message_time
+
+def test_message_time():
+    assert message_time({'time': '2024-01-01T10:00:30.000Z'}) == 1704103230
+    assert message_time({}, 5) == 5
+    assert message_time({'time': 'INVALID'}) is None
+
+def test_repeated_reading_is_merged_once():
+    readings = ReadingDedupe()
+    assert readings.merge(1000)
+    assert not readings.merge(1000)
+    assert readings.merge(990)
+    assert readings.latest == 1000
+    assert readings.duplicates == 1
+
+def test_readings_of_the_previous_run_are_ignored():
+    readings = ReadingDedupe()
+    readings.restore({'latest': 1000})
+    assert not readings.merge(1000)
+    assert not readings.merge(970)
+    assert readings.merge(1030)
+
+def test_large_jump_back_is_a_clock_reset():
+    readings = ReadingDedupe(clock_reset=900)
+    readings.restore({'latest': 1000000})
+    readings.merge(1000030)
+    #the device restarted with its clock back in time, its readings still count
+    assert readings.merge(5000)
+    assert readings.merge(5030)
+    assert not readings.merge(5030)
+    assert readings.clock_resets == 1
+    assert readings.latest == 5030
+
+def test_compact_forgets_old_readings():
+    readings = ReadingDedupe(max_age=100)
+    for timestamp in (0, 50, 120, 200):
+        readings.merge(timestamp)
+    assert readings.compact() == 2
+    assert len(readings) == 2
@@ -0,0 +1,43 @@
+import plugin
+from scheduler import TimerWheel
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.connecting = False
+
+    def Connecting(self):
+        return self.connecting
+
+class FakeDevice(object):
+    serial = 'NN2-EU-ABC1234A'
+
+def disconnected_plugin(monkeypatch):
+    dyson = plugin.DysonPureLinkPlugin()
+    dyson.myDevice = FakeDevice()
+    dyson.scheduler = TimerWheel(10)
+    opened = []
+    #Open would create a Domoticz connection
+    monkeypatch.setattr(plugin.MqttClient, 'Open', lambda client: opened.append(client))
+    dyson.mqttClient = plugin.MqttClient('192.168.1.2', '1883', 'test', None, None, None, None)
+    dyson.mqttClient.mqttConn = FakeConnection()
+    del opened[:]
+    return dyson, opened
+
+def test_no_reconnect_while_connecting(monkeypatch):
+    dyson, opened = disconnected_plugin(monkeypatch)
+    dyson.mqttClient.mqttConn.connecting = True
+    dyson.checkConnection()
+    assert dyson.reconnectJob is None
+
+def test_reconnect_skipped_when_an_attempt_started_meanwhile(monkeypatch):
+    dyson, opened = disconnected_plugin(monkeypatch)
+    dyson.checkConnection()
+    assert dyson.reconnectJob is not None
+    dyson.mqttClient.mqttConn.connecting = True
+    dyson.reconnect()
+    assert opened == []
+    dyson.mqttClient.mqttConn.connecting = False
+    dyson.reconnect()
+    assert opened == [dyson.mqttClient]
+    assert dyson.reconnectBackoff == 2 * plugin.DysonPureLinkPlugin.reconnectDelay
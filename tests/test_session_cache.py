@@ -0,0 +1,43 @@
+import sys, types
+
+import pytest
+
+import session_cache
+from cloud.exceptions import DysonInvalidAuth
+
+class FakeAccount(object):
+    """DysonAccount logging like the real one, a token is refused"""
+
+    def __init__(self, auth_info=None, log=None):
+        self.log = [] if log is None else log
+
+    def devices(self):
+        self.log.append(('debug', "building request: method GET"))
+        self.log.append(('error', "Dyson request failed: '401, Unauthorized'"))
+        raise DysonInvalidAuth
+
+    def login_email_otp(self, email, region):
+        self.log.append(('debug', "building request: method POST"))
+        return 'challenge-1'
+
+@pytest.fixture
+def fake_account(monkeypatch):
+    module = types.ModuleType('cloud.account')
+    module.DysonAccount = FakeAccount
+    monkeypatch.setitem(sys.modules, 'cloud.account', module)
+
+def test_log_lines_are_returned_for_the_plugin_thread(tmp_path, fake_account):
+    cache = session_cache.SessionCache(str(tmp_path))
+    devices, challenge_id, log = session_cache.fetch_devices(cache, 'user@example.com', 'secret', now=1000)
+    assert (devices, challenge_id) == (None, 'challenge-1')
+    assert log == [('debug', "building request: method POST")]
+
+def test_log_lines_travel_with_the_error(tmp_path, fake_account):
+    cache = session_cache.SessionCache(str(tmp_path))
+    with cache.lock():
+        cache.save({'auth': {'token': 'expired'}})
+    with pytest.raises(DysonInvalidAuth) as error:
+        session_cache.fetch_devices(cache, 'user@example.com', 'secret', now=1000)
+    assert error.value.log[-1] == ('error', "Dyson request failed: '401, Unauthorized'")
+    #the refused token is forgotten
+    assert 'auth' not in cache.load()
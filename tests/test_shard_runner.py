@@ -0,0 +1,76 @@
+import asyncio, time
+
+import pytest
+
+import shard_runner
+from cloud.utils import credentials
+
+def devices(count):
+    return [{'name': 'fan{0}'.format(index), 'serial': 'SERIAL-{0:02d}'.format(index), 'credential': 'blob{0}'.format(index),
+             'product_type': '438', 'address': '127.0.0.1', 'port': '1883'} for index in range(count)]
+
+def test_load_devices_needs_an_address(capsys):
+    config = {'fan.serial': 'S1', 'fan.credential': 'blob', 'fan.product_type': '438', 'fan.address': '192.168.1.5',
+              'other.serial': 'S2', 'other.credential': 'blob2', 'other.product_type': '520'}
+    assert shard_runner.load_devices(config) == [{'name': 'fan', 'serial': 'S1', 'credential': 'blob', 'product_type': '438',
+                                                  'address': '192.168.1.5', 'port': '1883'}]
+    assert "'other.address'" in capsys.readouterr().err
+
+def test_devices_are_spread_round_robin_by_serial():
+    fleet = devices(7)
+    shards = shard_runner.shard_devices(list(reversed(fleet)), 3)
+    assert [[device['serial'] for device in shard] for shard in shards] == [
+        ['SERIAL-00', 'SERIAL-03', 'SERIAL-06'], ['SERIAL-01', 'SERIAL-04'], ['SERIAL-02', 'SERIAL-05']]
+    #no more shards than devices, and at least one
+    assert len(shard_runner.shard_devices(fleet[:2], 8)) == 2
+    assert shard_runner.shard_devices([], 4) == [[]]
+
+def test_session_emits_only_changed_values():
+    emitted = []
+    description = dict(devices(1)[0], password='password')
+    session = shard_runner.DeviceSession(description, lambda serial, kind, changes: emitted.append((serial, kind, changes)))
+    topic = session.device.device_status
+    state = {'fnsp': '0004', 'oson': 'ON', 'ercd': 'NONE', 'wacd': 'NONE'}
+    session.on_publish(topic, {'msg': 'CURRENT-STATE', 'product-state': state})
+    session.on_publish(topic, {'msg': 'CURRENT-STATE', 'product-state': state})
+    session.on_publish(topic, {'msg': 'STATE-CHANGE', 'product-state': {'fnsp': ['0004', '0006']}})
+    session.on_publish(topic, {'msg': 'STATE-CHANGE'})
+    assert [(kind, changes.get('fan_speed')) for _, kind, changes in emitted] == [('state', '0004'), ('state', '0006')]
+    assert session.decode_errors == 1
+
+def fake_worker(shard, connection, poll_interval):
+    """worker that reports every device of its shard once through the change channel and ends"""
+    async def run():
+        channel = shard_runner.ChangeChannel(connection, flush_interval=0.01)
+        for device in shard:
+            channel.emit(device['serial'], 'state', {'password': device['password']})
+        await asyncio.sleep(0.1)
+    asyncio.run(run())
+
+def idle_worker(shard, connection, poll_interval):
+    time.sleep(60)
+
+@pytest.fixture
+def decrypt(monkeypatch):
+    monkeypatch.setattr(credentials, 'decrypt_many', lambda blobs: {blob: 'pw-' + blob for blob in blobs})
+
+def test_change_sets_travel_from_the_workers_to_the_coordinator(monkeypatch, decrypt):
+    monkeypatch.setattr(shard_runner, 'worker_main', fake_worker)
+    received = []
+    coordinator = shard_runner.ShardCoordinator(devices(5), workers=2, on_changes=lambda *change: received.append(change))
+    coordinator.start()
+    #returns when every worker has ended and closed its pipe
+    coordinator.run()
+    coordinator.stop()
+    assert sorted(received) == [('SERIAL-{0:02d}'.format(index), 'state', {'password': 'pw-blob{0}'.format(index)}) for index in range(5)]
+    #one frame per worker, the changes of a shard are gathered
+    assert coordinator.frames == 2
+    assert coordinator.changes == 5
+
+def test_stop_ends_the_workers(monkeypatch, decrypt):
+    monkeypatch.setattr(shard_runner, 'worker_main', idle_worker)
+    coordinator = shard_runner.ShardCoordinator(devices(2), workers=2)
+    coordinator.start()
+    assert all(process.is_alive() for process in coordinator.processes)
+    coordinator.stop()
+    assert not any(process.is_alive() for process in coordinator.processes)
@@ -0,0 +1,27 @@
+import json, threading
+
+import plugin
+from executor import TaskExecutor
+from snapshot import DeviceSnapshot
+
+class FakeDevice(object):
+    serial = 'NN2-EU-ABC1234A'
+    product_type = '438'
+
+def test_stop_writes_the_snapshot_of_a_dropped_background_write(tmp_path):
+    dyson = plugin.DysonPureLinkPlugin()
+    dyson.myDevice = FakeDevice()
+    dyson.snapshot = DeviceSnapshot(FakeDevice.serial, FakeDevice.product_type)
+    dyson.snapshotFile = str(tmp_path / 'snapshot.json')
+    dyson.executor = TaskExecutor(workers=1)
+    #the worker is busy, the background write stays queued
+    release = threading.Event()
+    dyson.executor.submit(release.wait, 5)
+    dyson.snapshot.merge_state({'fnsp': '0004'})
+    dyson.saveSnapshot()
+    assert not dyson.snapshot.dirty
+    threading.Timer(0.2, release.set).start()
+    dyson.onStop()
+    with open(dyson.snapshotFile) as snapshot_file:
+        assert json.load(snapshot_file)['state'] == {'fnsp': '0004'}
+    assert [path.name for path in tmp_path.iterdir()] == ['snapshot.json']
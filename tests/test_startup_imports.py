@@ -0,0 +1,41 @@
+import json, os, subprocess, sys
+
+PLUGIN_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#the guard list of the startup benchmark
+sys.path.insert(0, os.path.join(PLUGIN_FOLDER, 'benchmarks'))
+from startup import HEAVY_MODULES
+
+PROBE = """
+import json, sys
+sys.path.insert(0, {folder!r})
+import plugin
+{code}
+print(json.dumps([name for name in {heavy!r} if name in sys.modules]))
+"""
+
+def loaded_after(code=''):
+    """heavy modules loaded by importing the plugin and running code, in a fresh interpreter"""
+    probe = PROBE.format(folder=PLUGIN_FOLDER, code=code, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, '-c', probe], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def test_plugin_import_loads_no_heavy_modules():
+    assert loaded_after() == []
+
+def test_metrics_off_does_not_load_the_http_server():
+    assert loaded_after("plugin.DysonPureLinkPlugin().startMetricsServer({'port': 0})") == []
+
+def test_cached_address_does_not_load_the_scanner():
+    code = "\n".join([
+        "from discovery_cache import DiscoveryCache",
+        "dyson = plugin.DysonPureLinkPlugin()",
+        "dyson.myDevice = type('Device', (), {'serial': 'SER'})()",
+        "dyson.ip_address, dyson.port_number = '192.168.1.2', '1883'",
+        "dyson.discoveryCache = DiscoveryCache()",
+        "dyson.discoveryCache.set('SER', '192.168.1.3', '1883')",
+        "dyson.moveDevice = lambda address, port: None",
+        "dyson.locateDevice()",
+        "assert 'discovery' not in sys.modules",
+    ])
+    assert loaded_after(code) == []
@@ -0,0 +1,64 @@
+import plugin
+from tracing import tracer
+
+TOPIC = '438/NN2-EU-ABC1234A/status/current'
+
+class FakeDevice(object):
+    serial = 'NN2-EU-ABC1234A'
+
+def queued_plugin(monkeypatch):
+    dyson = plugin.DysonPureLinkPlugin()
+    dyson.myDevice = FakeDevice()
+    dyson.base_topic = '438/NN2-EU-ABC1234A'
+    #every message waits in the inbound stage until drained
+    dyson.drainInterval = 3600
+    dyson.lastDrain = float('inf')
+    monkeypatch.setattr(dyson, 'confirmCommands', lambda message: None)
+    monkeypatch.setattr(dyson, 'updateHeartbeat', lambda: None)
+    monkeypatch.setattr(dyson, 'handleMessage', lambda topic, message: tracer.stamp('handled ' + message['time']))
+    return dyson
+
+def receive(dyson, message):
+    #as the MQTT client does around the publish callback
+    trace = tracer.start(TOPIC)
+    try:
+        dyson.onMQTTPublish(TOPIC, message)
+    finally:
+        tracer.finish(trace)
+
+def stages(trace):
+    return [stage for stage, _ in trace.stamps]
+
+def test_queued_messages_are_stamped_on_their_own_trace(monkeypatch):
+    tracer.configure(True)
+    tracer.clear()
+    try:
+        dyson = queued_plugin(monkeypatch)
+        receive(dyson, {'msg': 'CURRENT-STATE', 'time': 'T1', 'product-state': {}})
+        receive(dyson, {'msg': 'ENVIRONMENTAL-CURRENT-SENSOR-DATA', 'time': 'T2', 'data': {}})
+        #nothing is stored while the messages wait
+        assert len(tracer) == 0
+        #drained from the heartbeat, without a current trace
+        assert tracer.current is None
+        dyson.drainInbound()
+        assert tracer.current is None
+        traces = list(tracer._traces)
+        assert [stages(trace) for trace in traces] == [['start', 'queued', 'handled T1', 'end'],
+                                                       ['start', 'queued', 'handled T2', 'end']]
+    finally:
+        tracer.configure(False)
+        tracer.clear()
+
+def test_message_drained_at_once_is_stored_once(monkeypatch):
+    tracer.configure(True)
+    tracer.clear()
+    try:
+        dyson = queued_plugin(monkeypatch)
+        dyson.drainInterval = 0
+        dyson.lastDrain = 0
+        receive(dyson, {'msg': 'CURRENT-STATE', 'time': 'T1', 'product-state': {}})
+        assert [stages(trace) for trace in tracer._traces] == [['start', 'queued', 'handled T1', 'end']]
+        assert tracer.current is None
+    finally:
+        tracer.configure(False)
+        tracer.clear()
@@ -0,0 +1,54 @@
+"""Write throttling of noisy sensor units
+
+Every environmental message would update the temperature, humidity, VOC, PM
+and NO2 units, and each update is a database write and a history row in
+Domoticz. A unit is only written when one of its values moved at least the
+deadband of its kind since the last write, and not more often than
+min_interval. After max_interval the unit is written anyway, so Domoticz does
+not mark the sensor as timed out.
+"""
+
+#results of WriteThrottle.check
+SKIP, WRITE, REFRESH = 0, 1, 2
+
+class WriteThrottle(object):
+    """Deadband and interval limits per value kind, e.g. {'temperature': {'deadband': 0.2, 'max_interval': 900}}"""
+
+    def __init__(self, limits):
+        self.limits = limits
+        #unit: (time of the last write, values written)
+        self._written = {}
+        self.skipped = 0
+        self.written = 0
+
+    def reset(self):
+        """forget the previous writes, the next values are written in any case"""
+        self._written.clear()
+
+    def _limit(self, kind, key, default):
+        return self.limits.get(kind, {}).get(key, default)
+
+    def _moved(self, kind, value, last_value):
+        if last_value is None:
+            return True
+        return value != last_value and abs(value - last_value) >= self._limit(kind, 'deadband', 0)
+
+    def check(self, unit, values, now):
+        """SKIP, WRITE or REFRESH (nothing moved, but the write is due) for values, a list of (kind, value)"""
+        result = WRITE
+        last = self._written.get(unit)
+        if last is not None:
+            last_time, last_values = last
+            elapsed = now - last_time
+            kinds = [kind for kind, _ in values]
+            if elapsed < min(self._limit(kind, 'min_interval', 0) for kind in kinds):
+                self.skipped += 1
+                return SKIP
+            if not any(self._moved(kind, value, last_values.get(kind)) for kind, value in values):
+                if elapsed < min(self._limit(kind, 'max_interval', 3600) for kind in kinds):
+                    self.skipped += 1
+                    return SKIP
+                result = REFRESH
+        self._written[unit] = (now, dict(values))
+        self.written += 1
+        return result
@@ -0,0 +1,122 @@
+"""Lifecycle tracing of messages and commands
+
+A trace follows one inbound message (MQTT receive, JSON decode, value
+decode, device updates) or one outbound command (onCommand to Publish).
+Stages are stamped on the trace that is current on the plugin thread, so the
+code in between does not have to pass it around. A message that waits in the
+inbound stage takes its trace along (hold), the trace is made current again
+when the message is handled (resume) and finished after it. Finished traces
+go to a ring buffer and are only formatted when dumped as Chrome trace JSON
+(open it in chrome://tracing or https://ui.perfetto.dev).
+
+When tracing is disabled start() returns None and stamp() returns at once.
+"""
+
+import collections, json, os, threading, time
+
+#thread id of the categories in the trace viewer
+CATEGORIES = {'inbound': 1, 'outbound': 2}
+
+class Trace(object):
+    __slots__ = ('name', 'category', 'stamps', 'parent')
+
+    def __init__(self, name, category, parent):
+        self.name = name
+        self.category = category
+        self.parent = parent
+        self.stamps = [('start', time.perf_counter())]
+
+class Tracer(object):
+    """Ring buffer of finished traces"""
+
+    def __init__(self, size=1024):
+        self.enabled = False
+        self.current = None
+        self.dropped = 0
+        self._traces = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def configure(self, enabled, size=None):
+        self.enabled = bool(enabled)
+        if size is not None and size != self._traces.maxlen:
+            with self._lock:
+                self._traces = collections.deque(self._traces, maxlen=size)
+
+    def start(self, name, category='inbound'):
+        """start a trace and make it current, returns None when tracing is disabled"""
+        if not self.enabled:
+            return None
+        self.current = Trace(name, category, self.current)
+        return self.current
+
+    def stamp(self, stage):
+        """mark the end of a stage of the current trace"""
+        trace = self.current
+        if trace is not None:
+            trace.stamps.append((stage, time.perf_counter()))
+
+    def hold(self):
+        """take the current trace out of the plugin thread to be resumed later, returns it"""
+        trace = self.current
+        if trace is not None:
+            self.current = trace.parent
+            trace.parent = None
+        return trace
+
+    def resume(self, trace):
+        """make a held trace current again, finish() stores it"""
+        if trace is not None:
+            trace.parent = self.current
+            self.current = trace
+        return trace
+
+    def finish(self, trace):
+        """store a trace started with start(), the trace it interrupted becomes current again
+
+        a trace that is held is not current, it is stored when finished after resume()"""
+        if trace is None or trace is not self.current:
+            return
+        trace.stamps.append(('end', time.perf_counter()))
+        self.current = trace.parent
+        trace.parent = None
+        with self._lock:
+            if len(self._traces) == self._traces.maxlen:
+                self.dropped += 1
+            self._traces.append(trace)
+
+    def __len__(self):
+        return len(self._traces)
+
+    def chrome_trace(self):
+        """the buffered traces as Chrome trace event format"""
+        with self._lock:
+            traces = list(self._traces)
+        events = []
+        for trace in traces:
+            tid = CATEGORIES.get(trace.category, 3)
+            start, end = trace.stamps[0][1], trace.stamps[-1][1]
+            events.append({'name': trace.name, 'cat': trace.category, 'ph': 'X', 'pid': 1, 'tid': tid,
+                           'ts': start * 1e6, 'dur': (end - start) * 1e6})
+            #every stage lasts from the previous stamp to its own
+            for (_, previous), (stage, stamp) in zip(trace.stamps, trace.stamps[1:-1]):
+                events.append({'name': stage, 'cat': trace.category, 'ph': 'X', 'pid': 1, 'tid': tid,
+                               'ts': previous * 1e6, 'dur': (stamp - previous) * 1e6})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'dropped': self.dropped}}
+
+    def dump(self, path=None):
+        """the Chrome trace as JSON bytes, also written to path when given"""
+        data = json.dumps(self.chrome_trace()).encode()
+        if path is not None:
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as trace_file:
+                trace_file.write(data)
+            os.replace(tmp_path, path)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+            self.dropped = 0
+
+#the tracer of the plugin, shared by the MQTT client and the plugin
+tracer = Tracer()
@@ -123,6 +123,9 @@ class SensorsData(object):
     particulate_matter_10 = None
     nitrogenDioxideDensity = None
     heat_target = None
+    sleep_timer = None
+    FIELDS = ['temperature', 'humidity', 'volatile_compounds', 'particles', 'particles2_5', 'particles10',
+              'particulate_matter_25', 'particulate_matter_10', 'nitrogenDioxideDensity', 'sleep_timer']
     
     def __init__(self, message):
         data = message['data']
@@ -169,6 +172,10 @@ class SensorsData(object):
     def has_data(self):
         return self.temperature is not None or self.humidity is not None
 
+    def as_dict(self):
+        """Return the decoded values as plain dictionary"""
+        return {field: getattr(self, field) for field in self.FIELDS}
+
     @staticmethod
     def is_sensors_data(message):
         return message['msg'] in ['ENVIRONMENTAL-CURRENT-SENSOR-DATA']
@@ -194,6 +201,9 @@ class StateData(object):
     night_mode_speed = None
     oscillation_angle_low = None
     oscillation_angle_high = None
+    FIELDS = ['fan_mode', 'fan_mode_auto', 'fan_state', 'night_mode', 'oscillation', 'standby_monitoring', 'fan_speed',
+              'focus', 'filter_life', 'quality_target', 'error_code', 'warning_code', 'heat_mode', 'heat_state',
+              'heat_target', 'oscillation_status', 'night_mode_speed', 'oscillation_angle_low', 'oscillation_angle_high']
 
     def __init__(self, message):
         data = message['product-state']
@@ -251,6 +261,10 @@ class StateData(object):
     def has_data(self):
         return self.fan_speed is not None or self.fan_mode is not None
 
+    def as_dict(self):
+        """Return the decoded values as plain dictionary, enums as their state string"""
+        return {field: _plain_value(getattr(self, field)) for field in self.FIELDS}
+
     @staticmethod
     def _get_field_value(field):
         """Get field value"""
@@ -260,6 +274,16 @@ class StateData(object):
     def is_state_data(message):
         return message['msg'] in ['CURRENT-STATE', 'STATE-CHANGE']
 
+def _plain_value(value):
+    """Value of an enum type (FanMode, HeatMode, ...) as string, other values unchanged"""
+    return value._state if isinstance(value, (FanMode, QualityTarget, HeatMode)) else value
+
+def changed_fields(old, new):
+    """Return the fields of the dictionary new with a different value in old"""
+    if old is None:
+        return dict(new)
+    return {field: value for field, value in new.items() if old.get(field) != value}
+
 def kelvin_to_fahrenheit (kelvin_value):
     return kelvin_value * 9 / 5 - 459.67
 